@@ -0,0 +1,37 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script builds the query-ready traffic density store (utils.density_store) from the estimate_traffic_density output and the
+census block geometry: blocks sorted by GEOID20 for binary-search lookups, memory-mappable density columns and a packed Hilbert R-tree
+for bbox and point queries.
+
+<LICENSE>
+"""
+import argparse
+import pandas as pd
+import pyogrio
+from pathlib import Path
+from utils.density_store import DensityStore
+
+parser = argparse.ArgumentParser(description="Build the traffic density store")
+parser.add_argument('--density', type=Path, default=None, help='A traffic density Parquet file (e.g. incremental/traffic_density.parquet) instead of the traffic_density layer')
+
+def main():
+    args = parser.parse_args()
+
+    TD_DIR = Path('../data/processed_data/Traffic_Density')
+    TD_GDB = TD_DIR / 'Traffic_Density.gdb'
+
+    print('Loading traffic density and census blocks...', flush=True)
+    if args.density is not None:
+        density = pd.read_parquet(args.density)
+    else:
+        density = pyogrio.read_dataframe(TD_GDB, layer='traffic_density', read_geometry=False)
+    blocks = pyogrio.read_dataframe(TD_GDB, layer='US_census_block_2020', columns=['GEOID20'], use_arrow=True)
+
+    store = DensityStore.build(density, blocks, TD_DIR / 'density_store')
+    print(f'Wrote the density store of {store.keys.size} blocks to:\n{store.path}', flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script builds the VKT / VMT rollup cube (utils.rollup) by GEOID level x F_SYSTEM x URBAN in one pass. By default it reads the
+imputed road links (county and state levels); with --pairs it reads the block-exact block-link pairs written by
+compile_traffic_density_tiled.py --distance 0 --rollup to density_rollup/ (block, tract, county and state levels); pairs of another distance or
+without the rollup fields are refused.
+
+<LICENSE>
+"""
+import argparse
+from pathlib import Path
+from utils.rollup import build_cube
+
+parser = argparse.ArgumentParser(description="Build the VKT / VMT rollup cube")
+parser.add_argument('--pairs', type=Path, nargs='?', default=None, const=Path('../data/processed_data/Traffic_Density/density_rollup'),
+                    help='Directory of block-exact block-link pair tiles (default density_rollup)')
+
+def main():
+    args = parser.parse_args()
+
+    HPMS_DIR = Path('../data/processed_data/HPMS')
+    TD_DIR = Path('../data/processed_data/Traffic_Density')
+
+    if args.pairs is not None:
+        cube = build_cube(args.pairs, TD_DIR / 'rollup_cube')
+    else:
+        cube = build_cube(HPMS_DIR / 'hpms_aadt_imputation.parquet', HPMS_DIR / 'rollup_cube')
+    print(cube.query('state', by=['GEOID']).head(), flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@ Summary: This script
 1) Creates two file geodatabases for storing processed data,
 2) Compiles the raw data into two file geodatabases for analysis, 
 3) Cleans and merges the HPMS network, intersects HPMS links with US county census boundaries, and adds rural-urban codes to road links in the network.
+With --reduce the links, counties and urban areas are snapped and simplified (utils/geometry.py) before the two overlays, which then read the
+<layer>_reduced layers.
 
 <LICENSE>
 """
@@ -13,9 +15,12 @@ Summary: This script
 
 import os
 import sys
+import argparse
 from pathlib import Path
 import tqdm
 from utils.utils import get_state_fips
+from utils.geometry import reduce_gdb_layer, GRID_SIZE, TOLERANCE, REDUCED_SUFFIX
+from utils.telemetry import instrument, print_summary
 
 try:
     import arcpy
@@ -27,9 +32,20 @@ except:
     sys.exit(1)
 
 
+parser = argparse.ArgumentParser(description="Compile the raw HPMS and census data")
+parser.add_argument('--reduce', action='store_true', help='Snap and simplify the links, counties and urban areas before the county intersection and urban area join')
+parser.add_argument('--grid-size', type=float, default=GRID_SIZE, help='Grid size of the coordinates in meters with --reduce (0 keeps full precision)')
+parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='Simplification tolerance in meters with --reduce (0 skips the simplification)')
+
+# The inputs of the county intersection and the urban area join
+OVERLAY_LAYERS = ["HPMS_2018_state_sub_proj", "US_census_county_2020", "US_census_uac_2010"]
+
+
 class HPMSDataPreparation:
     def __init__(self, storage_dir: Path):
         self.storage_dir = storage_dir
+        # Suffix of the overlay input layers, _reduced after reduce_overlay_inputs
+        self.layer_suffix = ""
         if not storage_dir.exists():
             storage_dir.mkdir(parents=True)
         self.hpms_dir = storage_dir / "HPMS"
@@ -58,6 +74,7 @@ class HPMSDataPreparation:
             f"Created file geodatabase for Traffic Density data: {Traffic_Density_gdb}"
         )
 
+    @instrument("load_hpms")
     def copy_raw_hpms(self, hpms_raw_gdb: Path):
         """
         Summary: Copy raw HPMS data to HPMS file geodatabase in processed data dir using ArcPy
@@ -83,6 +100,7 @@ class HPMSDataPreparation:
             f"{hpms_raw_gdb}\\{self.fc_456}", f"{self.hpms_gdb}\\{self.fc_456}"
         )
 
+    @instrument("load_counties")
     def copy_raw_census_counties(self, census_shp: Path):
         """
         Summary: Copy raw Census data to HPMS file geodatabase in processed data dir using ArcPy
@@ -101,6 +119,7 @@ class HPMSDataPreparation:
             in_features, out_features, where_clause, use_field_alias_as_name
         )
 
+    @instrument("load_urban_areas")
     def copy_raw_census_urban(self, urban_areas_shp: Path):
         """
         Summary: Copy raw Census urban area data to HPMS file geodatabase in processed data dir using ArcPy
@@ -121,6 +140,7 @@ class HPMSDataPreparation:
             in_features, out_features, where_clause, use_field_alias_as_name
         )
 
+    @instrument("load_blocks")
     def copy_raw_census_blocks(
         self,
         blocks_dir: Path,
@@ -150,6 +170,7 @@ class HPMSDataPreparation:
                 in_features, out_features, where_clause, use_field_alias_as_name
             )
 
+    @instrument("merge")
     def merge_hpms_data(self):
         """
         Summmary: Merge the HPMS data from the two feature classes into a single feature class
@@ -167,6 +188,7 @@ class HPMSDataPreparation:
         add_source = "NO_SOURCE_INFO"
         arcpy.management.Merge(input, self.fc_123456, field_mappings, add_source)
 
+    @instrument("repair")
     def repair_hpms_geometry(self):
         """
         Summary: Repair geometry of HPMS road network
@@ -195,6 +217,7 @@ class HPMSDataPreparation:
         validation_method = "ESRI"
         arcpy.management.RepairGeometry(in_features, delete_null, validation_method)
 
+    @instrument("subset_states")
     def subset_hpms_geometry(self):
         """
         Summary: Subset geometry to 50 states and Washington DC
@@ -222,6 +245,19 @@ class HPMSDataPreparation:
         out_feature_class = "HPMS_2018_state_sub_proj"
         arcpy.management.CopyFeatures(in_features, out_feature_class)
 
+    def reduce_overlay_inputs(self, grid_size: float = GRID_SIZE, tolerance: float = TOLERANCE):
+        """
+        Summary: Snap and simplify the overlay inputs (written as <layer>_reduced) and overlay those from here on
+        Inputs:
+            - grid_size (float): Grid size of the coordinates in meters
+            - tolerance (float): Simplification tolerance in meters
+        """
+        print("Reducing the geometry of the overlay inputs...")
+        for layer in OVERLAY_LAYERS:
+            reduce_gdb_layer(Path(self.hpms_gdb), layer, grid_size, tolerance)
+        self.layer_suffix = REDUCED_SUFFIX
+
+    @instrument("intersect")
     def intersect_hpms_county(self):
         """
         Summary: Intersect HPMS road network with US county boundaries
@@ -233,7 +269,7 @@ class HPMSDataPreparation:
 
         print("Intersecting HPMS road network with US county boundaries...")
 
-        in_features = "HPMS_2018_state_sub_proj;US_census_county_2020"
+        in_features = f"HPMS_2018_state_sub_proj{self.layer_suffix};US_census_county_2020{self.layer_suffix}"
         out_feature_class = "HPMS_2018_county_intxn"
         join_attributes = "ALL"
         cluster_tolerance = None
@@ -246,6 +282,7 @@ class HPMSDataPreparation:
             output_type,
         )
 
+    @instrument("add_unique_id")
     def add_unique_id(self):
         """
         Summary: Generate new field with unique ID for road links
@@ -266,6 +303,7 @@ class HPMSDataPreparation:
             inFeatures, fieldName, expression, expression_type
         )
 
+    @instrument("uac_join")
     def correct_urban_codes(self):
         """
         Summary: Correct urban codes in HPMS data (including links with no urban code)
@@ -278,11 +316,17 @@ class HPMSDataPreparation:
         print("Correcting urban codes in HPMS data...")
 
         target_features = "HPMS_2018_county_intxn"
-        join_features = "US_census_uac_2010"
+        join_features = f"US_census_uac_2010{self.layer_suffix}"
         out_feature_class = "HPMS_2018_cnty_uac_join"
         join_operation = "JOIN_ONE_TO_ONE"
         join_type = "KEEP_ALL"
         field_mapping = 'FID_HPMS_2018_state_sub_proj "FID_HPMS_2018_state_sub_proj" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,FID_HPMS_2018_state_sub_proj,-1,-1;Year_Record "Year_Record" true true false 2 Short 0 0,First,#,HPMS_2018_county_intxn,Year_Record,-1,-1;State_Code "State_Code" true true false 2 Short 0 0,First,#,HPMS_2018_county_intxn,State_Code,-1,-1;Route_ID "Route_ID" true true false 2048 Text 0 0,First,#,HPMS_2018_county_intxn,Route_ID,0,2048;Begin_Point "Begin_Point" true true false 8 Double 0 0,First,#,HPMS_2018_county_intxn,Begin_Point,-1,-1;End_Point "End_Point" true true false 8 Double 0 0,First,#,HPMS_2018_county_intxn,End_Point,-1,-1;AADT "AADT" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,AADT,-1,-1;AADT_COMBINATION "AADT_COMBINATION" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,AADT_COMBINATION,-1,-1;AADT_SINGLE_UNIT "AADT_SINGLE_UNIT" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,AADT_SINGLE_UNIT,-1,-1;ACCESS_CONTROL_ "ACCESS_CONTROL_" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,ACCESS_CONTROL_,-1,-1;COUNTY_CODE "COUNTY_CODE" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,COUNTY_CODE,-1,-1;F_SYSTEM "F_SYSTEM" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,F_SYSTEM,-1,-1;FACILITY_TYPE "FACILITY_TYPE" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,FACILITY_TYPE,-1,-1;IRI "IRI" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,IRI,-1,-1;IRI_YEAR "IRI_YEAR" true true false 8 Date 0 0,First,#,HPMS_2018_county_intxn,IRI_YEAR,-1,-1;NHS "NHS" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,NHS,-1,-1;OWNERSHIP "OWNERSHIP" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,OWNERSHIP,-1,-1;PSR "PSR" true true false 8 Double 0 0,First,#,HPMS_2018_county_intxn,PSR,-1,-1;ROUTE_NUMBER "ROUTE_NUMBER" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,ROUTE_NUMBER,-1,-1;ROUTE_NAME "ROUTE_NAME" true true false 100 Text 0 0,First,#,HPMS_2018_county_intxn,ROUTE_NAME,0,100;ROUTE_QUALIFIER "ROUTE_QUALIFIER" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,ROUTE_QUALIFIER,-1,-1;ROUTE_SIGNING "ROUTE_SIGNING" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,ROUTE_SIGNING,-1,-1;SPEED_LIMIT "SPEED_LIMIT" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,SPEED_LIMIT,-1,-1;STRAHNET_TYPE "STRAHNET_TYPE" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,STRAHNET_TYPE,-1,-1;STRUCTURE_TYPE "STRUCTURE_TYPE" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,STRUCTURE_TYPE,-1,-1;SURFACE_TYPE "SURFACE_TYPE" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,SURFACE_TYPE,-1,-1;THROUGH_LANES "THROUGH_LANES" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,THROUGH_LANES,-1,-1;TOLL_CHARGED "TOLL_CHARGED" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,TOLL_CHARGED,-1,-1;TOLL_TYPE "TOLL_TYPE" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,TOLL_TYPE,-1,-1;TRUCK "TRUCK" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,TRUCK,-1,-1;URBAN_CODE "URBAN_CODE" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,URBAN_CODE,-1,-1;FID_US_census_county_2020 "FID_US_census_county_2020" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,FID_US_census_county_2020,-1,-1;STATEFP "STATEFP" true true false 2 Text 0 0,First,#,HPMS_2018_county_intxn,STATEFP,0,2;COUNTYFP "COUNTYFP" true true false 3 Text 0 0,First,#,HPMS_2018_county_intxn,COUNTYFP,0,3;COUNTYNS "COUNTYNS" true true false 8 Text 0 0,First,#,HPMS_2018_county_intxn,COUNTYNS,0,8;GEOID "GEOID" true true false 5 Text 0 0,First,#,HPMS_2018_county_intxn,GEOID,0,5;NAME "NAME" true true false 100 Text 0 0,First,#,HPMS_2018_county_intxn,NAME,0,100;NAMELSAD "NAMELSAD" true true false 100 Text 0 0,First,#,HPMS_2018_county_intxn,NAMELSAD,0,100;Shape_Length "Shape_Length" false true true 8 Double 0 0,First,#,HPMS_2018_county_intxn,Shape_Length,-1,-1;FID_Link_Cnty_Intxn "FID_Link_Cnty_Intxn" true true false 4 Long 0 0,First,#,HPMS_2018_county_intxn,FID_Link_Cnty_Intxn,-1,-1;UACE10 "UACE10" true true false 5 Text 0 0,First,#,US_census_uac_2010,UACE10,0,5;GEOID10 "GEOID10" true true false 5 Text 0 0,First,#,US_census_uac_2010,GEOID10,0,5;NAME10 "NAME10" true true false 100 Text 0 0,First,#,US_census_uac_2010,NAME10,0,100;NAMELSAD10 "NAMELSAD10" true true false 100 Text 0 0,First,#,US_census_uac_2010,NAMELSAD10,0,100;UATYP10 "UATYP10" true true false 1 Text 0 0,First,#,US_census_uac_2010,UATYP10,0,1;Shape_Length_1 "Shape_Length" false true true 8 Double 0 0,First,#,US_census_uac_2010,Shape_Length,-1,-1;Shape_Area "Shape_Area" false true true 8 Double 0 0,First,#,US_census_uac_2010,Shape_Area,-1,-1'
+        # The input FID fields and the join layer are named after the (reduced) overlay inputs; the output fields keep their names
+        for field in ["FID_HPMS_2018_state_sub_proj", "FID_US_census_county_2020"]:
+            field_mapping = field_mapping.replace(
+                f",HPMS_2018_county_intxn,{field},", f",HPMS_2018_county_intxn,{field}{self.layer_suffix},"
+            )
+        field_mapping = field_mapping.replace(",US_census_uac_2010,", f",{join_features},")
         match_option = "HAVE_THEIR_CENTER_IN"
         search_radius = None
         distance_field_name = ""
@@ -300,6 +344,7 @@ class HPMSDataPreparation:
 
 
 def main():
+    args = parser.parse_args()
 
     STORAGE_DIR = Path("../data/processed_data")
     RAW_DIR = Path("../data/raw_data")
@@ -320,9 +365,12 @@ def main():
     prep.merge_hpms_data()
     prep.repair_hpms_geometry()
     prep.subset_hpms_geometry()
+    if args.reduce:
+        prep.reduce_overlay_inputs(args.grid_size, args.tolerance)
     prep.intersect_hpms_county()
     prep.add_unique_id()
     prep.correct_urban_codes()
+    print_summary()
 
 
 if __name__ == "__main__":
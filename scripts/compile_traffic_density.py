@@ -1,6 +1,8 @@
 import arcpy
+import argparse
 import pandas as pd
 from pathlib import Path
+from utils.geometry import reduce_gdb_layer, GRID_SIZE, TOLERANCE, REDUCED_SUFFIX
 
 arcpy.env.overwriteOutput = True
 print('arcpy.env.overwriteOutput', arcpy.env.overwriteOutput,'\n')
@@ -8,6 +10,11 @@ print('arcpy.env.overwriteOutput', arcpy.env.overwriteOutput,'\n')
 arcpy.env.outputCoordinateSystem = arcpy.SpatialReference("USA Contiguous Albers Equal Area Conic USGS")
 pd.set_option('display.float_format', '{:.4f}'.format)
 
+parser = argparse.ArgumentParser(description="Overlay the census block buffers with the road links (ArcPy)")
+parser.add_argument('--reduce', action='store_true', help='Snap and simplify the census blocks before buffering them (buffers US_census_block_2020_reduced)')
+parser.add_argument('--grid-size', type=float, default=GRID_SIZE, help='Grid size of the coordinates in meters with --reduce (0 keeps full precision)')
+parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='Simplification tolerance in meters with --reduce (0 skips the simplification)')
+
 def merge_state_fcs(TD_GDB):
     
     print("Merging state census block feature classes...")
@@ -41,11 +48,11 @@ def copy_hpms_data(TD_GDB, HPMS_GDB, fc):
 
     arcpy.Copy_management(in_data, out_data)
 
-def buffer_census_blocks(TD_GDB, distance):
+def buffer_census_blocks(TD_GDB, distance, blocks_layer = 'US_census_block_2020'):
 
     print('Buffering census blocks...')
 
-    in_feature = f"{TD_GDB}\\US_census_block_2020"
+    in_feature = f"{TD_GDB}\\{blocks_layer}"
     out_feature = f"{TD_GDB}\\US_census_block_buffers"
     buffer_distance = f'{distance} Meters'
     dissolve_option = 'NONE'
@@ -91,6 +98,7 @@ def intersect_buffer_roads(TD_GDB):
 
 
 def main():
+    args = parser.parse_args()
     TD_GDB = Path('../data/processed_data/Traffic_Density/Traffic_Density.gdb')
     HPMS_GDB = Path('../data/processed_data/HPMS/HPMS.gdb')
 
@@ -100,7 +108,13 @@ def main():
     calculate_census_block_area(TD_GDB)
     copy_hpms_data(TD_GDB, HPMS_GDB, 'hpms_aadt_imputation')
 
-    buffer_census_blocks(TD_GDB, distance = 250)
+    blocks_layer = 'US_census_block_2020'
+    if args.reduce:
+        # Reduced after the area calculation, so Area_Orig stays the area of the original block
+        reduce_gdb_layer(TD_GDB, blocks_layer, args.grid_size, args.tolerance)
+        blocks_layer += REDUCED_SUFFIX
+
+    buffer_census_blocks(TD_GDB, distance = 250, blocks_layer = blocks_layer)
     buffer_area_addfield(TD_GDB)
     buffer_area_calculate(TD_GDB)
 
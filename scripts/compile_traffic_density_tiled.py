@@ -0,0 +1,80 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script is an ArcPy-free, tiled and multi-process version of compile_traffic_density.py. It overlays 250 m census block buffers
+with the HPMS road links tile by tile and writes the block-link pairs (with the clipped link length) to a directory of Parquet files that
+estimate_traffic_density.py aggregates. An interrupted run resumes from the finished tiles of the same settings. With --grid-size / --simplify
+the blocks and links are first snapped and simplified (utils/geometry.py), which makes the overlay faster at a reported cost in length and area.
+The pairs go to density_intxn/, rollup pairs (--rollup) to density_rollup/ and reduced-geometry pairs to a directory named after the
+reduction, so that no run resumes from or mixes in the tiles of another.
+
+<LICENSE>
+"""
+import argparse
+import geopandas as gpd
+from pathlib import Path
+from utils.utils import load_data
+from utils.overlay import run_overlay
+from utils.geometry import reduce_layer
+from utils.rollup import ROLLUP_FIELDS
+from utils.telemetry import print_summary
+from utils import metrics
+
+parser = argparse.ArgumentParser(description="Tiled census block buffer / road link overlay")
+parser.add_argument('--distance', type=float, nargs='+', default=[250], help='Buffer distance in meters; several distances (e.g. 100 250 500 1000) write one Length_Clip_<distance> column each')
+parser.add_argument('--partition', choices=['grid', 'state'], default='grid', help='Partition the blocks into grid tiles or states')
+parser.add_argument('--tile-size', type=float, default=50000, help='Grid tile width in meters')
+parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+parser.add_argument('--kernel', choices=['buffer', 'dwithin'], default='buffer', help='Clip against exact block buffers or use the buffer-free dwithin kernel')
+parser.add_argument('--rollup', action='store_true', help='Also carry F_SYSTEM, URBAN and the VMT fields for build_rollup_cube.py (use with --distance 0 for block-exact pairs)')
+parser.add_argument('--metrics-port', type=int, default=None, help='Serve live progress metrics (Prometheus) on this localhost port')
+parser.add_argument('--grid-size', type=float, default=0, help='Snap the block and link coordinates to a grid of this size in meters before the overlay')
+parser.add_argument('--simplify', type=float, default=0, help='Simplify the blocks and links with this tolerance in meters before the overlay')
+parser.add_argument('--out-dir', type=Path, default=None, help='Directory of the pair tiles (default density_intxn, density_rollup with --rollup, suffixed with the geometry reduction)')
+parser.add_argument('--no-resume', action='store_true', help='Remove the tiles that are already finished and recompute them')
+
+BLOCK_FIELDS = ['GEOID20', 'Area_Land_Orig']
+LINK_FIELDS = ['FID_Link_Cnty_Intxn', 'Shape_Length_New', 'VKT_TOTAL', 'VKT_LDV', 'VKT_MDV', 'VKT_HDV']
+
+def main():
+    args = parser.parse_args()
+    if args.metrics_port:
+        metrics.start_exporter(args.metrics_port)
+
+    TD_DIR = Path('../data/processed_data/Traffic_Density')
+    TD_GDB = TD_DIR / 'Traffic_Density.gdb'
+    HPMS_PARQUET = Path('../data/processed_data/HPMS/hpms_aadt_imputation.parquet')
+
+    print('Loading census blocks and road links...', flush=True)
+    blocks = load_data(TD_GDB, 'US_census_block_2020')[BLOCK_FIELDS + ['geometry']]
+    link_fields = LINK_FIELDS + ROLLUP_FIELDS if args.rollup else LINK_FIELDS
+    links = gpd.read_parquet(HPMS_PARQUET, columns=link_fields + ['geometry'])
+    links = links.rename(columns={'VKT_TOTAL': 'VKT'}).to_crs(blocks.crs)
+
+    if args.grid_size or args.simplify:
+        blocks, _, _ = reduce_layer(blocks, args.grid_size, args.simplify, 'census blocks')
+        links, _, _ = reduce_layer(links, args.grid_size, args.simplify, 'road links')
+        # Apportion by the reduced link length so that a link fully inside a block buffer still contributes all of its VKT
+        links['Shape_Length_New'] = links.geometry.length
+
+    out_dir = args.out_dir
+    if out_dir is None:
+        out_dir = TD_DIR / ('density_rollup' if args.rollup else 'density_intxn')
+        if args.grid_size or args.simplify:
+            out_dir = out_dir.with_name(f"{out_dir.name}_g{args.grid_size:g}_s{args.simplify:g}")
+    print(f"Writing the pairs to {out_dir}", flush=True)
+
+    summary = run_overlay(blocks, links, out_dir,
+                          distance = args.distance[0] if len(args.distance) == 1 else args.distance,
+                          partition = args.partition,
+                          tile_size = args.tile_size,
+                          n_workers = args.workers,
+                          resume = not args.no_resume,
+                          kernel = args.kernel,
+                          settings = {'rollup': args.rollup, 'grid_size': args.grid_size, 'simplify': args.simplify})
+    print(f"Overlay finished: {summary['n_pairs'].sum()} pairs in {summary['seconds'].sum():.1f} CPU seconds", flush=True)
+    print_summary()
+
+if __name__ == '__main__':
+    main()
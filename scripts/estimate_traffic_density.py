@@ -1,39 +1,31 @@
+import argparse
 import pandas as pd
-import geopandas as gpd
-from shapely import wkt
+import pyogrio
 from pathlib import Path
-from utils.utils import load_data
+from utils.density import stream_density, BATCH_SIZE
+from utils import telemetry
 
 pd.set_option('display.float_format', lambda x: '%.3f' % x)
 
-def calculate_traffic_density(df):
-
-    print('Calculating traffic density...')
-
-    agg_funcs = {
-        'VKT': 'sum',
-        'VKT_LDV': 'sum',
-        'VKT_MDV': 'sum',
-        'VKT_HDV': 'sum',
-        'Area_Land_Orig': 'first'
-    }
-    grouped_df = df.groupby('GEOID20').agg(agg_funcs)
-
-    for vehicle_type in ['VKT', 'VKT_LDV', 'VKT_MDV', 'VKT_HDV']:
-        grouped_df[f'TD_{vehicle_type}'] = grouped_df[vehicle_type] / (grouped_df['Area_Land_Orig'] / 10**6)
-
-    grouped_df = grouped_df.replace([pd.NA, pd.np.inf, -pd.np.inf], 0)
-
-    return grouped_df.reset_index()
+parser = argparse.ArgumentParser(description="Estimate census block traffic density")
+parser.add_argument('--intxn-dir', type=Path, default=None, help='Read the block-link pairs from the Parquet tiles of compile_traffic_density_tiled.py instead of density_intxn')
+parser.add_argument('--no-apportion', action='store_true', help="Add each link's full VKT to every block buffer it crosses (the original method)")
+parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Number of pairs read per batch')
 
 def main():
-    TD_GDB = Path("../data/processed_data/Traffic_Density/Traffic_Density.gdb")
-    HPMS_GDB = Path("../data/processed_data/HPMS/HPMS.gdb")
+    args = parser.parse_args()
 
-    intxn_gdf = load_data(TD_GDB, "density_intxn")
-    intxn_gdf['geometry'] = intxn_gdf['geometry'].apply(lambda x: wkt.dumps(x))
+    TD_GDB = Path("../data/processed_data/Traffic_Density/Traffic_Density.gdb")
 
-    td_gdf = calculate_traffic_density(intxn_gdf)
+    print('Calculating traffic density...')
+    if args.intxn_dir is not None:
+        td_df = stream_density(args.intxn_dir, batch_size=args.batch_size, apportion=not args.no_apportion)
+    else:
+        td_df = stream_density(TD_GDB, layer="density_intxn", batch_size=args.batch_size, apportion=not args.no_apportion)
 
-    td_gdf.to_file(TD_GDB, layer="traffic_density", driver="OpenFileGDB")
+    with telemetry.stage("write", rows_in=len(td_df)):
+        pyogrio.write_dataframe(td_df, TD_GDB, layer="traffic_density", driver="OpenFileGDB")
+    telemetry.print_summary()
 
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,17 @@
 from pathlib import Path
+import argparse
 import utils.aadt_predictor as ap
+from utils import telemetry
 import tqdm
 
+parser = argparse.ArgumentParser(description="Impute missing AADT_MDV and AADT_HDV values")
+parser.add_argument('--per-state', action='store_true', help='Train one model per state in parallel instead of one national model')
+parser.add_argument('--min-state-rows', type=int, default=1000, help='States with fewer training rows use the national model')
+parser.add_argument('--memory-limit-gb', type=float, default=None, help='Memory available to the per-state worker processes')
+parser.add_argument('--export-models', action='store_true', help='Export the national models in the compact format to HPMS/models (with --per-state also the state models to HPMS/models/<response>_states)')
+
 def main():
+    args = parser.parse_args()
 
     HPMS_DIR = Path('../data/processed_data/HPMS')
     RESPONSE_VARS = ['AADT_MDV', 'AADT_HDV']
@@ -14,19 +23,41 @@ def main():
     for response_var in tqdm.tqdm(RESPONSE_VARS):
         predictor.response_var = response_var
         predictor.subset_train_data()
+
+        if args.per_state:
+            predictor.fit_state_models(RF_PREDICTOR_VARS, "Random Forest",
+                                       min_train_rows = args.min_state_rows,
+                                       memory_limit_gb = args.memory_limit_gb)
+            if args.export_models:
+                # The national fallback model is the one served from HPMS/models/<response>; it is only trained when a state needs it
+                if predictor.model is not None:
+                    predictor.export_model(HPMS_DIR / 'models' / response_var)
+                else:
+                    print(f"No national {response_var} model was needed, so none is exported to {HPMS_DIR / 'models' / response_var}", flush=True)
+                for state, model in predictor.state_models.items():
+                    predictor.export_model(HPMS_DIR / 'models' / f'{response_var}_states' / str(state), model=model)
+            n_imputed = predictor.impute_by_state(RF_PREDICTOR_VARS)
+            print(f"Imputed {n_imputed} missing values for {response_var}", flush=True)
+            continue
+
         predictor.split_data(RF_PREDICTOR_VARS, state_fips= None, test_size=1e-10)
         predictor.initialize_model("Random Forest")
         predictor.fit_model()
 
+        if args.export_models:
+            predictor.export_model(HPMS_DIR / 'models' / response_var)
+
         missing_data = predictor.data_full[predictor.data_full[response_var].isna()]
 
         try:
-            predictor.data_full.loc[missing_data.index, response_var] = predictor.model.predict(missing_data[RF_PREDICTOR_VARS])
+            predictor.data_full.loc[missing_data.index, response_var] = predictor.predict(missing_data[RF_PREDICTOR_VARS])
             print(f"Imputed {missing_data.shape[0]} missing values for {response_var}", flush=True)
         except Exception as e:
             print(f"ERROR: Could not impute missing values for {response_var}. {e}", flush=True)
     
-    predictor.data_full.to_csv(HPMS_DIR / 'hpms_aadt_imputed.csv', index=False)
+    with telemetry.stage('write', rows_in=len(predictor.data_full)):
+        predictor.data_full.to_csv(HPMS_DIR / 'hpms_aadt_imputed.csv', index=False)
+    telemetry.print_summary()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,126 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script is an ArcPy-free replacement of joingeo_hpms.py that
+1) Reads the HPMS road link geometry (HPMS_2018_county_intxn) with pyogrio,
+2) Joins the HPMS road link AADT estimation results to the links with an in-memory hash join on FID_Link_Cnty_Intxn,
+3) Calculates the length of road segments and the vehicle miles traveled (VMT) and vehicle kilometers traveled (VKT) for all vehicle classes as array expressions, and
+4) Writes the result as GeoParquet.
+
+<LICENSE>
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+from pathlib import Path
+
+METERS_PER_MILE = 1609.34
+METERS_PER_KM = 1000
+
+
+def load_link_geometry(gdb: Path, layer: str, join_field: str):
+    '''
+    Summary: This function reads the road link geometry and the join field from the geodatabase.
+    Inputs:
+        - gdb: path to the HPMS geodatabase
+        - layer: name of the road link feature class
+        - join_field: field identifying the road links
+    Output:
+        - links (GeoDataFrame): the road links
+    '''
+    print("Reading road link geometry...")
+    return gpd.read_file(gdb, layer=layer, columns=[join_field, 'Shape_Length'], engine='pyogrio', use_arrow=True)
+
+
+def load_results(in_table: Path):
+    '''
+    Summary: This function reads the HPMS road link AADT estimation results.
+    Inputs:
+        - in_table: path to the imputed results table
+    Output:
+        - results (DataFrame): the imputed results
+    '''
+    print("Reading results table...")
+    return pd.read_csv(in_table, dtype={'STATEFP': str, 'COUNTYFP': str, 'GEOID': str, 'URBAN_CODE': str})
+
+
+def join_results(links, results, join_field, field_remove):
+    '''
+    Summary: This function joins the HPMS road link AADT estimation results to the road links (left join, first match).
+    Inputs:
+        - links: road link GeoDataFrame
+        - results: imputed results DataFrame
+        - join_field: field identifying the road links in both tables
+        - field_remove: list of result fields not to join
+    Output:
+        - links (GeoDataFrame): the road links with the results fields
+    '''
+    print("Joining results to the road links...")
+
+    results = results.drop_duplicates(subset=join_field, keep='first')
+    fields = [f for f in results.columns if f not in field_remove and f != join_field]
+
+    # reindex hashes the result keys once and looks up every link, filling unmatched links with nulls
+    joined = results.set_index(join_field)[fields].reindex(links[join_field].to_numpy()).reset_index(drop=True)
+    matched = results[join_field].isin(links[join_field]).sum()
+
+    print('Joined {} results to {} road links on the following fields:\n{}'.format(matched, len(links), fields))
+    return pd.concat([links.reset_index(drop=True), joined], axis=1)
+
+
+def calculate_vmt_vkt(links):
+    '''
+    Summary: This function calculates the length of each road link in meters and the vehicle miles traveled (VMT) and vehicle kilometers traveled (VKT) for all vehicle classes.
+    Inputs:
+        - links: road link GeoDataFrame with the AADT fields
+    Output:
+        - links (GeoDataFrame): the road links with the length, VMT and VKT fields
+    '''
+    print("Calculating geometry length, VMT and VKT...")
+
+    length = shapely.length(links.geometry.values)
+    links['Shape_Length_New'] = length
+
+    miles = length / METERS_PER_MILE
+    kms = length / METERS_PER_KM
+    for suffix, aadt in [('MDV', 'AADT_MDV'), ('HDV', 'AADT_HDV'), ('TOTAL', 'AADT')]:
+        values = links[aadt].to_numpy(dtype=np.float64)
+        links[f'VMT_{suffix}'] = values * miles
+        links[f'VKT_{suffix}'] = values * kms
+
+    links['VMT_LDV'] = links['VMT_TOTAL'] - links['VMT_MDV'] - links['VMT_HDV']
+    links['VKT_LDV'] = links['VKT_TOTAL'] - links['VKT_MDV'] - links['VKT_HDV']
+    return links
+
+
+def main():
+    HPMS_DIR = Path('../data/processed_data/HPMS')
+    GEO_IN_GDB = HPMS_DIR / 'HPMS.gdb'
+    GEO_IN_LAYER = 'HPMS_2018_county_intxn'
+    TAB_IN_PATH = HPMS_DIR / 'hpms_aadt_imputed.csv'
+    OUT_PATH = HPMS_DIR / 'hpms_aadt_imputation.parquet'
+
+    JOIN_FIELD = 'FID_Link_Cnty_Intxn'
+
+    try:
+        links = load_link_geometry(GEO_IN_GDB, GEO_IN_LAYER, JOIN_FIELD)
+        results = load_results(TAB_IN_PATH)
+    except Exception as e:
+        print("ERROR: ")
+        print(e)
+        sys.exit('Exiting script.')
+
+    links = join_results(links, results, JOIN_FIELD,
+                         field_remove = ['OBJECTID', 'Shape_Length', 'Shape_Area', 'Shape_Length_'])
+    links = calculate_vmt_vkt(links)
+
+    links.to_parquet(OUT_PATH, index=False)
+    print('Wrote road links with VMT and VKT to:\n{}'.format(OUT_PATH))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script measures how AADTPredictor Random Forest fits scale with the number of training rows, n_estimators, max_depth, n_jobs and
+the dtype of the design matrix, on synthetic data with the HPMS feature distribution (utils/synthetic.py), so that it runs without
+hpms_aadt_subset.csv. Each configuration is fitted in a fresh process to measure its own peak RSS. The fit time, predict throughput, peak RSS
+and model size are written to a CSV with scaling curves, together with the cores / memory / time to request in the SLURM scripts
+(run_senstivity_*.sh) for a target data size.
+
+<LICENSE>
+"""
+import sys
+import json
+import itertools
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+import pandas as pd
+import matplotlib.pyplot as plt
+
+# Get the absolute path of the parent directory
+parent_dir = str(Path(__file__).resolve().parent.parent)
+
+# Add the parent directory to sys.path
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from utils.benchmark import profile_aadt_fit, recommend_resources
+
+
+def depth(value):
+    return None if value.lower() == "none" else int(value)
+
+
+parser = argparse.ArgumentParser(description="AADTPredictor scaling benchmark")
+parser.add_argument('--rows', type=int, nargs='+', default=[10000, 30000, 100000], help='Numbers of training rows')
+parser.add_argument('--estimators', type=int, nargs='+', default=[25, 95], help='Values of n_estimators')
+parser.add_argument('--depths', type=depth, nargs='+', default=[40], help='Values of max_depth ("none" for fully grown trees)')
+parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4], help='Values of n_jobs')
+parser.add_argument('--dtypes', nargs='+', choices=['float64', 'float32'], default=['float64', 'float32'], help='Dtypes of the design matrix')
+parser.add_argument('--response-var', type=str, default='AADT_HDV', help='Response variable')
+parser.add_argument('--n-predict', type=int, default=200000, help='Number of rows predicted to measure the throughput')
+parser.add_argument('--target-rows', type=int, default=1500000, help='Training rows of the fit to size the request for')
+parser.add_argument('--target-estimators', type=int, default=95, help='n_estimators of the fit to size the request for')
+parser.add_argument('--target-depth', type=depth, default=40, help='max_depth of the fit to size the request for')
+parser.add_argument('--target-dtype', choices=['float64', 'float32'], default='float64', help='Dtype of the fit to size the request for')
+parser.add_argument('--output', type=Path, default=Path('../../data/results/aadt_scaling'), help='Output directory')
+
+
+def plot_scaling(results, path):
+    """
+    Summary: Log-log scaling curves of fit time, peak RSS and predict throughput against training rows, one line per configuration
+    """
+    fig, axes = plt.subplots(1, 3, figsize=(15, 4.5))
+    metrics = [("fit_time_s", "Fit time (s)"), ("peak_rss_mb", "Peak RSS (MB)"), ("predict_rows_per_s", "Predict rows / s")]
+    for keys, group in results.groupby(["n_estimators", "max_depth", "n_jobs", "dtype"], dropna=False):
+        group = group.sort_values("n_rows")
+        label = f"{keys[0]} trees, depth {keys[1]}, {keys[2]} jobs, {keys[3]}"
+        for ax, (metric, _) in zip(axes, metrics):
+            ax.plot(group["n_rows"], group[metric], marker="o", label=label)
+    for ax, (_, title) in zip(axes, metrics):
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("Training rows")
+        ax.set_title(title)
+        ax.grid(True, which="both", alpha=0.3)
+    axes[0].legend(fontsize=6)
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+
+
+def main():
+    args = parser.parse_args()
+    args.output.mkdir(parents=True, exist_ok=True)
+
+    configs = list(itertools.product(args.rows, args.estimators, args.depths, args.jobs, args.dtypes))
+    results = []
+    for i, (n_rows, n_estimators, max_depth, n_jobs, dtype) in enumerate(configs, 1):
+        print(f"Fitting {i}/{len(configs)}: {n_rows} rows, {n_estimators} trees, depth {max_depth}, {n_jobs} jobs, {dtype}", flush=True)
+        # A fresh (spawned) process per fit so that the peak RSS is not inflated by earlier fits
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            try:
+                result = executor.submit(
+                    profile_aadt_fit, n_rows, n_estimators, max_depth, n_jobs, dtype, args.response_var, None, args.n_predict
+                ).result()
+            except Exception as e:
+                print(f"ERROR: The fit could not be profiled. {e}", flush=True)
+                continue
+        print(
+            f"Fit {result['fit_time_s']:.2f}s, predict {result['predict_rows_per_s']:.0f} rows/s, "
+            f"peak {result['peak_rss_mb']:.0f} MB, model {result['model_size_mb']:.1f} MB",
+            flush=True,
+        )
+        results.append(result)
+
+    results_df = pd.DataFrame(results)
+    results_df.to_csv(args.output / "aadt_scaling.csv", index=False)
+    plot_scaling(results_df, args.output / "aadt_scaling.png")
+
+    recommendation = recommend_resources(results_df, args.target_rows, args.target_estimators, args.target_depth, args.target_dtype)
+    with open(args.output / "recommendation.json", "w") as f:
+        json.dump(recommendation, f, indent=2)
+
+    print(results_df.to_string(index=False))
+    print(
+        f"Recommended request for {args.target_rows} rows, {args.target_estimators} trees, depth {args.target_depth}: "
+        f"#SBATCH --ntasks={recommendation['n_jobs']} --mem={recommendation['mem_gb']}G "
+        f"(~{recommendation['time_h']} h per fit, ~{recommendation['peak_rss_mb'] / 1024:.1f} GB peak)",
+        flush=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script benchmarks the estimator backends available in AADTPredictor (fit time, predict throughput, model size and accuracy) on the same train/test split, so that a faster backend can be chosen where the accuracy allows.
+
+<LICENSE>
+"""
+import sys
+import os
+import argparse
+from pathlib import Path
+import pandas as pd
+
+# Get the absolute path of the parent directory
+parent_dir = str(Path(__file__).resolve().parent.parent)
+
+# Add the parent directory to sys.path
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+import utils.aadt_predictor as ap
+from utils.benchmark import benchmark_model
+
+parser = argparse.ArgumentParser(description="Benchmark AADTPredictor backends")
+parser.add_argument('--sample', type=float, default=None, help='Fraction of the training data to use')
+parser.add_argument('--test-size', type=float, default=0.2, help='Proportion of the data used for testing')
+
+NUM_JOBS = int(os.getenv('SLURM_NTASKS')) if os.getenv('SLURM_NTASKS') else -1
+
+
+def main():
+    args = parser.parse_args()
+
+    HPMS_DIR = Path('../../data/processed_data/HPMS')
+    RANDOM_STATE = 42
+
+    RESPONSE_VARS = ['AADT_MDV', 'AADT_HDV']
+    RF_PREDICTOR_VARS = ["STATEFP", "COUNTYFP", "F_SYSTEM", "THROUGH_LANES", "AADT"]
+
+    # Backends to compare; the Random Forest uses the tuned parameters from log/best_params_*.txt
+    BACKENDS = {
+        'Random Forest': {'n_estimators': 95, 'max_depth': 40, 'min_samples_leaf': 1, 'n_jobs': NUM_JOBS},
+        'Hist Gradient Boosting': {'max_iter': 500, 'learning_rate': 0.1, 'max_leaf_nodes': 255, 'early_stopping': False},
+        'Linear': {},
+        'Grouped Linear': {'group_vars': ('STATEFP',)},
+    }
+
+    predictor = ap.AADTPredictor(HPMS_DIR / 'hpms_aadt_subset.csv', None, random_state = RANDOM_STATE)
+
+    results = []
+    for response_var in RESPONSE_VARS:
+        predictor.response_var = response_var
+        predictor.subset_train_data()
+        if args.sample:
+            predictor.data = predictor.data.sample(frac=args.sample, random_state=RANDOM_STATE)
+        predictor.split_data(RF_PREDICTOR_VARS, state_fips = None, test_size = args.test_size)
+
+        for model_type, params in BACKENDS.items():
+            print(f'Benchmarking {model_type} for {response_var}', flush=True)
+            predictor.initialize_model(model_type, **params)
+            result = benchmark_model(predictor.model, predictor.X_train, predictor.y_train, predictor.X_test, predictor.y_test)
+            print(result, flush=True)
+            results.append({'response_var': response_var, 'model_type': model_type, 'n_train': predictor.X_train.shape[0], **result})
+
+    results_df = pd.DataFrame(results)
+    print(results_df.to_string(index=False))
+    results_df.to_csv('../../data/results/benchmark_models.csv', index = False)
+
+if __name__ == "__main__":
+    main()
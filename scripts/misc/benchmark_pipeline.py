@@ -0,0 +1,166 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script benchmarks the pipeline stages offline on synthetic data (utils/synthetic.py) at several scales: subset_hpms.py, the
+county and UAC joins of compile_raw_data.py, the census block buffer overlay and estimate_traffic_density.py. The wall time, CPU time and peak
+memory of each stage are appended to a JSON history with the git commit, and compared with the previous commit in the history so that
+regressions show up between commits. The ArcPy joins are measured through their ArcPy-free equivalents (Shapely intersection for the
+pairwise county intersect, a GeoPandas spatial join for the UAC join, run_overlay for the block buffers).
+
+<LICENSE>
+"""
+import sys
+import argparse
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# Get the absolute path of the parent directory
+parent_dir = str(Path(__file__).resolve().parent.parent)
+
+# Add the parent directory to sys.path
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+import subset_hpms as sh
+from utils import synthetic
+from utils.benchmark import profile_call, append_history, compare_history
+from utils.overlay import run_overlay
+from utils.density import stream_density
+
+STAGES = ["subset_hpms", "county_join", "uac_join", "block_overlay", "estimate_traffic_density"]
+
+
+def parse_scale(value):
+    """
+    Summary: Parse a scale such as 10000, 10k or 1M
+    """
+    multipliers = {"k": 10**3, "m": 10**6}
+    value = value.strip().lower()
+    if value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(float(value))
+
+
+parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data")
+parser.add_argument('--scales', type=parse_scale, nargs='+', default=[10**4, 10**5], help='Numbers of road links (e.g. 10k 100k 1M 10M)')
+parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help='The stages to benchmark')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+parser.add_argument('--distance', type=float, default=250, help='Census block buffer distance in meters')
+parser.add_argument('--workers', type=int, default=None, help='Number of worker processes of the block overlay')
+parser.add_argument('--history', type=Path, default=Path('../../data/results/benchmark_history.json'), help='JSON history of the benchmark results')
+parser.add_argument('--baseline', type=str, default=None, help='Commit to compare with (defaults to the previous commit in the history)')
+
+
+def run_subset_hpms(hpms_intx, hpms_uac):
+    """
+    Summary: The processing steps of subset_hpms.main without the geodatabase reads and the CSV write
+    """
+    hpms_intx = sh.correct_hpms_columns(hpms_intx)
+    hpms_intx = sh.calculate_vkt_vmt(hpms_intx)
+    hpms_intx["LANE_KMS"] = hpms_intx["THROUGH_LANES"] * (hpms_intx["Shape_Length"] / 1000)
+    hpms_intx["LANE_MILES"] = hpms_intx["THROUGH_LANES"] * (hpms_intx["Shape_Length"] / 1609.344)
+    hpms_intx = sh.merge_uac_data(hpms_intx, hpms_uac)
+    return sh.subset_hpms(hpms_intx)
+
+
+def county_join(links, counties):
+    """
+    Summary: Pairwise intersect of the road links with the counties (the Link_Cnty_Intxn step of compile_raw_data.py)
+    """
+    link_idx, county_idx = shapely.STRtree(np.asarray(counties.geometry.values)).query(np.asarray(links.geometry.values), predicate="intersects")
+    geometry = shapely.intersection(links.geometry.values[link_idx], counties.geometry.values[county_idx])
+    joined = pd.DataFrame(links.drop(columns="geometry")).iloc[link_idx].reset_index(drop=True)
+    for field in ["STATEFP", "COUNTYFP", "GEOID"]:
+        joined[field] = counties[field].to_numpy()[county_idx]
+    return gpd.GeoDataFrame(joined, geometry=geometry, crs=links.crs)
+
+
+def uac_join(links, uac):
+    """
+    Summary: Spatial join of the road links with the urban areas (the cnty_uac_join step of compile_raw_data.py)
+    """
+    return gpd.sjoin(links, uac, how="left", predicate="intersects")
+
+
+def benchmark_scale(n_links, stages, seed, distance, n_workers, work_dir):
+    """
+    Summary: Generate the synthetic data of a scale and profile each stage
+    Input:
+        - n_links (int): The scale
+        - stages (list): The stages to profile
+        - seed (int): The random seed
+        - distance (float): The buffer distance of the block overlay
+        - n_workers (int): The number of processes of the block overlay
+        - work_dir (Path): Scratch directory for the overlay output
+    Output:
+        - records (list): One dict per stage (scale, stage, rows_in, rows_out and the profile_call measurements)
+    """
+    print(f"Generating synthetic data with {n_links} links...", flush=True)
+    data, profile = profile_call(synthetic.make_dataset, n_links, seed)
+    records = [{"scale": n_links, "stage": "generate", "rows_in": 0, "rows_out": n_links, **profile}]
+    links, counties = data["links"], data["counties"]
+
+    def record(stage, rows_in, fn, *args):
+        print(f"Running {stage} on {n_links} links...", flush=True)
+        result, profile = profile_call(fn, *args)
+        rows_out = len(result) if hasattr(result, "__len__") else None
+        records.append({"scale": n_links, "stage": stage, "rows_in": rows_in, "rows_out": rows_out, **profile})
+        print(f"{stage}: {profile['wall_time_s']:.2f}s wall, {profile['cpu_time_s']:.2f}s CPU, {profile['peak_rss_mb']:.0f} MB peak", flush=True)
+        return result
+
+    if "subset_hpms" in stages:
+        hpms_intx = synthetic.hpms_county_frame(links, counties)
+        hpms_uac = synthetic.hpms_uac_frame(links, data["uac"])
+        record("subset_hpms", len(hpms_intx), run_subset_hpms, hpms_intx, hpms_uac)
+    if "county_join" in stages:
+        record("county_join", len(links), county_join, links, counties)
+    if "uac_join" in stages:
+        record("uac_join", len(links), uac_join, links, data["uac"])
+
+    pairs_dir = Path(work_dir) / f"pairs_{n_links}"
+    if "block_overlay" in stages or "estimate_traffic_density" in stages:
+        network = synthetic.link_network(links, counties).rename(columns={"VKT_TOTAL": "VKT"})
+        network = network[["FID_Link_Cnty_Intxn", "Shape_Length_New", "VKT", "VKT_LDV", "VKT_MDV", "VKT_HDV", "geometry"]]
+        blocks = data["blocks"]
+        if "block_overlay" in stages:
+            summary = record("block_overlay", len(blocks), run_overlay, blocks, network, pairs_dir, distance, "grid", 50000, n_workers, False)
+            records[-1]["rows_out"] = int(summary["n_pairs"].sum())
+        else:
+            # The density stage reads the pairs of the overlay
+            summary = run_overlay(blocks, network, pairs_dir, distance=distance, n_workers=n_workers, resume=False)
+    if "estimate_traffic_density" in stages:
+        n_pairs = int(summary["n_pairs"].sum())
+        record("estimate_traffic_density", n_pairs, stream_density, pairs_dir)
+    return records
+
+
+def main():
+    args = parser.parse_args()
+    records = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_links in args.scales:
+            if n_links > 10**6:
+                print(f"WARNING: {n_links} links needs tens of GB of memory for the block overlay", flush=True)
+            records += benchmark_scale(n_links, args.stages, args.seed, args.distance, args.workers, work_dir)
+
+    history = append_history(args.history, records)
+    print(f"Appended {len(records)} records to {args.history}", flush=True)
+
+    comparison = compare_history(history, baseline=args.baseline)
+    if comparison.empty:
+        print("No earlier commit in the history to compare with", flush=True)
+    else:
+        print(f"Comparison of {comparison.attrs['candidate'][:10]} with {comparison.attrs['baseline'][:10]} (ratio > 1 is slower / larger):")
+        print(comparison.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+        regressions = comparison[comparison["wall_time_s_ratio"] > 1.2]
+        for _, row in regressions.iterrows():
+            print(f"WARNING: {row['stage']} at {row['scale']} links is {row['wall_time_s_ratio']:.2f}x slower", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script compares the buffer-free (dwithin) overlay kernel with the explicit buffer kernel of utils.overlay on a sample of states,
+reporting the difference in clipped road length and the buffer memory saved.
+
+<LICENSE>
+"""
+import sys
+import json
+import argparse
+from pathlib import Path
+import numpy as np
+import geopandas as gpd
+
+# Get the absolute path of the parent directory
+parent_dir = str(Path(__file__).resolve().parent.parent)
+
+# Add the parent directory to sys.path
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from utils.utils import load_data
+from utils.overlay import compare_kernels, DWITHIN_QUAD_SEGS
+
+parser = argparse.ArgumentParser(description="Compare the buffer and dwithin overlay kernels")
+parser.add_argument('--states', nargs='+', default=['50'], help='State FIPS codes of the blocks to compare on')
+parser.add_argument('--distance', type=float, default=250, help='Buffer distance in meters')
+parser.add_argument('--quad-segs', type=int, default=DWITHIN_QUAD_SEGS, help='Segments per quarter circle of the dwithin buffers')
+args = parser.parse_args()
+
+
+def main():
+    TD_GDB = Path('../../data/processed_data/Traffic_Density/Traffic_Density.gdb')
+    HPMS_PARQUET = Path('../../data/processed_data/HPMS/hpms_aadt_imputation.parquet')
+
+    blocks = load_data(TD_GDB, 'US_census_block_2020')[['GEOID20', 'geometry']]
+    blocks = blocks[blocks['GEOID20'].str[:2].isin(args.states)]
+    links = gpd.read_parquet(HPMS_PARQUET, columns=['geometry']).to_crs(blocks.crs)
+
+    # Only the links near the sampled blocks take part
+    minx, miny, maxx, maxy = blocks.total_bounds
+    links = links.cx[minx - args.distance : maxx + args.distance, miny - args.distance : maxy + args.distance]
+
+    report = compare_kernels(np.asarray(blocks.geometry.values), np.asarray(links.geometry.values), args.distance, args.quad_segs)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script compares a new pipeline output with an old one (hpms_aadt_subset.csv, hpms_aadt_imputed.csv, traffic_density) row by row
+in bounded memory, replacing the column-by-column describe() of subset_compare.ipynb. It reports the rows added, removed and changed, the
+changes per column, the largest differences and the one-pass column statistics of both outputs (see utils/dataset_diff.py).
+
+<LICENSE>
+"""
+import sys
+import json
+import argparse
+from pathlib import Path
+
+# Get the absolute path of the parent directory
+parent_dir = str(Path(__file__).resolve().parent.parent)
+
+# Add the parent directory to sys.path
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from utils.dataset_diff import diff_datasets, print_report, ATOL, RTOL, CHUNK_SIZE, N_BUCKETS
+
+parser = argparse.ArgumentParser(description="Compare two versions of a pipeline output")
+parser.add_argument('old', type=Path, help='The old output (CSV, Parquet file / directory, or geodatabase with --layer)')
+parser.add_argument('new', type=Path, help='The new output')
+parser.add_argument('--layer', type=str, default=None, help='Geodatabase layer of both outputs (e.g. traffic_density)')
+parser.add_argument('--key', type=str, default=None, help='Key column (defaults to FID_Link_Cnty_Intxn or GEOID20)')
+parser.add_argument('--columns', nargs='+', default=None, help='Value columns to compare (defaults to all shared columns)')
+parser.add_argument('--atol', type=float, default=ATOL, help='Absolute tolerance of numeric changes')
+parser.add_argument('--rtol', type=float, default=RTOL, help='Relative tolerance of numeric changes')
+parser.add_argument('--top', type=int, default=10, help='Largest differences listed per column')
+parser.add_argument('--hash-only', action='store_true', help='Fast mode: compare row hashes only (exact changes, no tolerances)')
+parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows read at a time')
+parser.add_argument('--buckets', type=int, default=N_BUCKETS, help='Key-hash buckets (more buckets, less memory)')
+parser.add_argument('--work-dir', type=Path, default=None, help='Directory of the temporary buckets')
+parser.add_argument('--output', type=Path, default=None, help='Also write the report as JSON (and the largest differences as CSV)')
+
+
+def main():
+    args = parser.parse_args()
+    report = diff_datasets(args.old, args.new,
+                           key = args.key,
+                           layer_old = args.layer,
+                           layer_new = args.layer,
+                           columns = args.columns,
+                           atol = args.atol,
+                           rtol = args.rtol,
+                           top_n = args.top,
+                           hash_only = args.hash_only,
+                           chunk_size = args.chunk_size,
+                           n_buckets = args.buckets,
+                           work_dir = args.work_dir)
+    print_report(report)
+
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        top = report.pop('top_differences', None)
+        if top is not None:
+            top.to_csv(args.output.with_suffix('.top.csv'), index=False)
+        stats = report.pop('stats')
+        report['stats'] = {f"{side}.{stat}": column for (side, stat), column in stats.to_dict().items()}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+    # A non-zero exit status when the outputs differ, so that the comparison can gate a run
+    sys.exit(int(bool(report['added'] or report['removed'] or report['changed'])))
+
+
+if __name__ == '__main__':
+    main()
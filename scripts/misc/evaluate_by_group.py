@@ -0,0 +1,66 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script evaluates the AADT models on the test set overall and per state, functional system and urban class with
+AADTPredictor.evaluate_by_group (utils/evaluation.py), replacing the per-group filtering and scikit-learn metric calls of the notebooks.
+The bootstrap resamples are shared by the models, so their confidence intervals are paired. The tidy table (one row per response variable,
+model, grouping, group and metric) is written to data/results/evaluation_by_group.csv.
+
+<LICENSE>
+"""
+import sys
+import argparse
+from pathlib import Path
+import pandas as pd
+
+# Get the absolute path of the parent directory
+parent_dir = str(Path(__file__).resolve().parent.parent)
+
+# Add the parent directory to sys.path
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+import utils.aadt_predictor as ap
+from utils.evaluation import CI
+
+HPMS_DIR = Path('../../data/processed_data/HPMS')
+RF_PREDICTOR_VARS = ["STATEFP", "COUNTYFP", "F_SYSTEM", "THROUGH_LANES", "AADT"]
+RANDOM_STATE = 42
+
+parser = argparse.ArgumentParser(description="Evaluate the AADT models per group")
+parser.add_argument('--response-vars', nargs='+', default=['AADT_MDV', 'AADT_HDV'], help='Response variables')
+parser.add_argument('--models', nargs='+', default=['Random Forest', 'Linear'], help='Model types of AADTPredictor')
+parser.add_argument('--by', nargs='+', default=['STATEFP', 'F_SYSTEM', 'URBAN'], help='Groupings; join columns with "+" for combinations, e.g. STATEFP+F_SYSTEM')
+parser.add_argument('--n-boot', type=int, default=200, help='Bootstrap resamples of the confidence intervals (0 for none)')
+parser.add_argument('--ci', type=float, default=CI, help='Confidence level')
+parser.add_argument('--test-size', type=float, default=0.2, help='Proportion of the data used for testing')
+parser.add_argument('--output', type=Path, default=Path('../../data/results/evaluation_by_group.csv'), help='Output CSV')
+
+
+def main():
+    args = parser.parse_args()
+    by = [grouping.split('+') if '+' in grouping else grouping for grouping in args.by]
+    predictor = ap.AADTPredictor(HPMS_DIR / 'hpms_aadt_subset.csv', None, random_state=RANDOM_STATE)
+
+    tables = []
+    for response_var in args.response_vars:
+        predictor.response_var = response_var
+        predictor.subset_train_data()
+        predictor.split_data(RF_PREDICTOR_VARS, test_size=args.test_size)
+        for model_type in args.models:
+            predictor.initialize_model(model_type)
+            predictor.fit_model()
+            table = predictor.evaluate_by_group(by=by, n_boot=args.n_boot, ci=args.ci)
+            overall = table[table['grouping'] == 'all'].set_index('metric')['value']
+            print(f"{response_var} {model_type}: R2 {overall['r2']:.4f}, MAE {overall['mae']:.2f}, MAPE {overall['mape']:.2%}", flush=True)
+            tables.append(table.assign(response_var=response_var, model_type=model_type))
+
+    results = pd.concat(tables, ignore_index=True)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    results.to_csv(args.output, index=False)
+    print(f"Evaluation written to {args.output}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script measures the effect of the geometry reduction stage (utils/geometry.py) on a sample of states: for every grid size and
+simplification tolerance it reports the vertex reduction and the maximum per-feature length / area change of the blocks and links, the
+block-buffer overlay speed-up, and the change in apportioned VKT and per-block traffic density against the full-precision geometry.
+
+<LICENSE>
+"""
+import sys
+import json
+import itertools
+import argparse
+from pathlib import Path
+import pandas as pd
+import geopandas as gpd
+
+# Get the absolute path of the parent directory
+parent_dir = str(Path(__file__).resolve().parent.parent)
+
+# Add the parent directory to sys.path
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from utils.utils import load_data
+from utils.geometry import compare_reduction
+from utils import synthetic
+
+parser = argparse.ArgumentParser(description="Evaluate the geometry reduction on the block-buffer overlay")
+parser.add_argument('--states', nargs='+', default=['50'], help='State FIPS codes of the blocks to evaluate on')
+parser.add_argument('--synthetic', type=int, default=None, help='Evaluate on this many synthetic links instead of the HPMS data')
+parser.add_argument('--distance', type=float, default=250, help='Buffer distance in meters')
+parser.add_argument('--grid-sizes', type=float, nargs='+', default=[1.0], help='Grid sizes of the coordinates in meters')
+parser.add_argument('--tolerances', type=float, nargs='+', default=[1.0, 2.0, 5.0], help='Simplification tolerances in meters')
+parser.add_argument('--output', type=Path, default=Path('../../data/results/geometry_reduction.json'), help='Output JSON file')
+args = parser.parse_args()
+
+
+def load_sample():
+    """
+    Summary: The blocks of the sampled states and the links near them, in the schema of compile_traffic_density_tiled.py
+    """
+    if args.synthetic:
+        dataset = synthetic.make_dataset(args.synthetic)
+        links = synthetic.link_network(dataset['links'], dataset['counties'])
+        return dataset['blocks'], links.rename(columns={'VKT_TOTAL': 'VKT'})
+
+    TD_GDB = Path('../../data/processed_data/Traffic_Density/Traffic_Density.gdb')
+    HPMS_PARQUET = Path('../../data/processed_data/HPMS/hpms_aadt_imputation.parquet')
+
+    blocks = load_data(TD_GDB, 'US_census_block_2020')[['GEOID20', 'Area_Land_Orig', 'geometry']]
+    blocks = blocks[blocks['GEOID20'].str[:2].isin(args.states)]
+    links = gpd.read_parquet(HPMS_PARQUET, columns=['Shape_Length_New', 'VKT_TOTAL', 'VKT_LDV', 'VKT_MDV', 'VKT_HDV', 'geometry'])
+    links = links.rename(columns={'VKT_TOTAL': 'VKT'}).to_crs(blocks.crs)
+
+    # Only the links near the sampled blocks take part
+    minx, miny, maxx, maxy = blocks.total_bounds
+    links = links.cx[minx - args.distance : maxx + args.distance, miny - args.distance : maxy + args.distance]
+    return blocks, links
+
+
+def main():
+    blocks, links = load_sample()
+    print(f"Evaluating on {len(blocks)} blocks and {len(links)} links", flush=True)
+
+    reports = []
+    for grid_size, tolerance in itertools.product(args.grid_sizes, args.tolerances):
+        report = compare_reduction(blocks, links, args.distance, grid_size, tolerance)
+        print(
+            f"Grid {grid_size} m, tolerance {tolerance} m: overlay {report['speedup']:.2f}x faster, "
+            f"VKT change {report['vkt_change_rel']['VKT']:+.4%}, max block density change {report['max_density_change_rel']:.2%} "
+            f"(p99 {report['p99_density_change_rel']:.2%})",
+            flush=True,
+        )
+        reports.append(report)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(reports, f, indent=2)
+
+    table = pd.json_normalize(reports)
+    columns = ['grid_size', 'tolerance', 'blocks.vertex_reduction', 'links.vertex_reduction', 'links.max_length_change_rel',
+               'blocks.max_area_change_rel', 'speedup', 'vkt_change_rel.VKT', 'max_density_change_rel', 'p99_density_change_rel']
+    print(table[columns].to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
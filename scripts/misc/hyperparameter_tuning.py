@@ -16,6 +16,8 @@ if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
 import utils.aadt_predictor as ap
+# Serves live progress on localhost when HPMS_METRICS_PORT is set
+import utils.metrics as metrics
 
 def main():
 
@@ -63,8 +65,9 @@ def main():
             random_state = 42
         )
 
-        # Fit the model
-        opt.fit(X, y)
+        # Fit the model, reporting each finished trial (skopt minimizes the negated score)
+        report_trial = lambda res: metrics.trial_finished(len(res.func_vals), NUM_ITERS, -res.fun)
+        opt.fit(X, y, callback=report_trial)
 
         # Best model found
         print("Best parameters found:", opt.best_params_)
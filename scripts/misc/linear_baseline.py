@@ -0,0 +1,93 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script runs the linear-regression baseline of every state (or every F_SYSTEM x state) at once with the "Grouped Linear" model of
+AADTPredictor (utils/grouped_linear.py) and writes the test metrics of every group. With --compare-sklearn it also times the Python loop of
+one scikit-learn LinearRegression per group on the same split and reports the largest difference of the predictions.
+
+<LICENSE>
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+
+# Get the absolute path of the parent directory
+parent_dir = str(Path(__file__).resolve().parent.parent)
+
+# Add the parent directory to sys.path
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+import utils.aadt_predictor as ap
+
+HPMS_DIR = Path('../../data/processed_data/HPMS')
+RF_PREDICTOR_VARS = ["STATEFP", "COUNTYFP", "F_SYSTEM", "THROUGH_LANES", "AADT"]
+RANDOM_STATE = 42
+
+parser = argparse.ArgumentParser(description="Fit the linear baseline of every state at once")
+parser.add_argument('--response-vars', nargs='+', default=['AADT_MDV', 'AADT_HDV'], help='Response variables')
+parser.add_argument('--group-vars', nargs='+', default=['STATEFP'], help='Group columns, e.g. STATEFP F_SYSTEM')
+parser.add_argument('--min-group-rows', type=int, default=50, help='Groups with fewer training rows use the pooled model')
+parser.add_argument('--test-size', type=float, default=0.2, help='Proportion of the data used for testing')
+parser.add_argument('--compare-sklearn', action='store_true', help='Also fit one scikit-learn LinearRegression per group and compare')
+parser.add_argument('--output', type=Path, default=Path('../../data/results/linear_baseline.csv'), help='Output CSV of the group metrics')
+
+
+def sklearn_loop(X_train, y_train, X_test, group_vars):
+    """
+    Summary: The reference: one LinearRegression per group, predicting the test rows of the groups seen in training
+    """
+    features = [c for c in X_train.columns if c not in group_vars]
+    y_pred = np.full(len(X_test), np.nan)
+    test_rows = X_test.groupby(group_vars, observed=True).indices
+    for group, rows in X_train.groupby(group_vars, observed=True).indices.items():
+        model = LinearRegression().fit(X_train.iloc[rows][features], y_train.iloc[rows])
+        if group in test_rows:
+            y_pred[test_rows[group]] = model.predict(X_test.iloc[test_rows[group]][features])
+    return y_pred
+
+
+def main():
+    args = parser.parse_args()
+    predictor = ap.AADTPredictor(HPMS_DIR / 'hpms_aadt_subset.csv', None, random_state=RANDOM_STATE)
+
+    results = []
+    for response_var in args.response_vars:
+        predictor.response_var = response_var
+        predictor.subset_train_data()
+        predictor.split_data(RF_PREDICTOR_VARS, test_size=args.test_size)
+        predictor.initialize_model('Grouped Linear', group_vars=tuple(args.group_vars), min_group_rows=args.min_group_rows)
+
+        start = time.perf_counter()
+        predictor.fit_model()
+        metrics = predictor.model.group_metrics(predictor.X_test, predictor.y_test)
+        elapsed = time.perf_counter() - start
+        print(f"{response_var}: {len(predictor.model.groups_)} group models fit and tested in {elapsed:.2f} s", flush=True)
+
+        if args.compare_sklearn:
+            start = time.perf_counter()
+            y_ref = sklearn_loop(predictor.X_train, predictor.y_train, predictor.X_test, args.group_vars)
+            loop_time = time.perf_counter() - start
+            # Only the groups with their own model are comparable; the others use the pooled model
+            own = predictor.model.train_metrics_.loc[predictor.model.train_metrics_['own_model'], args.group_vars]
+            y_pred = predictor.predict(predictor.X_test)
+            mask = pd.MultiIndex.from_frame(predictor.X_test[args.group_vars].astype(str)).isin(
+                pd.MultiIndex.from_frame(own.astype(str))) & ~np.isnan(y_ref)
+            print(f"{response_var}: scikit-learn loop {loop_time:.2f} s ({loop_time / elapsed:.1f}x), largest prediction difference "
+                  f"{np.abs(y_pred[mask] - y_ref[mask]).max():.3g}", flush=True)
+
+        results.append(metrics.assign(response_var=response_var))
+
+    results_df = pd.concat(results, ignore_index=True)
+    print(results_df.to_string(index=False))
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    results_df.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script regenerates the binned figures of figs/ (hdv_mdv_scatter, hexbin_AADT_HDV_MDV, error_map_*, boxplot_* and their _lr
+variants, residual_lowess_*) with utils/figures.py and utils/diagnostics.py. The HDV / MDV grid is accumulated from hpms_aadt_imputed.csv in chunks; the error maps and boxplots are
+binned from the test-set predictions of the Random Forest ("rf") and linear ("lr") models, and the residual LOWESS of both models is
+approximated in one call. The binned arrays are cached in
+data/results/figure_cache, so later runs (e.g. restyling) only read the cache; --refresh rebuilds them.
+
+<LICENSE>
+"""
+import sys
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Get the absolute path of the parent directory
+parent_dir = str(Path(__file__).resolve().parent.parent)
+
+# Add the parent directory to sys.path
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+import utils.aadt_predictor as ap
+from utils.utils import load_data
+from utils.geometry import reduce_geometry
+from utils import figures
+from utils import diagnostics
+
+HPMS_DIR = Path('../../data/processed_data/HPMS')
+RF_PREDICTOR_VARS = ["STATEFP", "COUNTYFP", "F_SYSTEM", "THROUGH_LANES", "AADT"]
+MODELS = {'rf': ('Random Forest', '', 'Random Forest'), 'lr': ('Linear', '_lr', 'Linear Regression')}
+LABELS = {'AADT_HDV': ('hdv', 'AADT HDV'), 'AADT_MDV': ('mdv', 'AADT MDV')}
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
+GRID_BINS = 60
+
+parser = argparse.ArgumentParser(description="Regenerate the binned figures")
+parser.add_argument('--figures', nargs='+', choices=['scatter', 'hexbin', 'error_map', 'boxplot', 'residual_lowess'], default=['scatter', 'hexbin', 'error_map', 'boxplot', 'residual_lowess'], help='Figures to draw')
+parser.add_argument('--models', nargs='+', choices=list(MODELS), default=list(MODELS), help='Models of the error maps and boxplots')
+parser.add_argument('--response-vars', nargs='+', default=list(LABELS), help='Response variables of the error maps and boxplots')
+parser.add_argument('--lowess-method', choices=['binned', 'delta'], default='binned', help='Approximation of the residual LOWESS (see utils/diagnostics.py)')
+parser.add_argument('--cache-dir', type=Path, default=Path('../../data/results/figure_cache'), help='Directory of the binned arrays')
+parser.add_argument('--refresh', action='store_true', help='Rebuild the binned arrays even when the cache is valid')
+parser.add_argument('--output', type=Path, default=Path('../../figs'), help='Output directory of the figures')
+
+
+def bin_density_grid():
+    """
+    Summary: The log HDV / log MDV grid of all road links, streamed from hpms_aadt_imputed.csv
+    """
+    path = HPMS_DIR / 'hpms_aadt_imputed.csv'
+    signature = {'source': figures.source_signature(path), 'bins': GRID_BINS, 'extent': [0, 11, 0, 11]}
+    compute = lambda: figures.histogram2d(pd.read_csv(path, usecols=['AADT_HDV', 'AADT_MDV'], chunksize=1000000),
+                                          'AADT_HDV', 'AADT_MDV', bins=GRID_BINS, extent=(0, 11, 0, 11))
+    return figures.cached_bins(args.cache_dir / 'aadt_hdv_mdv_grid.npz', compute, signature, args.refresh)
+
+
+class Predictions:
+    """
+    Summary: The test-set predictions of a model, computed only on a cache miss (the subset data is loaded once)
+    """
+
+    predictor = None
+
+    @classmethod
+    def get(cls, response_var, model_type):
+        if cls.predictor is None:
+            cls.predictor = ap.AADTPredictor(HPMS_DIR / 'hpms_aadt_subset.csv', response_var, random_state=RANDOM_STATE)
+        predictor = cls.predictor
+        predictor.response_var = response_var
+        predictor.subset_train_data()
+        predictor.split_data(RF_PREDICTOR_VARS, test_size=TEST_SIZE)
+        predictor.initialize_model(model_type)
+        predictor.fit_model()
+
+        test = predictor.data.loc[predictor.X_test.index, ['GEOID', 'F_SYSTEM', 'THROUGH_LANES', 'AADT']].copy()
+        test['observed'] = predictor.y_test.to_numpy()
+        test['predicted'] = predictor.predict(predictor.X_test)
+        return test
+
+
+def bin_predictions(test):
+    """
+    Summary: The per-county errors and the per-group observed / predicted histograms of the boxplot panels
+    """
+    edges = figures.value_edges(max(test['observed'].max(), test['predicted'].max()))
+    arrays = {f"county_{k}": v for k, v in figures.group_errors(test['GEOID'], test['observed'], test['predicted']).items()}
+
+    # Total AADT in four equal-width classes (in thousands)
+    aadt = test['AADT'].to_numpy(dtype=np.float64)
+    aadt_edges = np.linspace(0, aadt.max(), 5)
+    aadt_class = figures.bin_index(aadt, 0, aadt.max(), 4)
+    panels = {
+        'lanes': test['THROUGH_LANES'].to_numpy(dtype=np.int64),
+        'fsystem': test['F_SYSTEM'].astype(int).to_numpy(),
+        'aadt': aadt_class,
+    }
+    for name, keys in panels.items():
+        groups, observed = figures.group_histograms(keys, test['observed'], edges)
+        _, predicted = figures.group_histograms(keys, test['predicted'], edges)
+        arrays.update({f"{name}_groups": groups, f"{name}_observed": observed, f"{name}_predicted": predicted})
+    arrays['edges'] = edges
+    arrays['aadt_edges'] = aadt_edges
+    return arrays
+
+
+def bin_model(response_var, model):
+    model_type = MODELS[model][0]
+    path = HPMS_DIR / 'hpms_aadt_subset.csv'
+    signature = {'source': figures.source_signature(path), 'response_var': response_var, 'model': model_type,
+                 'predictors': RF_PREDICTOR_VARS, 'test_size': TEST_SIZE, 'random_state': RANDOM_STATE, 'box_bins': figures.BOX_BINS}
+    compute = lambda: bin_predictions(Predictions.get(response_var, model_type))
+    return figures.cached_bins(args.cache_dir / f"{response_var}_{model}_errors.npz", compute, signature, args.refresh)
+
+
+def bin_residuals(response_var, models):
+    """
+    Summary: The residual LOWESS of the models (one call over the shared observed values)
+    """
+    path = HPMS_DIR / 'hpms_aadt_subset.csv'
+    signature = {'source': figures.source_signature(path), 'response_var': response_var, 'models': models, 'predictors': RF_PREDICTOR_VARS,
+                 'test_size': TEST_SIZE, 'random_state': RANDOM_STATE, 'method': args.lowess_method, 'frac': diagnostics.FRAC,
+                 'it': diagnostics.ITERATIONS, 'n_bins': diagnostics.N_BINS, 'n_grid': diagnostics.N_GRID}
+
+    def compute():
+        # The split is seeded, so every model is tested on the same rows
+        tests = {model: Predictions.get(response_var, MODELS[model][0]) for model in models}
+        observed = next(iter(tests.values()))['observed'].to_numpy()
+        predictions = {model: test['predicted'].to_numpy() for model, test in tests.items()}
+        return diagnostics.residual_diagnostics(observed, predictions, method=args.lowess_method, seed=RANDOM_STATE)
+
+    return figures.cached_bins(args.cache_dir / f"{response_var}_residual_lowess_{args.lowess_method}.npz", compute, signature, args.refresh)
+
+
+def load_counties():
+    counties = load_data(HPMS_DIR / 'HPMS.gdb', 'US_census_county_2020')[['GEOID', 'geometry']].to_crs('EPSG:5070')
+    # The map is drawn at ~1 km per pixel; simplified county outlines draw in a fraction of the time
+    counties['geometry'] = reduce_geometry(counties.geometry.values, grid_size=10, tolerance=200)
+    return counties
+
+
+def main():
+    global args
+    args = parser.parse_args()
+    args.output.mkdir(parents=True, exist_ok=True)
+
+    if {'scatter', 'hexbin'} & set(args.figures):
+        grid = bin_density_grid()
+        if 'scatter' in args.figures:
+            figures.plot_density_grid(grid, args.output / 'hdv_mdv_scatter.png', 'log HDV and MDV AADT', 'log(HDV AADT)', 'log(MDV AADT)')
+        if 'hexbin' in args.figures:
+            figures.plot_density_marginals(grid, args.output / 'hexbin_AADT_HDV_MDV.png', 'log HDV and MDV AADT Hexbin', 'log(HDV AADT)', 'log(MDV AADT)')
+
+    counties = load_counties() if 'error_map' in args.figures else None
+    for response_var in args.response_vars:
+        suffix, label = LABELS[response_var]
+        if 'residual_lowess' in args.figures:
+            residuals = bin_residuals(response_var, args.models)
+            for model in args.models:
+                _, file_suffix, model_name = MODELS[model]
+                diagnostics.plot_residual_lowess(residuals, model, args.output / f"residual_lowess_{suffix}{file_suffix}.png",
+                                                 f"Residuals vs Observed {label} - {model_name}", f"Observed {label}")
+        if not {'error_map', 'boxplot'} & set(args.figures):
+            continue
+        for model in args.models:
+            _, file_suffix, model_name = MODELS[model]
+            binned = bin_model(response_var, model)
+            if 'error_map' in args.figures:
+                errors = {k[len('county_'):]: v for k, v in binned.items() if k.startswith('county_')}
+                figures.plot_error_map(counties, errors, args.output / f"error_map_{suffix}{file_suffix}.png",
+                                       f"Mean Absolute Percentage Error (MAPE) of {label} - {model_name}")
+            if 'boxplot' in args.figures:
+                aadt_edges = binned['aadt_edges'] / 1000
+                aadt_labels = [f"{aadt_edges[g]:.0f}-{aadt_edges[g + 1]:.0f}" for g in binned['aadt_groups']]
+                panels = [
+                    ('Through Lanes', binned['lanes_groups'], binned['lanes_observed'], binned['lanes_predicted'], binned['edges']),
+                    ('F System', binned['fsystem_groups'], binned['fsystem_observed'], binned['fsystem_predicted'], binned['edges']),
+                    ('Total AADT (1e3)', aadt_labels, binned['aadt_observed'], binned['aadt_predicted'], binned['edges']),
+                ]
+                figures.plot_boxplots(panels, args.output / f"boxplot_{suffix}{file_suffix}.png",
+                                      f"{label} Observed vs Predicted for each Predictor Variable - {model_name}", label)
+    print(f"Figures written to {args.output}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
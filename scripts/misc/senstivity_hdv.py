@@ -30,6 +30,8 @@ if parent_dir not in sys.path:
 
 # Now you can import the module as if it was in the same directory
 import utils.aadt_predictor as ap
+# Serves live progress on localhost when HPMS_METRICS_PORT is set
+import utils.metrics as metrics
 
 NUM_JOBS = int(os.getenv('SLURM_NTASKS')) if os.getenv('SLURM_NTASKS') else -1
 
@@ -48,7 +50,7 @@ response_var = RESPONSE_VARS[1]
 predictor.response_var = response_var
 predictor.subset_train_data()
 
-for error in tqdm.tqdm(ERROR_SCOPE):
+for i, error in enumerate(tqdm.tqdm(ERROR_SCOPE)):
         
     predictor.split_data(RF_PREDICTOR_VARS, state_fips= None, test_size=0.2)
     predictor.initialize_model('Random Forest', n_jobs = NUM_JOBS)
@@ -73,6 +75,7 @@ for error in tqdm.tqdm(ERROR_SCOPE):
         'mae': mae,
         'run': run
     })
+    metrics.set_progress(i + 1, len(ERROR_SCOPE))
 
 results_hdv_perturb_df = pd.DataFrame(results_hdv_perturb)
 results_hdv_perturb_df.to_csv(f'../../data/results/sensitivity_results_HDV_perturb_{run}.csv', index = False)
\ No newline at end of file
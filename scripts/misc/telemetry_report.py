@@ -0,0 +1,41 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script prints where a pipeline run spent its time from the JSON lines written by utils/telemetry.py (run any script with
+HPMS_TELEMETRY=<file> to record them).
+
+<LICENSE>
+"""
+import sys
+import argparse
+from pathlib import Path
+
+# Get the absolute path of the parent directory
+parent_dir = str(Path(__file__).resolve().parent.parent)
+
+# Add the parent directory to sys.path
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from utils.telemetry import load_records, print_summary
+
+parser = argparse.ArgumentParser(description="Summarize a telemetry file")
+parser.add_argument('path', type=Path, help='The JSON lines file written by utils/telemetry.py')
+parser.add_argument('--run-id', type=str, default=None, help='The run to summarize (defaults to the last run)')
+parser.add_argument('--list-runs', action='store_true', help='List the runs in the file')
+
+
+def main():
+    args = parser.parse_args()
+    if args.list_runs:
+        records = load_records(args.path)
+        records['top_level_s'] = records['wall_s'].where(records['depth'] == 0, 0)
+        runs = records.groupby('run_id', sort=False).agg(start=('start', 'min'), stages=('stage', 'size'), wall_s=('top_level_s', 'sum'))
+        print(runs.to_string())
+        return
+    print_summary(args.path, args.run_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script is the geometry reduction stage run before the overlays. It reads layers of a file geodatabase (by default the HPMS links
+subset to the states and the census counties, urban areas and blocks), snaps their coordinates to a grid and simplifies them in the projected
+Albers CRS (utils/geometry.py), and writes each reduced layer back as <layer>_reduced together with a per-feature report of the vertex, length
+and area change (<layer>_reduced.csv next to the geodatabase). compile_raw_data.py --reduce and compile_traffic_density.py --reduce run the
+same reduction inside the pipeline and overlay the reduced layers; this script reduces existing layers on their own, e.g. to inspect the
+reports first.
+
+<LICENSE>
+"""
+import json
+import argparse
+import pyogrio
+from pathlib import Path
+from utils.geometry import reduce_gdb_layer, GRID_SIZE, TOLERANCE
+from utils.telemetry import print_summary
+
+parser = argparse.ArgumentParser(description="Snap and simplify the geometry of the overlay inputs")
+parser.add_argument('--gdb', type=Path, nargs='+', default=[Path('../data/processed_data/HPMS/HPMS.gdb'), Path('../data/processed_data/Traffic_Density/Traffic_Density.gdb')], help='File geodatabases')
+parser.add_argument('--layers', nargs='+', default=['HPMS_2018_state_sub_proj', 'US_census_county_2020', 'US_census_uac_2010', 'US_census_block_2020'], help='Layers to reduce (the layers found in one of the geodatabases)')
+parser.add_argument('--grid-size', type=float, default=GRID_SIZE, help='Grid size of the coordinates in meters (0 keeps full precision)')
+parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='Simplification tolerance in meters (0 skips the simplification)')
+
+
+def main():
+    args = parser.parse_args()
+
+    summaries = {}
+    for gdb in args.gdb:
+        available = set(pyogrio.list_layers(gdb)[:, 0]) if gdb.exists() else set()
+        for layer in [l for l in args.layers if l in available]:
+            print(f"Reducing {gdb.name}/{layer}...", flush=True)
+            summaries[layer] = reduce_gdb_layer(gdb, layer, args.grid_size, args.tolerance)
+
+    missing = set(args.layers) - set(summaries)
+    if missing:
+        print(f"WARNING: Layers not found: {sorted(missing)}", flush=True)
+    print(json.dumps(summaries, indent=2))
+    print_summary()
+
+
+if __name__ == '__main__':
+    main()
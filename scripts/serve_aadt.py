@@ -0,0 +1,41 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script serves AADT_MDV and AADT_HDV estimates for new or edited road segments on localhost, from the models exported by impute_hpms.py --export-models.
+
+<LICENSE>
+"""
+import argparse
+import time
+from pathlib import Path
+from utils.prediction_service import PredictionService, serve
+
+parser = argparse.ArgumentParser(description="Local AADT_MDV / AADT_HDV prediction service")
+parser.add_argument('--model-dir', type=Path, default=Path('../data/processed_data/HPMS/models'), help='Directory of the exported models')
+parser.add_argument('--host', default='127.0.0.1', help='Interface to bind')
+parser.add_argument('--port', type=int, default=8000, help='Port to bind')
+parser.add_argument('--cache-size', type=int, default=100000, help='Number of feature tuples kept in the LRU cache')
+parser.add_argument('--max-batch-rows', type=int, default=8192, help='Maximum rows per micro-batch')
+parser.add_argument('--max-wait-ms', type=float, default=2.0, help='Time a request waits for others to join its micro-batch')
+
+def main():
+    args = parser.parse_args()
+
+    service = PredictionService.from_directory(args.model_dir,
+                                               cache_size = args.cache_size,
+                                               max_batch_rows = args.max_batch_rows,
+                                               max_wait_ms = args.max_wait_ms)
+    server = serve(service, args.host, args.port)
+    print(f"Serving {service.response_vars} on http://{args.host}:{server.server_address[1]}", flush=True)
+
+    try:
+        while True:
+            time.sleep(60)
+            print(service.stats(), flush=True)
+    except KeyboardInterrupt:
+        server.shutdown()
+        service.close()
+
+if __name__ == '__main__':
+    main()
@@ -16,8 +16,10 @@ import numpy as np
 import us
 from pathlib import Path
 from utils.utils import load_data
+from utils.telemetry import instrument, n_rows, print_summary
 
 
+@instrument("preprocess", rows_in=n_rows, rows_out=lambda result, *args: n_rows(result))
 def correct_hpms_columns(hpms):
     """
     Summary: This function corrects the columns in the HPMS dataset to ensure that the data is in the correct format for analysis.
@@ -58,6 +60,7 @@ def correct_hpms_columns(hpms):
     return hpms
 
 
+@instrument("uac_merge", rows_in=lambda hpms, hpms_uac: n_rows(hpms), rows_out=lambda result, *args: n_rows(result))
 def merge_uac_data(hpms, hpms_uac):
     """
     Summary: This function merges the HPMS dataset with the urban area codes dataset to add urban area codes to the road links in the network.
@@ -81,6 +84,7 @@ def merge_uac_data(hpms, hpms_uac):
     return hpms
 
 
+@instrument("calculate_vkt", rows_in=n_rows)
 def calculate_vkt_vmt(hpms):
     """
     Summary: This function calculates the vehicle kilometers traveled (VKT) and vehicle miles traveled (VMT) for the HPMS dataset.
@@ -102,6 +106,7 @@ def calculate_vkt_vmt(hpms):
     return hpms
 
 
+@instrument("subset", rows_in=n_rows, rows_out=lambda result, *args: n_rows(result))
 def subset_hpms(hpms):
     '''
     Summary: This function subsets the HPMS dataset to remove links with AADT values that are less than zero or greater than the sum of AADT_HDV and AADT_MDV.
@@ -205,6 +210,7 @@ def main():
     hpms_sub = subset_hpms(hpms_intx)
 
     hpms_sub.to_csv(HPMS_DIR / "hpms_aadt_subset.csv", index=False)
+    print_summary()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script updates the census block traffic density incrementally. Per-state content hashes of the census blocks and the imputed
+HPMS road links are compared with those of the previous run; only the changed states, and the blocks of neighboring states within the buffer
+distance of their links, are overlaid and aggregated again, and the result is merged into the national traffic_density.parquet.
+The first run computes every state.
+
+<LICENSE>
+"""
+import argparse
+import geopandas as gpd
+from pathlib import Path
+from utils.utils import load_data
+from utils.incremental import update_density
+
+parser = argparse.ArgumentParser(description="Incremental census block traffic density update")
+parser.add_argument('--distance', type=float, nargs='+', default=[250], help='Buffer distance(s) in meters')
+parser.add_argument('--kernel', choices=['buffer', 'dwithin'], default='buffer', help='Overlay kernel')
+parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+parser.add_argument('--no-apportion', action='store_true', help="Add each link's full VKT to every block buffer it crosses")
+
+BLOCK_FIELDS = ['GEOID20', 'Area_Land_Orig']
+LINK_FIELDS = ['FID_Link_Cnty_Intxn', 'STATEFP', 'Shape_Length_New', 'VKT_TOTAL', 'VKT_LDV', 'VKT_MDV', 'VKT_HDV']
+
+def main():
+    args = parser.parse_args()
+
+    TD_DIR = Path('../data/processed_data/Traffic_Density')
+    TD_GDB = TD_DIR / 'Traffic_Density.gdb'
+    HPMS_PARQUET = Path('../data/processed_data/HPMS/hpms_aadt_imputation.parquet')
+
+    print('Loading census blocks and road links...', flush=True)
+    blocks = load_data(TD_GDB, 'US_census_block_2020')[BLOCK_FIELDS + ['geometry']]
+    links = gpd.read_parquet(HPMS_PARQUET, columns=LINK_FIELDS + ['geometry'])
+    links = links.rename(columns={'VKT_TOTAL': 'VKT'}).to_crs(blocks.crs)
+
+    update_density(blocks, links, TD_DIR / 'incremental',
+                   distance = args.distance[0] if len(args.distance) == 1 else args.distance,
+                   kernel = args.kernel,
+                   n_workers = args.workers,
+                   apportion = not args.no_apportion)
+
+if __name__ == '__main__':
+    main()
@@ -2,32 +2,130 @@
 HPMS Data Paper
 by Aviral Chawla, Meg Fay, and Britanny Antonczak
 
-Summary: This script contains the AADTPredictor class that is used to predict the AADT values using the Random Forest and Linear Regression models.
+Summary: This script contains the AADTPredictor class that is used to predict the AADT values using the Random Forest, Linear Regression (pooled or
+one per state with utils.grouped_linear) and Histogram Gradient Boosting models.
 
 <LICENSE>
 """
+import os
 import pandas as pd
+import psutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
 from sklearn.model_selection import KFold
 from sklearn.model_selection import cross_validate
 from sklearn.model_selection import GridSearchCV
 from pathlib import Path
+from utils.forest_store import save_forest, prune_to_size, SUPPORTED_MODELS
+from utils.forest_inference import ForestEngine, HAS_NUMBA
+from utils.grouped_linear import GroupedLinearRegression
+from utils.telemetry import instrument, n_rows
+from utils import metrics
+from utils import evaluation
+
+# Predictors with a small, fixed set of levels that tree models can split on natively
+CATEGORICAL_VARS = ["STATEFP", "F_SYSTEM"]
+
+# Approximate bytes per node of a fitted scikit-learn tree (node struct + leaf value)
+TREE_NODE_BYTES = 72
+
+
+@instrument("fit_state", rows_in=lambda state_fips, model_class, params, X, y: n_rows(X))
+def _fit_state_model(state_fips, model_class, params, X, y):
+    """
+    Summary: Fit one state model (runs inside a worker process)
+    Input:
+        - state_fips (str): The state FIPS code of the data
+        - model_class: The estimator class to fit
+        - params (dict): Keyword arguments to pass to the model
+        - X (DataFrame): The predictor variables of the state
+        - y (Series): The response variable of the state
+    Output:
+        - state_fips (str): The state FIPS code
+        - model: The fitted estimator
+    """
+    model = model_class(**params)
+    model.fit(X, y)
+    return state_fips, model
+
+
+def estimate_model_memory(n_rows, n_features, params):
+    """
+    Summary: Rough upper bound of the memory needed to fit one model, used to size the process pool
+    Input:
+        - n_rows (int): The number of training rows
+        - n_features (int): The number of predictor variables
+        - params (dict): The model parameters
+    Output:
+        - n_bytes (int): Estimated peak memory of the fit in bytes
+    """
+    # Training data copies made by the worker and by scikit-learn (float32 + float64)
+    data_bytes = n_rows * n_features * 12 + n_rows * 16
+    n_estimators = params.get("n_estimators", 100)
+    if "n_estimators" not in params and "max_iter" in params:
+        return 4 * data_bytes
+
+    # A fully grown tree on a bootstrap sample has ~2 * 0.632 * n / min_samples_leaf nodes
+    min_samples_leaf = params.get("min_samples_leaf", 1)
+    if isinstance(min_samples_leaf, float):
+        min_samples_leaf = max(int(min_samples_leaf * n_rows), 1)
+    nodes_per_tree = 2 * 0.632 * n_rows / min_samples_leaf
+    max_depth = params.get("max_depth")
+    if max_depth is not None:
+        nodes_per_tree = min(nodes_per_tree, 2 ** (max_depth + 1))
+    return int(2 * data_bytes + n_estimators * nodes_per_tree * TREE_NODE_BYTES)
 
 
 class AADTPredictor:
+    # Estimators available to initialize_model; extend with register_model
+    model_dict = {
+        "Random Forest": RandomForestRegressor,
+        "Linear": LinearRegression,
+        "Hist Gradient Boosting": HistGradientBoostingRegressor,
+        "Grouped Linear": GroupedLinearRegression,
+    }
+    # Default keyword arguments per model type, overridden by those passed to initialize_model
+    model_defaults = {
+        "Hist Gradient Boosting": {"categorical_features": CATEGORICAL_VARS},
+        "Grouped Linear": {"group_vars": ("STATEFP",)},
+    }
+
     def __init__(self, data_path: Path, response_var, random_state: int = 42):
         self.data_path = data_path
         self.data = None
         self.data_full = None
         self.response_var = response_var
         self.model = None
+        self.model_type = None
+        self.predictor_vars = None
+        self.state_models = {}
+        # The ForestEngine of each fitted tree model (flattening a forest copies all its nodes, so it is done once per fit)
+        self.engines = {}
         self.random_state = random_state
 
-        self._load_data()
+        if data_path is not None:
+            self._load_data()
 
+    @classmethod
+    def from_dataframe(cls, data, response_var, random_state: int = 42):
+        """
+        Summary: Create a predictor from an in-memory frame with the columns of hpms_aadt_subset.csv (e.g. utils.synthetic.make_training_frame)
+        Input:
+            - data (DataFrame): The AADT data
+            - response_var (str): The response variable
+            - random_state (int): The random state
+        Output:
+            - predictor (AADTPredictor): The predictor with the data pre-processed
+        """
+        predictor = cls(None, response_var, random_state=random_state)
+        predictor.data_full = data.copy()
+        predictor._pre_process_data()
+        return predictor
+
+    @instrument("load", rows_out=lambda result, self: n_rows(self.data_full))
     def _load_data(self):
         """
         Summary: Load the AADT subset data
@@ -48,6 +146,7 @@ class AADTPredictor:
         except Exception as e:
             print(f"ERROR: The data could not be loaded. {e}", flush=True)
 
+    @instrument("preprocess", rows_in=lambda self: n_rows(self.data_full), rows_out=lambda result, self: n_rows(self.data))
     def _pre_process_data(self):
         """
         Summary: Set the data types for the columns
@@ -94,6 +193,11 @@ class AADTPredictor:
         except Exception as e:
             print(f"ERROR: The data could not be subsetted. {e}", flush=True)
 
+    @instrument(
+        "split",
+        rows_in=lambda self, *args, **kwargs: n_rows(self.data),
+        rows_out=lambda result, self, *args, **kwargs: n_rows(self.X_train) + n_rows(self.X_test),
+    )
     def split_data(
         self, predictor_vars, test_size=0.2, state_fips=None, stratify_by_state=False
     ):
@@ -110,6 +214,7 @@ class AADTPredictor:
             f"Training and testing data split with test size {test_size} on State {state_fips} and {'not' if not stratify_by_state else ''} stratified ...",
             flush=True,
         )
+        self.predictor_vars = list(predictor_vars)
         if state_fips:
             try:
                 data = self.data[self.data["STATEFP"] == state_fips]
@@ -126,33 +231,251 @@ class AADTPredictor:
             stratify=data["STATEFP"] if stratify_by_state else None,
         )
 
+    @classmethod
+    def register_model(cls, model_type, model_class, **defaults):
+        """
+        Summary: Register an estimator so that it can be selected in initialize_model
+        Input:
+            - model_type (str): The name used to select the model
+            - model_class: A scikit-learn compatible regressor class
+            - **defaults: Default keyword arguments to pass to the model
+        """
+        cls.model_dict = {**cls.model_dict, model_type: model_class}
+        cls.model_defaults = {**cls.model_defaults, model_type: defaults}
+
+    def _model_params(self, model_type, kwargs):
+        """
+        Summary: Merge the default and user keyword arguments of a model type
+        Input:
+            - model_type (str): The type of model to use
+            - kwargs (dict): The keyword arguments passed by the user
+        Output:
+            - params (dict): The keyword arguments to pass to the model
+        """
+        params = {**self.model_defaults.get(model_type, {}), **kwargs}
+
+        # Only declare the categorical predictors that are actually in the design matrix
+        if "categorical_features" in params and "categorical_features" not in kwargs:
+            if self.predictor_vars is not None:
+                params["categorical_features"] = [
+                    var for var in params["categorical_features"] if var in self.predictor_vars
+                ] or None
+        return params
+
     def initialize_model(self, model_type, **kwargs):
         """
         Summary: Initialize the selected model
         Input:
-            - model_type (str): The type of model to use. Supported models are "Random Forest" and "Linear Regression"
+            - model_type (str): The type of model to use. Supported models are the keys of model_dict ("Random Forest", "Linear", "Hist Gradient Boosting" and
+              "Grouped Linear", one linear model per group_vars, e.g. ("STATEFP", "F_SYSTEM"))
             - **kwargs: Additional keyword arguments to pass to the model
         """
-        model_dict = {
-            "Random Forest": RandomForestRegressor,
-            "Linear": LinearRegression,
-        }
+        params = self._model_params(model_type, kwargs)
+        self.engines = {}
         try:
-            self.model = model_dict[model_type](**kwargs)
-            print(f"{model_type} model initialized with- {kwargs}", flush=True)
+            self.model = self.model_dict[model_type](**params)
+            self.model_type = model_type
+            print(f"{model_type} model initialized with- {params}", flush=True)
         except Exception as e:
             print(f"ERROR: The model could not be initialized. {e}", flush=True)
 
+    @instrument("fit", rows_in=lambda self, **kwargs: n_rows(self.X_train))
     def fit_model(self, **kwargs):
         """
         Summary: Fit the model to the data
         """
+        self.engines.pop(id(self.model), None)
         try:
             self.model.fit(self.X_train, self.y_train, **kwargs)
             print("Model trained successfully", flush=True)
         except Exception as e:
             print(f"ERROR: The model could not be trained. {e}", flush=True)
 
+    @instrument("fit_state_models", rows_in=lambda self, *args, **kwargs: n_rows(self.data), rows_out=lambda result, *args, **kwargs: len(result))
+    def fit_state_models(
+        self,
+        predictor_vars,
+        model_type="Random Forest",
+        min_train_rows=1000,
+        n_workers=None,
+        memory_limit_gb=None,
+        **kwargs,
+    ):
+        """
+        Summary: Train one model per state concurrently on a process pool. States with fewer than min_train_rows training rows fall back to a national model (self.model).
+        Input:
+            - predictor_vars (list): The predictor variables
+            - model_type (str): The type of model to use (see initialize_model)
+            - min_train_rows (int): The minimum number of training rows for a state to get its own model
+            - n_workers (int): The maximum number of worker processes (defaults to the number of CPUs)
+            - memory_limit_gb (float): Memory available to the workers (defaults to 80% of the available memory)
+            - **kwargs: Additional keyword arguments to pass to the models
+        Output:
+            - state_models (dict): The fitted model of each state with enough training data
+        """
+        self.predictor_vars = list(predictor_vars)
+        self.model_type = model_type
+        params = self._model_params(model_type, kwargs)
+        self.engines = {}
+
+        # Group the training rows by state once instead of filtering the frame for every state
+        state_rows = self.data.groupby("STATEFP", observed=True, sort=True).indices
+        state_sizes = {state: len(rows) for state, rows in state_rows.items()}
+        large_states = [s for s, n in state_sizes.items() if n >= min_train_rows]
+        small_states = [s for s, n in state_sizes.items() if n < min_train_rows]
+
+        # States with missing values but no training rows at all also need the national model
+        missing_states = self.data_full.loc[self.data_full[self.response_var].isna(), "STATEFP"]
+        fallback_states = sorted(set(small_states) | (set(missing_states.unique()) - set(large_states)))
+
+        self.model = None
+        if fallback_states:
+            print(
+                f"States below {min_train_rows} training rows use the national model: {fallback_states}",
+                flush=True,
+            )
+            self.split_data(predictor_vars, test_size=1e-10)
+            self.initialize_model(model_type, **kwargs)
+            self.fit_model()
+
+        self.state_models = {}
+        if not large_states:
+            return self.state_models
+
+        # Size the pool so that the largest concurrent fits still fit in memory
+        if memory_limit_gb is None:
+            memory_budget = 0.8 * psutil.virtual_memory().available
+        else:
+            memory_budget = memory_limit_gb * 1024**3
+        worker_params = {**params, "n_jobs": 1} if "n_jobs" in self.model_dict[model_type]().get_params() else params
+        model_memory = estimate_model_memory(
+            max(state_sizes[s] for s in large_states), len(predictor_vars), worker_params
+        )
+        max_workers = min(
+            n_workers or os.cpu_count() or 1,
+            len(large_states),
+            max(int(memory_budget // max(model_memory, 1)), 1),
+        )
+        print(
+            f"Training {len(large_states)} state models on {max_workers} processes (~{model_memory / 1024**3:.2f} GB per model)",
+            flush=True,
+        )
+
+        X = self.data[predictor_vars]
+        y = self.data[self.response_var]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # Submit the largest states first so that they do not end up as stragglers
+            futures = [
+                executor.submit(
+                    _fit_state_model,
+                    state,
+                    self.model_dict[model_type],
+                    worker_params,
+                    X.iloc[state_rows[state]],
+                    y.iloc[state_rows[state]],
+                )
+                for state in sorted(large_states, key=state_sizes.get, reverse=True)
+            ]
+            metrics.set_progress(0, len(futures))
+            for i, future in enumerate(as_completed(futures), 1):
+                metrics.set_progress(i, len(futures))
+                try:
+                    state, model = future.result()
+                    self.state_models[state] = model
+                    print(f"Model trained successfully for state {state}", flush=True)
+                except Exception as e:
+                    print(f"ERROR: A state model could not be trained. {e}", flush=True)
+
+        return self.state_models
+
+    @instrument("impute", rows_out=lambda result, *args, **kwargs: result)
+    def impute_by_state(self, predictor_vars=None):
+        """
+        Summary: Impute the missing response values of each state from its own model, or from the national model for states without one
+        Input:
+            - predictor_vars (list): The predictor variables (defaults to those used for training)
+        Output:
+            - n_imputed (int): The number of imputed values
+        """
+        predictor_vars = list(predictor_vars or self.predictor_vars)
+        missing_data = self.data_full[self.data_full[self.response_var].isna()]
+
+        n_imputed = 0
+        for state, rows in missing_data.groupby("STATEFP", observed=True, sort=True).indices.items():
+            model = self.state_models.get(state, self.model)
+            if model is None:
+                print(f"ERROR: No model available to impute state {state}", flush=True)
+                continue
+            state_missing = missing_data.iloc[rows]
+            try:
+                self.data_full.loc[state_missing.index, self.response_var] = self.predict(
+                    state_missing[predictor_vars], model=model
+                )
+                n_imputed += len(rows)
+                print(f"Imputed {len(rows)} missing values for state {state}", flush=True)
+            except Exception as e:
+                print(f"ERROR: Could not impute missing values for state {state}. {e}", flush=True)
+        return n_imputed
+
+    def _engine(self, model):
+        """
+        Summary: The cached ForestEngine of a fitted tree model, built on first use
+        """
+        cached = self.engines.get(id(model))
+        if cached is None or cached[0] is not model:
+            cached = self.engines[id(model)] = (model, ForestEngine.from_model(model))
+        return cached[1]
+
+    @instrument("predict", rows_in=lambda self, X, *args, **kwargs: n_rows(X))
+    def predict(self, X, model=None):
+        """
+        Summary: Predict with a fitted model. When Numba is installed, forests are evaluated with the compiled ForestEngine (bit-identical
+        to model.predict and faster); without Numba the engine's NumPy backend is no faster than scikit-learn, so model.predict is used.
+        The engine of each model is cached until the model is refit with fit_model / fit_state_models (refitting the model object
+        directly needs predictor.engines.clear()).
+        Input:
+            - X (DataFrame): The predictor variables
+            - model: The fitted model to use (defaults to self.model)
+        Output:
+            - y_pred (array): The predictions
+        """
+        model = self.model if model is None else model
+        if HAS_NUMBA and isinstance(model, SUPPORTED_MODELS):
+            return self._engine(model).predict(X)
+        return model.predict(X)
+
+    def export_model(self, path: Path, max_size_mb=None, X_val=None, y_val=None, model=None):
+        """
+        Summary: Export the fitted tree model in the compact, memory-mappable format of utils.forest_store
+        Input:
+            - path (Path): The output directory
+            - max_size_mb (float): Optionally truncate the trees so that the exported arrays fit in this size
+            - X_val, y_val: The data used to report the accuracy cost of the truncation (defaults to the test set)
+            - model: The fitted model to export (defaults to self.model; e.g. a model of self.state_models)
+        Output:
+            - report (dict): The size of the export and, when pruned, the accuracy before and after pruning
+        """
+        metadata = {
+            "feature_names": self.predictor_vars,
+            "response_var": self.response_var,
+            "model_type": self.model_type,
+        }
+        model = self.model if model is None else model
+        if max_size_mb is None:
+            forest = save_forest(model, path, **metadata)
+            report = {"bytes": int(forest.nbytes)}
+        else:
+            forest, report = prune_to_size(
+                model,
+                max_size_mb * 1024**2,
+                self.X_test if X_val is None else X_val,
+                self.y_test if y_val is None else y_val,
+                **metadata,
+            )
+            forest.save(path)
+        print(f"Model exported to {path}: {report}", flush=True)
+        return report
+
     def test_model(self):
         """
         Summary: Test the model
@@ -167,6 +490,24 @@ class AADTPredictor:
         mse = mean_squared_error(self.y_test, y_pred)
         return r2, mae, mse
 
+    def evaluate_by_group(self, by=("STATEFP", "F_SYSTEM", "URBAN"), n_boot=0, ci=evaluation.CI, X=None, y=None):
+        """
+        Summary: Evaluate the model overall and per group (e.g. state, functional system, urban class) in one pass over the test set
+        Input:
+            - by (list): The groupings, each a column of the data or a list of columns (see utils.evaluation.evaluate)
+            - n_boot (int): The number of bootstrap resamples of the confidence intervals (0 for none)
+            - ci (float): The confidence level
+            - X, y: The data to evaluate (defaults to the test set); the group columns are taken from the data by index
+        Output:
+            - table (DataFrame): grouping, group, n, metric, value (and ci_low, ci_high) of every group and metric
+        """
+        X = self.X_test if X is None else X
+        y = self.y_test if y is None else y
+        columns = sorted({c for grouping in by for c in ([grouping] if isinstance(grouping, str) else grouping)})
+        return evaluation.evaluate(
+            y, self.predict(X), self.data_full.loc[X.index, columns], by=by, n_boot=n_boot, ci=ci, seed=self.random_state
+        )
+
     def cross_validate_model(self, n_splits):
         """
         Summary: Cross validate the model
@@ -0,0 +1,342 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains helper functions to benchmark the estimators used by the AADTPredictor class (fit time, predict throughput, model size and accuracy),
+to profile pipeline stages (wall time, CPU time and peak memory) into a JSON history that can be compared between commits, and to size the
+compute requests of AADTPredictor fits from scaling runs on synthetic data.
+
+<LICENSE>
+"""
+import json
+import pickle
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import psutil
+from sklearn.base import clone
+from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
+from utils import synthetic
+from utils.aadt_predictor import AADTPredictor
+
+
+def model_size_mb(model):
+    """
+    Summary: Size of the pickled model in megabytes
+    Input:
+        - model: A fitted estimator
+    Output:
+        - size (float): Size of the serialized model in MB
+    """
+    return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)) / 1024**2
+
+
+def benchmark_model(model, X_train, y_train, X_test, y_test, n_predict_repeats=3):
+    """
+    Summary: Fit a fresh copy of the model and measure its cost and accuracy on a fixed split
+    Input:
+        - model: An (unfitted) scikit-learn compatible estimator
+        - X_train, y_train: The training data
+        - X_test, y_test: The testing data
+        - n_predict_repeats (int): Number of prediction passes; the fastest one is reported
+    Output:
+        - results (dict): fit time, predict time, predict throughput, model size, r2, mae and rmse
+    """
+    model = clone(model)
+
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+
+    predict_time = np.inf
+    for _ in range(max(n_predict_repeats, 1)):
+        start = time.perf_counter()
+        y_pred = model.predict(X_test)
+        predict_time = min(predict_time, time.perf_counter() - start)
+
+    return {
+        "fit_time_s": fit_time,
+        "predict_time_s": predict_time,
+        "predict_rows_per_s": X_test.shape[0] / predict_time if predict_time > 0 else np.nan,
+        "model_size_mb": model_size_mb(model),
+        "r2": r2_score(y_test, y_pred),
+        "mae": mean_absolute_error(y_test, y_pred),
+        "rmse": float(np.sqrt(mean_squared_error(y_test, y_pred))),
+    }
+
+
+class _PeakRSS:
+    """
+    Summary: Samples the resident set size of this process (and its worker processes) in a background thread and keeps the peak
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = self.rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def rss(self):
+        total = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.rss())
+
+
+def profile_call(fn, *args, **kwargs):
+    """
+    Summary: Run a function and measure its wall time, CPU time and peak memory
+    Input:
+        - fn: The function to run
+        - args, kwargs: Its arguments
+    Output:
+        - result: The return value of fn
+        - profile (dict): wall_time_s, cpu_time_s (of this process), peak_rss_mb (of this process and its workers during the call) and
+          rss_increase_mb (peak over the starting RSS)
+    """
+    start_rss = psutil.Process().memory_info().rss
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    with _PeakRSS() as rss:
+        result = fn(*args, **kwargs)
+    profile = {
+        "wall_time_s": time.perf_counter() - start,
+        "cpu_time_s": time.process_time() - start_cpu,
+        "peak_rss_mb": rss.peak / 1024**2,
+        "rss_increase_mb": (rss.peak - start_rss) / 1024**2,
+    }
+    return result, profile
+
+
+def git_revision(path: Path = None):
+    """
+    Summary: The current git commit and whether the working tree has uncommitted changes
+    Input:
+        - path (Path): A directory inside the repository (defaults to this file's)
+    Output:
+        - revision (dict): commit (None outside of a git checkout) and dirty
+    """
+    cwd = Path(path) if path is not None else Path(__file__).resolve().parent
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.stdout.strip())}
+
+
+def load_history(path: Path):
+    """
+    Summary: Read a benchmark history (a JSON list of records), or an empty list if it does not exist
+    """
+    path = Path(path)
+    if not path.exists():
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def append_history(path: Path, records: list):
+    """
+    Summary: Append benchmark records to a JSON history, stamping them with the git revision and the time of the run
+    Input:
+        - path (Path): The history file
+        - records (list): The records (dicts) of this run
+    Output:
+        - history (list): The updated history
+    """
+    path = Path(path)
+    stamp = {**git_revision(), "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+    history = load_history(path) + [{**stamp, **record} for record in records]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(history, f, indent=1)
+    tmp_path.replace(path)
+    return history
+
+
+def compare_history(history: list, keys=("scale", "stage"), metrics=("wall_time_s", "peak_rss_mb"), baseline: str = None, candidate: str = None):
+    """
+    Summary: Compare the records of two commits in a benchmark history
+    Input:
+        - history (list): The benchmark records
+        - keys (list): The fields identifying a benchmark
+        - metrics (list): The fields to compare
+        - baseline (str): The baseline commit (prefix); defaults to the last commit before the candidate
+        - candidate (str): The candidate commit (prefix); defaults to the commit of the latest record
+    Output:
+        - comparison (DataFrame): The keys, each metric for both commits and their ratio (candidate / baseline); the latest record of each
+          benchmark is used
+    """
+    df = pd.DataFrame(history)
+    if df.empty or "commit" not in df:
+        return pd.DataFrame()
+    commits = list(dict.fromkeys(df["commit"].dropna()))
+    match = lambda prefix: next((c for c in reversed(commits) if c.startswith(prefix)), None)
+    candidate = match(candidate) if candidate else (commits[-1] if commits else None)
+    if baseline:
+        baseline = match(baseline)
+    else:
+        earlier = commits[: commits.index(candidate)] if candidate in commits else []
+        baseline = earlier[-1] if earlier else None
+    if candidate is None or baseline is None:
+        return pd.DataFrame()
+
+    keys, metrics = list(keys), list(metrics)
+    latest = lambda commit: df[df["commit"] == commit].groupby(keys, sort=False)[metrics].last()
+    comparison = latest(baseline).join(latest(candidate), how="inner", lsuffix="_base", rsuffix="_new")
+    for metric in metrics:
+        comparison[f"{metric}_ratio"] = comparison[f"{metric}_new"] / comparison[f"{metric}_base"]
+    comparison.attrs = {"baseline": baseline, "candidate": candidate}
+    return comparison.reset_index()
+
+
+def profile_aadt_fit(n_rows, n_estimators, max_depth, n_jobs, dtype="float64", response_var="AADT_HDV", predictor_vars=None,
+                     n_predict=200000, seed=0):
+    """
+    Summary: Fit an AADTPredictor Random Forest on synthetic training rows and measure its cost. Meant to run in a fresh process
+    (see misc/benchmark_aadt_scaling.py) so that the peak RSS belongs to this fit only.
+    Input:
+        - n_rows (int): The number of training rows
+        - n_estimators (int): The number of trees
+        - max_depth (int): The maximum depth of the trees (None for fully grown trees)
+        - n_jobs (int): The number of threads of the fit
+        - dtype (str): The dtype of the design matrix ("float64" or "float32")
+        - response_var (str): The response variable
+        - predictor_vars (list): The predictor variables (defaults to those of impute_hpms.py)
+        - n_predict (int): The number of rows to predict when measuring the throughput
+        - seed (int): The random seed of the synthetic data
+    Output:
+        - result (dict): The configuration, fit wall / CPU time, predict rows per second, peak RSS, model size and test r2
+    """
+    predictor_vars = predictor_vars or ["STATEFP", "COUNTYFP", "F_SYSTEM", "THROUGH_LANES", "AADT"]
+    with _PeakRSS() as rss:
+        # Only the training rows (plus a 20% test split) are generated, as if read from hpms_aadt_subset.csv
+        data = synthetic.make_training_frame(int(np.ceil(n_rows / 0.8)), seed, reported=True)
+        predictor = AADTPredictor.from_dataframe(data, response_var, random_state=seed)
+        predictor.split_data(predictor_vars, test_size=0.2)
+        predictor.X_train = predictor.X_train.astype(dtype)
+        predictor.X_test = predictor.X_test.astype(dtype)
+        predictor.initialize_model("Random Forest", n_estimators=n_estimators, max_depth=max_depth, n_jobs=n_jobs, random_state=seed)
+        del data
+
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        predictor.fit_model()
+        fit_time = time.perf_counter() - start
+        fit_cpu_time = time.process_time() - start_cpu
+
+        X_predict = synthetic.make_training_frame(n_predict, seed + 1)[predictor_vars].astype(dtype)
+        start = time.perf_counter()
+        predictor.predict(X_predict)
+        predict_time = time.perf_counter() - start
+        r2 = r2_score(predictor.y_test, predictor.predict(predictor.X_test))
+
+    return {
+        "n_rows": n_rows,
+        "n_estimators": n_estimators,
+        "max_depth": max_depth,
+        "n_jobs": n_jobs,
+        "dtype": dtype,
+        "fit_time_s": fit_time,
+        "fit_cpu_time_s": fit_cpu_time,
+        "predict_rows_per_s": n_predict / predict_time if predict_time > 0 else np.nan,
+        "peak_rss_mb": rss.peak / 1024**2,
+        "model_size_mb": model_size_mb(predictor.model),
+        "n_nodes": int(sum(tree.tree_.node_count for tree in predictor.model.estimators_)),
+        "r2": r2,
+    }
+
+
+def fit_power_law(x, y):
+    """
+    Summary: Least-squares fit of y = a * x ** b in log-log space
+    Input:
+        - x, y (array): The positive observations
+    Output:
+        - a, b (float): The coefficient and exponent
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    keep = (x > 0) & (y > 0)
+    if np.unique(x[keep]).size < 2:
+        return (float(np.mean(y[keep])) if keep.any() else np.nan), 0.0
+    b, log_a = np.polyfit(np.log(x[keep]), np.log(y[keep]), 1)
+    return float(np.exp(log_a)), float(b)
+
+
+def recommend_resources(results, target_rows, n_estimators, max_depth, dtype="float64", min_efficiency=0.6, headroom=1.25):
+    """
+    Summary: Recommend the cores, memory and time to request for a Random Forest fit on target_rows rows, from the scaling results.
+    Cores: the most threads whose parallel efficiency (speedup / threads) at the largest measured size is at least min_efficiency.
+    Memory: a linear model of the peak RSS in rows, rows x trees and threads, extrapolated to the target with headroom.
+    Time: a power law of the single-thread fit time in rows x trees, divided by the speedup of the recommended cores.
+    Input:
+        - results (DataFrame): The profile_aadt_fit results
+        - target_rows (int): The number of training rows of the target fit
+        - n_estimators (int): The number of trees of the target fit
+        - max_depth (int): The maximum depth of the target fit (the results of this depth are used when there are any)
+        - dtype (str): The dtype of the target fit
+        - min_efficiency (float): The minimum parallel efficiency of the recommended cores
+        - headroom (float): Safety factor on the extrapolated memory and time
+    Output:
+        - recommendation (dict): n_jobs, mem_gb, time_h, the extrapolated peak RSS and fit time and the speedup by threads
+    """
+    runs = results[results["dtype"] == dtype]
+    same_depth = runs["max_depth"].isna() if max_depth is None else runs["max_depth"] == max_depth
+    if same_depth.any():
+        runs = runs[same_depth]
+
+    # Parallel efficiency of each thread count at the largest size measured with every thread count
+    largest = runs[runs["n_rows"] == runs["n_rows"].max()]
+    speed = largest.groupby("n_jobs")["fit_time_s"].median()
+    base_jobs = speed.index.min()
+    speedup = speed.loc[base_jobs] * base_jobs / speed
+    efficiency = speedup / speedup.index
+    n_jobs = int(max(j for j in efficiency.index if efficiency.loc[j] >= min_efficiency or j == base_jobs))
+
+    design = lambda df: np.column_stack([np.ones(len(df)), df["n_rows"], df["n_rows"] * df["n_estimators"], df["n_jobs"]])
+    coef = np.linalg.lstsq(design(runs), runs["peak_rss_mb"].to_numpy(), rcond=None)[0]
+    target = pd.DataFrame({"n_rows": [target_rows], "n_estimators": [n_estimators], "n_jobs": [n_jobs]})
+    peak_rss_mb = max(float((design(target) @ coef)[0]), float(runs["peak_rss_mb"].max()))
+
+    # Single-thread equivalent fit time: measured time x the speedup of its thread count
+    serial_time = runs["fit_time_s"] * runs["n_jobs"].map(speedup).fillna(1)
+    a, b = fit_power_law(runs["n_rows"] * runs["n_estimators"], serial_time)
+    fit_time_s = float(a * (target_rows * n_estimators) ** b / speedup.get(n_jobs, 1))
+
+    return {
+        "target_rows": int(target_rows),
+        "n_estimators": n_estimators,
+        "max_depth": max_depth,
+        "dtype": dtype,
+        "n_jobs": n_jobs,
+        "mem_gb": int(np.ceil(peak_rss_mb * headroom / 1024)),
+        "time_h": float(np.ceil(fit_time_s * headroom / 360) / 10),
+        "peak_rss_mb": peak_rss_mb,
+        "fit_time_s": fit_time_s,
+        "time_exponent": b,
+        "speedup": {int(j): float(v) for j, v in speedup.items()},
+    }
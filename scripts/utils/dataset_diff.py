@@ -0,0 +1,385 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the diff engine of two versions of a pipeline output (hpms_aadt_subset.csv, hpms_aadt_imputed.csv, the
+traffic_density layer or any CSV / Parquet / geodatabase table keyed on FID_Link_Cnty_Intxn or GEOID20). Both sides are streamed in chunks:
+every chunk updates one-pass (Welford / Chan) statistics of the columns, and is split by a hash of its key into buckets written to a
+temporary directory, so that the rows are then matched and compared one bucket at a time. Memory is bounded by the chunk and bucket sizes,
+not by the size of the outputs. The report counts the rows added, removed and changed (numeric columns within a tolerance), the changes per
+column, and lists the largest differences. The hash-only mode keeps one 64-bit hash of the key and of the row for every row instead of the
+buckets, and counts exact changes without tolerances.
+
+<LICENSE>
+"""
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from utils.density import iter_gdb_batches, iter_parquet_batches, layer_columns
+
+KEY_FIELDS = ["FID_Link_Cnty_Intxn", "GEOID20"]
+# Codes with leading zeros are read as text from CSV files
+TEXT_FIELDS = ["GEOID20", "GEOID", "STATEFP", "COUNTYFP", "URBAN_CODE", "UACE10"]
+SKIP_FIELDS = ["geometry", "OBJECTID", "Shape_Length", "Shape_Area"]
+CHUNK_SIZE = 500000
+N_BUCKETS = 64
+ATOL = 1e-6
+RTOL = 1e-6
+
+
+def source_columns(source: Path, layer: str = None):
+    """
+    Summary: The columns of a CSV file, a Parquet file / directory or a geodatabase layer
+    """
+    source = Path(source)
+    if source.suffix == ".csv":
+        return list(pd.read_csv(source, nrows=0, float_precision="round_trip").columns)
+    return layer_columns(source, layer)
+
+
+def iter_chunks(source: Path, layer: str = None, columns=None, chunk_size: int = CHUNK_SIZE):
+    """
+    Summary: Stream a CSV file, a Parquet file / directory or a geodatabase layer as DataFrame chunks
+    Input:
+        - source (Path): The output file (or geodatabase with layer)
+        - layer (str): The geodatabase layer
+        - columns (list): The columns to read
+        - chunk_size (int): The number of rows per chunk
+    Output:
+        - chunks (generator): DataFrames
+    """
+    source = Path(source)
+    if source.suffix == ".csv":
+        yield from pd.read_csv(source, usecols=columns, chunksize=chunk_size, dtype={f: str for f in TEXT_FIELDS},
+                               low_memory=False, float_precision="round_trip")
+        return
+    if layer is not None:
+        batches = iter_gdb_batches(source, layer, columns, chunk_size)
+    else:
+        batches = iter_parquet_batches(source, columns, chunk_size)
+    for batch in batches:
+        yield batch.to_pandas()
+
+
+def normalize_keys(keys):
+    """
+    Summary: Keys as text, so that integer keys read as floats (CSV columns with missing values) or as text still match
+    """
+    if pd.api.types.is_numeric_dtype(keys):
+        return keys.astype("Int64").astype(str)
+    return keys.astype(str)
+
+
+def _is_numeric(s):
+    return pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s)
+
+
+class ColumnStats:
+    """
+    Summary: One-pass statistics of the columns of a stream of chunks: count, nulls, mean, standard deviation (Welford, with Chan's update to
+    merge a whole chunk at once), min and max of the numeric columns; count and nulls of the others
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.n_rows = 0
+
+    def update(self, chunk):
+        """
+        Summary: Add a chunk to the running statistics
+        """
+        self.n_rows += len(chunk)
+        for column in chunk.columns:
+            s = chunk[column]
+            numeric = _is_numeric(s)
+            st = self.stats.setdefault(column, {"numeric": numeric, "count": 0, "nulls": 0, "mean": 0.0, "m2": 0.0, "min": np.nan, "max": np.nan})
+            st["nulls"] += int(s.isna().sum())
+            if not (numeric and st["numeric"]):
+                st["numeric"] = False
+                st["count"] += int(s.notna().sum())
+                continue
+
+            values = s.to_numpy(dtype=np.float64, na_value=np.nan)
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                continue
+            n_b, mean_b = len(values), values.mean()
+            m2_b = ((values - mean_b) ** 2).sum()
+            n = st["count"] + n_b
+            delta = mean_b - st["mean"]
+            st["mean"] += delta * n_b / n
+            st["m2"] += m2_b + delta**2 * st["count"] * n_b / n
+            st["count"] = n
+            st["min"] = np.fmin(st["min"], values.min())
+            st["max"] = np.fmax(st["max"], values.max())
+
+    def result(self):
+        """
+        Summary: The statistics of every column
+        Output:
+            - stats (DataFrame): count, nulls, mean, std, min and max, indexed by column
+        """
+        rows = {}
+        for column, st in self.stats.items():
+            numeric = st["numeric"]
+            rows[column] = {
+                "count": st["count"],
+                "nulls": st["nulls"],
+                "mean": st["mean"] if numeric and st["count"] else np.nan,
+                "std": np.sqrt(st["m2"] / (st["count"] - 1)) if numeric and st["count"] > 1 else np.nan,
+                "min": st["min"] if numeric else np.nan,
+                "max": st["max"] if numeric else np.nan,
+            }
+        return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def _partition(source, layer, columns, key, out_dir: Path, side: str, stats: ColumnStats, chunk_size: int, n_buckets: int):
+    # Stream one side: update its statistics and write every chunk's rows to the buckets of their key hash
+    for i, chunk in enumerate(iter_chunks(source, layer, columns, chunk_size)):
+        stats.update(chunk)
+        chunk[key] = normalize_keys(chunk[key])
+        buckets = pd.util.hash_pandas_object(chunk[key], index=False).to_numpy() % n_buckets
+        for bucket, part in chunk.groupby(buckets, sort=False):
+            part.to_parquet(out_dir / f"{side}_{bucket:03d}_{i:05d}.parquet", index=False)
+
+
+def _read_bucket(out_dir: Path, side: str, bucket: int, columns):
+    files = sorted(out_dir.glob(f"{side}_{bucket:03d}_*.parquet"))
+    if not files:
+        return pd.DataFrame(columns=columns)
+    return pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+
+
+class _Comparison:
+    """
+    Summary: The running counts and top differences of the keyed comparison, fed one bucket at a time
+    """
+
+    def __init__(self, key, value_columns, atol, rtol, top_n):
+        self.key = key
+        self.value_columns = value_columns
+        self.atol, self.rtol, self.top_n = atol, rtol, top_n
+        self.counts = {"added": 0, "removed": 0, "changed": 0, "unchanged": 0, "duplicate_keys_old": 0, "duplicate_keys_new": 0}
+        self.changed_by_column = dict.fromkeys(value_columns, 0)
+        self.max_abs_diff = dict.fromkeys(value_columns, 0.0)
+        self.top = []
+
+    def update(self, old, new):
+        key = self.key
+        self.counts["duplicate_keys_old"] += int(old[key].duplicated().sum())
+        self.counts["duplicate_keys_new"] += int(new[key].duplicated().sum())
+        old = old.drop_duplicates(subset=key).set_index(key)
+        new = new.drop_duplicates(subset=key).set_index(key)
+
+        common = old.index.intersection(new.index)
+        self.counts["removed"] += len(old) - len(common)
+        self.counts["added"] += len(new) - len(common)
+        old, new = old.loc[common], new.loc[common]
+
+        changed = np.zeros(len(common), dtype=bool)
+        for column in self.value_columns:
+            a, b = old[column], new[column]
+            if _is_numeric(a) and _is_numeric(b):
+                a = a.to_numpy(dtype=np.float64, na_value=np.nan)
+                b = b.to_numpy(dtype=np.float64, na_value=np.nan)
+                diff = np.abs(b - a)
+                same = (np.isnan(a) & np.isnan(b)) | (diff <= self.atol + self.rtol * np.abs(a))
+                if (~same).any():
+                    self.max_abs_diff[column] = max(self.max_abs_diff[column], float(np.nanmax(np.where(same, 0, diff))))
+            else:
+                same = ((a == b) | (a.isna() & b.isna())).to_numpy()
+                diff = np.full(len(a), np.nan)
+            bad = ~same
+            n_bad = int(bad.sum())
+            if n_bad == 0:
+                continue
+            changed |= bad
+            self.changed_by_column[column] += n_bad
+
+            # Keep the largest numeric differences (and the first text changes) of every column
+            top = pd.DataFrame(
+                {key: common[bad], "column": column, "old": old[column].to_numpy()[bad], "new": new[column].to_numpy()[bad], "abs_diff": diff[bad]}
+            )
+            self.top.append(top.sort_values("abs_diff", ascending=False, na_position="last").head(self.top_n))
+
+        n_changed = int(changed.sum())
+        self.counts["changed"] += n_changed
+        self.counts["unchanged"] += len(common) - n_changed
+        if len(self.top) > 4 * len(self.value_columns):
+            self._trim()
+
+    def _trim(self):
+        if not self.top:
+            return
+        top = pd.concat(self.top, ignore_index=True)
+        top = top.sort_values("abs_diff", ascending=False, na_position="last").groupby("column", sort=False).head(self.top_n)
+        self.top = [top]
+
+    def top_differences(self):
+        self._trim()
+        if not self.top:
+            return pd.DataFrame(columns=[self.key, "column", "old", "new", "abs_diff", "rel_diff"])
+        top = self.top[0].reset_index(drop=True)
+        old = pd.to_numeric(top["old"], errors="coerce")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            top["rel_diff"] = top["abs_diff"] / old.abs()
+        return top.sort_values(["column", "abs_diff"], ascending=[True, False], na_position="last").reset_index(drop=True)
+
+
+def _hash_side(source, layer, columns, key, value_columns, stats: ColumnStats, chunk_size: int):
+    # Stream one side into the 64-bit hashes of its keys and rows (numeric values as float64 so that 1 and 1.0 hash alike)
+    key_hashes, row_hashes = [], []
+    for chunk in iter_chunks(source, layer, columns, chunk_size):
+        stats.update(chunk)
+        values = chunk[value_columns].copy()
+        for column in value_columns:
+            values[column] = values[column].astype(np.float64) if _is_numeric(values[column]) else values[column].astype(str)
+        key_hashes.append(pd.util.hash_pandas_object(normalize_keys(chunk[key]), index=False).to_numpy())
+        row_hashes.append(pd.util.hash_pandas_object(values, index=False).to_numpy())
+    if not key_hashes:
+        return np.array([], dtype=np.uint64), np.array([], dtype=np.uint64)
+    return np.concatenate(key_hashes), np.concatenate(row_hashes)
+
+
+def _example_keys(source, layer, key, hashes, chunk_size: int, n: int):
+    # A second pass over one side to recover the keys of a few hashed rows
+    wanted = hashes[:n]
+    examples = []
+    for chunk in iter_chunks(source, layer, [key], chunk_size):
+        keys = normalize_keys(chunk[key])
+        found = np.isin(pd.util.hash_pandas_object(keys, index=False).to_numpy(), wanted)
+        examples += keys[found].tolist()
+        if len(examples) >= len(wanted):
+            break
+    return examples[:n]
+
+
+def diff_datasets(
+    old: Path,
+    new: Path,
+    key: str = None,
+    layer_old: str = None,
+    layer_new: str = None,
+    columns=None,
+    atol: float = ATOL,
+    rtol: float = RTOL,
+    top_n: int = 10,
+    hash_only: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+    n_buckets: int = N_BUCKETS,
+    work_dir: Path = None,
+):
+    """
+    Summary: Compare two versions of an output row by row on their key, streaming both in chunks
+    Input:
+        - old, new (Path): The outputs (CSV, Parquet file / directory, or geodatabase with layer_old / layer_new)
+        - key (str): The key column (defaults to the first of FID_Link_Cnty_Intxn / GEOID20 in both outputs)
+        - layer_old, layer_new (str): The geodatabase layers
+        - columns (list): The value columns to compare (defaults to the columns of both outputs)
+        - atol, rtol (float): A numeric value has changed when |new - old| > atol + rtol * |old|
+        - top_n (int): The number of largest differences listed per column
+        - hash_only (bool): Only compare 64-bit hashes of the keys and rows (exact changes, no tolerances or per-column counts)
+        - chunk_size (int): The number of rows read at a time
+        - n_buckets (int): The number of key-hash buckets (each bucket holds about 1 / n_buckets of the rows in memory)
+        - work_dir (Path): Where the temporary buckets are written (defaults to the system temporary directory)
+    Output:
+        - report (dict): The key, the row counts of both sides, the rows added / removed / changed / unchanged, duplicate keys, the columns
+          added / removed, the changed rows per column, the largest differences (DataFrame) and the column statistics of both sides (DataFrame)
+    """
+    old_columns, new_columns = source_columns(old, layer_old), source_columns(new, layer_new)
+    if key is None:
+        key = next((f for f in KEY_FIELDS if f in old_columns and f in new_columns), None)
+        if key is None:
+            raise ValueError(f"None of the key fields {KEY_FIELDS} is in both outputs; pass key")
+    value_columns = columns or [c for c in old_columns if c in new_columns and c != key and c not in SKIP_FIELDS]
+    read_columns = [key] + list(value_columns)
+
+    stats_old, stats_new = ColumnStats(), ColumnStats()
+    report = {
+        "key": key,
+        "columns_added": [c for c in new_columns if c not in old_columns and c not in SKIP_FIELDS],
+        "columns_removed": [c for c in old_columns if c not in new_columns and c not in SKIP_FIELDS],
+    }
+
+    if hash_only:
+        print("Hashing the old rows...", flush=True)
+        keys_old, rows_old = _hash_side(old, layer_old, read_columns, key, value_columns, stats_old, chunk_size)
+        print("Hashing the new rows...", flush=True)
+        keys_new, rows_new = _hash_side(new, layer_new, read_columns, key, value_columns, stats_new, chunk_size)
+
+        unique_old, first_old = np.unique(keys_old, return_index=True)
+        unique_new, first_new = np.unique(keys_new, return_index=True)
+        common, idx_old, idx_new = np.intersect1d(unique_old, unique_new, assume_unique=True, return_indices=True)
+        changed = rows_old[first_old[idx_old]] != rows_new[first_new[idx_new]]
+        report.update(
+            {
+                "added": len(unique_new) - len(common),
+                "removed": len(unique_old) - len(common),
+                "changed": int(changed.sum()),
+                "unchanged": int((~changed).sum()),
+                "duplicate_keys_old": len(keys_old) - len(unique_old),
+                "duplicate_keys_new": len(keys_new) - len(unique_new),
+                "changed_examples": _example_keys(new, layer_new, key, common[changed], chunk_size, top_n),
+            }
+        )
+    else:
+        with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+            tmp = Path(tmp)
+            print("Partitioning the old rows...", flush=True)
+            _partition(old, layer_old, read_columns, key, tmp, "old", stats_old, chunk_size, n_buckets)
+            print("Partitioning the new rows...", flush=True)
+            _partition(new, layer_new, read_columns, key, tmp, "new", stats_new, chunk_size, n_buckets)
+
+            comparison = _Comparison(key, list(value_columns), atol, rtol, top_n)
+            for bucket in range(n_buckets):
+                comparison.update(_read_bucket(tmp, "old", bucket, read_columns), _read_bucket(tmp, "new", bucket, read_columns))
+        report.update(comparison.counts)
+        report["changed_by_column"] = {c: n for c, n in comparison.changed_by_column.items() if n}
+        report["max_abs_diff"] = {c: d for c, d in comparison.max_abs_diff.items() if d}
+        report["top_differences"] = comparison.top_differences()
+
+    report["rows_old"], report["rows_new"] = stats_old.n_rows, stats_new.n_rows
+    report["stats"] = pd.concat({"old": stats_old.result(), "new": stats_new.result()}, axis=1)
+    return report
+
+
+def print_report(report):
+    """
+    Summary: Print a diff report (see diff_datasets)
+    """
+    print(f"Key: {report['key']}")
+    print(f"Rows: {report['rows_old']} old, {report['rows_new']} new")
+    print(
+        f"Added {report['added']}, removed {report['removed']}, changed {report['changed']}, unchanged {report['unchanged']} "
+        f"(duplicate keys: {report['duplicate_keys_old']} old, {report['duplicate_keys_new']} new)"
+    )
+    if report["columns_added"] or report["columns_removed"]:
+        print(f"Columns added: {report['columns_added']}, removed: {report['columns_removed']}")
+    if report.get("changed_by_column"):
+        print("Changed rows by column:")
+        for column, n in sorted(report["changed_by_column"].items(), key=lambda x: -x[1]):
+            print(f"  {column}: {n} (max abs diff {report['max_abs_diff'].get(column, float('nan')):.6g})")
+    if report.get("changed_examples"):
+        print(f"Changed keys (examples): {report['changed_examples']}")
+
+    stats = report["stats"]
+    numeric = stats[("old", "mean")].notna() | stats[("new", "mean")].notna() if not stats.empty else []
+    if len(stats) and numeric.any():
+        table = stats[numeric]
+        table = pd.DataFrame(
+            {
+                "mean_old": table[("old", "mean")],
+                "mean_new": table[("new", "mean")],
+                "std_old": table[("old", "std")],
+                "std_new": table[("new", "std")],
+                "nulls_old": table[("old", "nulls")],
+                "nulls_new": table[("new", "nulls")],
+            }
+        )
+        print("Column statistics:")
+        print(table.to_string(float_format=lambda x: f"{x:.6g}"))
+    top = report.get("top_differences")
+    if top is not None and not top.empty:
+        print("Largest differences:")
+        print(top.to_string(index=False, float_format=lambda x: f"{x:.6g}"), flush=True)
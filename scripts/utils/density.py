@@ -0,0 +1,255 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the streaming traffic density aggregator of estimate_traffic_density.py. The block-link pairs (the density_intxn
+layer, or the Parquet tiles of compile_traffic_density_tiled.py) are read as Arrow record batches without geometry (only the clipped lengths are
+computed); each pair's VKT is apportioned by the share of its link inside the block buffer, and per-GEOID20 partial sums of
+VKT / VKT_LDV / VKT_MDV / VKT_HDV are kept in dense arrays addressed through a GEOID20 -> slot hash table and updated with np.bincount,
+and the densities are calculated once at the end. Memory grows with the number of blocks, not with the number of pairs.
+
+<LICENSE>
+"""
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+import shapely
+from pathlib import Path
+from utils import telemetry
+
+VEHICLE_TYPES = ["VKT", "VKT_LDV", "VKT_MDV", "VKT_HDV"]
+BLOCK_FIELDS = ["GEOID20", "Area_Land_Orig"]
+LINK_LENGTH = "Shape_Length_New"
+LENGTH_PATTERN = re.compile(r"^Length_Clip_(\d+(?:\.\d+)?)$")
+BATCH_SIZE = 262144
+
+
+def buffer_distances(columns):
+    """
+    Summary: Find the buffer distances of a multi-distance overlay from its Length_Clip_<distance> columns
+    Input:
+        - columns (list): The column names of the pairs
+    Output:
+        - distances (list): The distance labels, in increasing order (empty for a single-distance overlay)
+    """
+    labels = [m.group(1) for m in map(LENGTH_PATTERN.match, columns) if m]
+    return sorted(labels, key=float)
+
+
+def value_fields(distances):
+    """
+    Summary: The names of the summed fields: the vehicle types, or one field per vehicle type and distance (e.g. VKT_LDV_250m)
+    """
+    if not distances:
+        return list(VEHICLE_TYPES)
+    return [f"{vehicle_type}_{d}m" for d in distances for vehicle_type in VEHICLE_TYPES]
+
+
+def iter_gdb_batches(gdb: Path, layer: str, columns, batch_size: int = BATCH_SIZE, lengths: bool = False):
+    """
+    Summary: Stream the attributes of a geodatabase layer as Arrow record batches, without keeping the geometry
+    Input:
+        - gdb (Path): The geodatabase
+        - layer (str): The layer name
+        - columns (list): The fields to read
+        - batch_size (int): The number of features per batch
+        - lengths (bool): Read the geometry only to add its length as a Length_Clip column
+    Output:
+        - batches (generator): pyarrow RecordBatches
+    """
+    with pyogrio.open_arrow(gdb, layer=layer, columns=columns, read_geometry=lengths, batch_size=batch_size, use_pyarrow=True) as (meta, reader):
+        geometry_name = meta["geometry_name"] or "wkb_geometry"
+        for batch in reader:
+            if lengths:
+                wkb = batch.column(geometry_name).to_numpy(zero_copy_only=False)
+                batch = batch.drop_columns([geometry_name]).append_column("Length_Clip", pa.array(shapely.length(shapely.from_wkb(wkb))))
+            yield batch
+
+
+def iter_parquet_batches(path: Path, columns, batch_size: int = BATCH_SIZE):
+    """
+    Summary: Stream a Parquet file, or a directory of Parquet tiles, as Arrow record batches
+    Input:
+        - path (Path): A Parquet file or a directory of Parquet files
+        - columns (list): The columns to read
+        - batch_size (int): The number of rows per batch
+    Output:
+        - batches (generator): pyarrow RecordBatches
+    """
+    path = Path(path)
+    files = sorted(path.glob("*.parquet")) if path.is_dir() else [path]
+    for file in files:
+        yield from pq.ParquetFile(file).iter_batches(batch_size=batch_size, columns=columns)
+
+
+def layer_columns(source: Path, layer: str = None):
+    """
+    Summary: The attribute columns of a geodatabase layer (layer given) or of Parquet pairs
+    """
+    if layer is not None:
+        return list(pyogrio.read_info(source, layer=layer)["fields"])
+    source = Path(source)
+    file = next(iter(sorted(source.glob("*.parquet")))) if source.is_dir() else source
+    return pq.read_schema(file).names
+
+
+class DensityAccumulator:
+    """
+    Summary: Running per-GEOID20 sums of the VKT fields, fed one batch of block-link pairs at a time
+    """
+
+    def __init__(self, distances=None, apportion: bool = True, capacity: int = 1 << 20):
+        """
+        Input:
+            - distances (list): The distance labels of a multi-distance overlay (see buffer_distances)
+            - apportion (bool): Weight each pair's VKT by the share of its link inside the block buffer (Length_Clip / Shape_Length_New),
+                                instead of adding the link's full VKT to every block buffer it crosses
+            - capacity (int): The initial number of block slots
+        """
+        self.distances = list(distances or [])
+        self.apportion = apportion
+        self.fields = value_fields(self.distances)
+        self.slots = {}
+        self.geoids = []
+        self.sums = np.zeros((len(self.fields), capacity), dtype=np.float64)
+        self.area = np.full(capacity, np.nan, dtype=np.float64)
+        self.n_rows = 0
+
+    def _slot_codes(self, geoids):
+        # Factorize the batch so that the hash table is touched once per distinct block, not once per pair
+        codes, uniques = pd.factorize(geoids)
+        slots = self.slots
+        mapping = np.empty(len(uniques), dtype=np.int64)
+        for i, geoid in enumerate(uniques):
+            slot = slots.get(geoid)
+            if slot is None:
+                slot = slots[geoid] = len(self.geoids)
+                self.geoids.append(geoid)
+            mapping[i] = slot
+
+        n_slots = len(self.geoids)
+        if n_slots > self.area.shape[0]:
+            capacity = max(n_slots, 2 * self.area.shape[0])
+            self.sums = np.pad(self.sums, ((0, 0), (0, capacity - self.sums.shape[1])))
+            self.area = np.pad(self.area, (0, capacity - self.area.shape[0]), constant_values=np.nan)
+        return mapping[codes]
+
+    def batch_values(self, batch: pa.RecordBatch):
+        """
+        Summary: The values summed for each pair of a batch (one row per field of self.fields)
+        Input:
+            - batch (RecordBatch): Pairs with the VKT fields, and the clipped lengths (Length_Clip, or Length_Clip_<distance> for a
+                                   multi-distance overlay) with Shape_Length_New when apportioning
+        Output:
+            - values (array): n_fields x n_pairs
+        """
+        vkt = np.vstack([batch.column(v).to_numpy(zero_copy_only=False) for v in VEHICLE_TYPES]).astype(np.float64)
+        vkt = np.nan_to_num(vkt)
+        length_fields = [f"Length_Clip_{d}" for d in self.distances] or ["Length_Clip"]
+        if not self.apportion and not self.distances:
+            return vkt
+
+        # Weights of every pair for every distance: the clipped share of the link, or (unapportioned multi-distance)
+        # 1 for the distances whose buffer the link reaches into
+        clipped = np.vstack([batch.column(f).to_numpy(zero_copy_only=False) for f in length_fields]).astype(np.float64)
+        if self.apportion:
+            link_length = batch.column(LINK_LENGTH).to_numpy(zero_copy_only=False).astype(np.float64)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                weights = np.clip(np.nan_to_num(clipped / link_length, nan=0.0, posinf=0.0), 0, 1)
+        else:
+            weights = (clipped > 0).astype(np.float64)
+
+        # All vehicle classes of all distances scaled in one operation: n_distances x n_vehicle_types x n_pairs
+        return (weights[:, None, :] * vkt[None, :, :]).reshape(len(self.fields), -1)
+
+    def update(self, batch: pa.RecordBatch):
+        """
+        Summary: Add a batch of pairs to the running sums
+        Input:
+            - batch (RecordBatch): Pairs with GEOID20, Area_Land_Orig and the VKT fields
+        """
+        if batch.num_rows == 0:
+            return
+        codes = self._slot_codes(batch.column("GEOID20").to_numpy(zero_copy_only=False))
+        n_slots = len(self.geoids)
+        values = self.batch_values(batch)
+        for i in range(len(self.fields)):
+            self.sums[i, :n_slots] += np.bincount(codes, weights=values[i], minlength=n_slots)
+
+        # The land area is a block attribute repeated on every pair; keep the first value seen
+        area = batch.column("Area_Land_Orig").to_numpy(zero_copy_only=False).astype(np.float64)
+        unset = np.isnan(self.area[codes])
+        self.area[codes[unset]] = area[unset]
+        self.n_rows += batch.num_rows
+
+    def result(self):
+        """
+        Summary: Calculate the traffic density (VKT per square kilometer of land) of every block
+        Output:
+            - density (DataFrame): GEOID20, the summed VKT fields, Area_Land_Orig and a TD_<field> column per field
+        """
+        n_slots = len(self.geoids)
+        sums = self.sums[:, :n_slots]
+        area = self.area[:n_slots]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            density = sums / (area / 10**6)
+        density[~np.isfinite(density)] = 0
+
+        columns = {"GEOID20": np.array(self.geoids, dtype=object)}
+        columns.update({field: sums[i] for i, field in enumerate(self.fields)})
+        columns["Area_Land_Orig"] = area
+        columns.update({f"TD_{field}": density[i] for i, field in enumerate(self.fields)})
+        return pd.DataFrame(columns)
+
+
+def aggregate_density(batches, distances=None, apportion: bool = True):
+    """
+    Summary: Aggregate a stream of block-link pair batches into the traffic density of every block
+    Input:
+        - batches (iterable): pyarrow RecordBatches of pairs
+        - distances (list): The distance labels of a multi-distance overlay
+        - apportion (bool): Weight each pair's VKT by the clipped share of its link (see DensityAccumulator)
+    Output:
+        - density (DataFrame): See DensityAccumulator.result
+    """
+    with telemetry.stage("aggregate") as stage:
+        accumulator = DensityAccumulator(distances, apportion)
+        for batch in batches:
+            accumulator.update(batch)
+        print(f"Aggregated {accumulator.n_rows} pairs into {len(accumulator.geoids)} blocks", flush=True)
+        density = accumulator.result()
+        stage.rows_in = accumulator.n_rows
+        stage.rows_out = len(density)
+    return density
+
+
+def stream_density(source: Path, layer: str = None, batch_size: int = BATCH_SIZE, apportion: bool = True):
+    """
+    Summary: Stream the pairs of a geodatabase layer (layer given) or of Parquet pairs and aggregate them into traffic density.
+    The clipped lengths of a geodatabase layer are computed from its geometry, batch by batch; Parquet pairs carry them as columns.
+    Input:
+        - source (Path): The geodatabase, or a Parquet file / directory of tiles
+        - layer (str): The pairs layer of the geodatabase (e.g. density_intxn)
+        - batch_size (int): The number of pairs per batch
+        - apportion (bool): Weight each pair's VKT by the clipped share of its link (see DensityAccumulator)
+    Output:
+        - density (DataFrame): See DensityAccumulator.result
+    """
+    distances = buffer_distances(layer_columns(source, layer))
+    columns = BLOCK_FIELDS + VEHICLE_TYPES
+    if apportion:
+        columns.append(LINK_LENGTH)
+    if distances:
+        columns += [f"Length_Clip_{d}" for d in distances]
+    elif apportion and layer is None:
+        columns.append("Length_Clip")
+
+    if layer is not None:
+        batches = iter_gdb_batches(source, layer, columns, batch_size, lengths=apportion and not distances)
+    else:
+        batches = iter_parquet_batches(source, columns, batch_size)
+    return aggregate_density(batches, distances, apportion)
@@ -0,0 +1,188 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the DensityStore class, a query-ready store of the estimate_traffic_density output. Blocks are sorted by
+GEOID20 (as int64 keys) so that batch lookups are one np.searchsorted; the density columns and block bounding boxes are .npy arrays that are
+memory-mapped on open; a packed Hilbert R-tree (utils.spatial_index) answers bbox and point queries, refined with the block geometry when exact
+results are requested. Results are returned as dicts of NumPy arrays or as Arrow tables.
+
+<LICENSE>
+"""
+import json
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from pathlib import Path
+from utils.spatial_index import PackedRTree
+
+GEOID_WIDTH = 15
+
+
+def geoid_keys(geoids):
+    """
+    Summary: Convert GEOID20 strings (or integers) to int64 keys
+    """
+    return np.asarray(geoids).astype(np.int64)
+
+
+def geoid_strings(keys):
+    """
+    Summary: Convert int64 keys back to zero-padded GEOID20 strings
+    """
+    return np.char.zfill(np.asarray(keys).astype(str), GEOID_WIDTH)
+
+
+class DensityStore:
+    """
+    Summary: GEOID20, bbox and point lookups of block traffic density
+    """
+
+    def __init__(self, path: Path, keys, columns: dict, bounds, rtree: PackedRTree):
+        """
+        Input:
+            - path (Path): The store directory
+            - keys (array): The sorted int64 GEOID20 keys
+            - columns (dict): The value array of each column, in key order
+            - bounds (array): The bounding box of each block, in key order
+            - rtree (PackedRTree): The R-tree over bounds
+        """
+        self.path = Path(path)
+        self.keys = keys
+        self.columns = columns
+        self.bounds = bounds
+        self.rtree = rtree
+        self._geometry = None
+
+    @staticmethod
+    def build(density, blocks, path: Path, node_size: int = 16):
+        """
+        Summary: Write a store from the traffic density table and the census block geometry
+        Input:
+            - density (DataFrame): The estimate_traffic_density output (GEOID20 and numeric columns)
+            - blocks (GeoDataFrame): The census blocks (GEOID20 and geometry)
+            - path (Path): The store directory
+            - node_size (int): The number of children of each R-tree node
+        Output:
+            - store (DensityStore): The opened store
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        keys = geoid_keys(density["GEOID20"])
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        if keys.size and (np.diff(keys) == 0).any():
+            raise ValueError("GEOID20 is not unique in the density table")
+
+        geometry = blocks.set_index("GEOID20").geometry.reindex(geoid_strings(keys))
+        if geometry.isna().any():
+            print(f"WARNING: {int(geometry.isna().sum())} blocks of the density table have no geometry", flush=True)
+        geometry = np.asarray(geometry.values)
+
+        names = [c for c in density.columns if c != "GEOID20" and np.issubdtype(density[c].dtype, np.number)]
+        np.save(path / "geoid.npy", keys)
+        for name in names:
+            np.save(path / f"{name}.npy", density[name].to_numpy(dtype=np.float64)[order])
+        bounds = shapely.bounds(geometry)
+        np.save(path / "bounds.npy", bounds)
+        pq.write_table(pa.table({"geometry": shapely.to_wkb(geometry)}), path / "geometry.parquet")
+
+        # Blocks without geometry get an empty box so that they never match a spatial query
+        tree_bounds = np.where(np.isnan(bounds), [np.inf, np.inf, -np.inf, -np.inf], bounds)
+        PackedRTree.build(tree_bounds, node_size).save(path / "rtree")
+        with open(path / "store.json", "w") as f:
+            json.dump({"columns": names, "n_blocks": int(keys.size)}, f)
+        return DensityStore.open(path)
+
+    @classmethod
+    def open(cls, path: Path, mmap: bool = True):
+        """
+        Summary: Open a store written by build (arrays memory-mapped by default)
+        Input:
+            - path (Path): The store directory
+            - mmap (bool): Memory-map the arrays instead of reading them
+        Output:
+            - store (DensityStore): The store
+        """
+        path = Path(path)
+        with open(path / "store.json") as f:
+            header = json.load(f)
+        mmap_mode = "r" if mmap else None
+        keys = np.load(path / "geoid.npy", mmap_mode=mmap_mode)
+        columns = {name: np.load(path / f"{name}.npy", mmap_mode=mmap_mode) for name in header["columns"]}
+        bounds = np.load(path / "bounds.npy", mmap_mode=mmap_mode)
+        return cls(path, keys, columns, bounds, PackedRTree.load(path / "rtree", mmap=mmap))
+
+    @property
+    def geometry(self):
+        # The block geometry is only read for exact spatial queries
+        if self._geometry is None:
+            wkb = pq.read_table(self.path / "geometry.parquet").column("geometry").to_numpy(zero_copy_only=False)
+            self._geometry = shapely.from_wkb(wkb)
+        return self._geometry
+
+    def _result(self, rows, columns, as_arrow: bool, found=None):
+        columns = list(self.columns) if columns is None else columns
+        result = {"GEOID20": geoid_strings(self.keys[rows])}
+        for name in columns:
+            values = np.asarray(self.columns[name][rows], dtype=np.float64)
+            if found is not None:
+                values[~found] = np.nan
+            result[name] = values
+        if found is not None:
+            result["found"] = found
+        return pa.table(result) if as_arrow else result
+
+    def lookup(self, geoids, columns=None, as_arrow: bool = False):
+        """
+        Summary: Look up blocks by GEOID20
+        Input:
+            - geoids (array): The GEOID20 of each requested block
+            - columns (list): The columns to return (all by default)
+            - as_arrow (bool): Return a pyarrow Table instead of a dict of arrays
+        Output:
+            - result: GEOID20 (as requested), the columns (NaN for unknown blocks) and a found flag, in request order
+        """
+        requested = geoid_keys(geoids)
+        rows = np.searchsorted(self.keys, requested)
+        rows = np.minimum(rows, max(self.keys.size - 1, 0))
+        found = self.keys[rows] == requested if self.keys.size else np.zeros(requested.size, dtype=bool)
+        result = self._result(rows, columns, as_arrow=False, found=found)
+        result["GEOID20"] = geoid_strings(requested)
+        return pa.table(result) if as_arrow else result
+
+    def query_bbox(self, minx, miny, maxx, maxy, columns=None, exact: bool = False, as_arrow: bool = False):
+        """
+        Summary: Find the blocks in a bounding box (in the CRS of the block geometry)
+        Input:
+            - minx, miny, maxx, maxy (float): The query box
+            - columns (list): The columns to return (all by default)
+            - exact (bool): Keep only the blocks whose geometry intersects the box, not just their bounding box
+            - as_arrow (bool): Return a pyarrow Table instead of a dict of arrays
+        Output:
+            - result: GEOID20 and the columns of the blocks, in GEOID20 order
+        """
+        rows = np.sort(self.rtree.query(minx, miny, maxx, maxy))
+        if exact and rows.size:
+            rows = rows[shapely.intersects(self.geometry[rows], shapely.box(minx, miny, maxx, maxy))]
+        return self._result(rows, columns, as_arrow)
+
+    def query_points(self, x, y, columns=None, as_arrow: bool = False):
+        """
+        Summary: Find the block containing each point
+        Input:
+            - x, y (array): The point coordinates (in the CRS of the block geometry)
+            - columns (list): The columns to return (all by default)
+            - as_arrow (bool): Return a pyarrow Table instead of a dict of arrays
+        Output:
+            - result: point_idx (the position of the matched point), GEOID20 and the columns of the containing blocks
+        """
+        point_idx, rows = self.rtree.query_points(x, y)
+        if rows.size:
+            inside = shapely.intersects_xy(self.geometry[rows], np.atleast_1d(x)[point_idx], np.atleast_1d(y)[point_idx])
+            point_idx, rows = point_idx[inside], rows[inside]
+        result = self._result(rows, columns, as_arrow=False)
+        result = {"point_idx": point_idx, **result}
+        return pa.table(result) if as_arrow else result
@@ -0,0 +1,275 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the residual diagnostics of the residual_lowess_* figures. Exact LOWESS over millions of (observed, residual)
+pairs costs O(n * k), so the smooth is approximated in one of two ways:
+1) "binned": the pairs are reduced with np.bincount to the sufficient statistics (n, sum x, sum y, sum x^2, sum xy) of fine x bins, and the
+   tricube-weighted local linear regression is solved on a fixed evaluation grid from the bin statistics (robustness iterations re-weight
+   the pairs and recount the bins);
+2) "delta": statsmodels' exact LOWESS on a sample stratified by x quantile (plus the extremes and the top tail of x, so that the smooth spans
+   the full x range), with delta-skipping of nearby points.
+The approximation error is measured against an exact LOWESS of a random sample. Several models (e.g. Random Forest and linear regression)
+share the observed values, so residual_diagnostics bins them once and smooths every model's residuals in one call.
+
+<LICENSE>
+"""
+import numpy as np
+import matplotlib.pyplot as plt
+from statsmodels.nonparametric.smoothers_lowess import lowess
+
+FRAC = 2 / 3
+ITERATIONS = 3
+N_BINS = 4096
+N_GRID = 200
+N_CHECK = 10000
+N_PLOT = 50000
+# The share of the sample of delta_lowess taken from the top tail of x, and the x quantiles its delta is sized from
+TAIL_SHARE = 0.01
+DELTA_QUANTILES = (0.01, 0.99)
+ERROR_FIELDS = ["max_abs_error", "rms_error", "max_error_rel_std", "max_abs_diff_full"]
+
+
+def _edges(x, n: int):
+    # Bin edges dense where the data is dense (quantiles) and covering the sparse tail (equal width); unique values when there are few
+    values = np.unique(x)
+    if len(values) <= n:
+        return np.concatenate([values, [values[-1] + 1]]).astype(np.float64)
+    edges = np.unique(np.concatenate([np.quantile(x, np.linspace(0, 1, n // 2 + 1)), np.linspace(x.min(), x.max(), n // 2 + 1)]))
+    edges[-1] = np.nextafter(edges[-1], np.inf)
+    return edges
+
+
+def evaluation_grid(x, n_grid: int = N_GRID):
+    """
+    Summary: The x values the smooth is evaluated at: half quantiles, half equal width, so both the dense and the sparse range are covered
+    """
+    return np.unique(np.concatenate([np.quantile(x, np.linspace(0, 1, n_grid // 2)), np.linspace(x.min(), x.max(), n_grid // 2)]))
+
+
+def _tricube(d):
+    return np.clip(1 - np.abs(d) ** 3, 0, None) ** 3
+
+
+def _bandwidths(grid, centers, counts, k: float):
+    # The distance from every grid point within which k points lie, from the binned counts (n_grid x n_bins)
+    distances = np.abs(grid[:, None] - centers[None, :])
+    order = np.argsort(distances, axis=1)
+    cumulative = np.cumsum(np.take_along_axis(np.broadcast_to(counts, distances.shape), order, axis=1), axis=1)
+    kth = np.minimum((cumulative < k).sum(axis=1), len(centers) - 1)
+    h = np.take_along_axis(distances, order, axis=1)[np.arange(len(grid)), kth]
+    # The bin of the k-th point keeps a (small) weight, as in LOWESS
+    return np.maximum(h * 1.000001, 1e-12)
+
+
+def _local_linear(grid, bandwidths, centers, stats):
+    # Weighted least squares of every grid point from the bin statistics: stats columns are w, wx, wy, wxx, wxy of every bin
+    weights = _tricube((grid[:, None] - centers[None, :]) / bandwidths[:, None])
+    s0, s1, t0, s2, t1 = (weights @ stats).T
+    det = s0 * s2 - s1**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(np.abs(det) > 1e-12 * s0**2, (s0 * t1 - s1 * t0) / det, 0.0)
+        intercept = (t0 - slope * s1) / s0
+    return intercept + slope * grid
+
+
+def _bin_stats(codes, n_bins, x, y, w):
+    return np.column_stack(
+        [np.bincount(codes, weights=v, minlength=n_bins) for v in (w, w * x, w * y, w * x * x, w * x * y)]
+    )
+
+
+class BinnedX:
+    """
+    Summary: The binning of x shared by every series smoothed against it (bin codes, centers, counts and the evaluation grid)
+    """
+
+    def __init__(self, x, n_bins: int = N_BINS, n_grid: int = N_GRID):
+        self.x = np.asarray(x, dtype=np.float64)
+        edges = _edges(self.x, n_bins)
+        self.n_bins = len(edges) - 1
+        self.codes = np.clip(np.searchsorted(edges, self.x, side="right") - 1, 0, self.n_bins - 1)
+        counts = np.bincount(self.codes, minlength=self.n_bins)
+        sums = np.bincount(self.codes, weights=self.x, minlength=self.n_bins)
+        occupied = counts > 0
+        self.centers = np.where(occupied, sums / np.maximum(counts, 1), (edges[:-1] + edges[1:]) / 2)
+        self.counts = counts
+        self.grid = evaluation_grid(self.x, n_grid)
+
+
+def binned_lowess(binned: BinnedX, y, frac: float = FRAC, it: int = ITERATIONS):
+    """
+    Summary: Approximate LOWESS of y against the binned x, evaluated on the grid of the binning
+    Input:
+        - binned (BinnedX): The binning of x
+        - y (array): The values smoothed (e.g. residuals)
+        - frac (float): The share of the points in every local regression
+        - it (int): The number of robustness iterations
+    Output:
+        - fit (array): The smooth at binned.grid
+    """
+    x, y = binned.x, np.asarray(y, dtype=np.float64)
+    occupied = binned.counts > 0
+    centers = binned.centers[occupied]
+    bandwidths = _bandwidths(binned.grid, centers, binned.counts[occupied], frac * len(x))
+    w = np.ones(len(x))
+    for i in range(it + 1):
+        stats = _bin_stats(binned.codes, binned.n_bins, x, y, w)[occupied]
+        fit = _local_linear(binned.grid, bandwidths, centers, stats)
+        if i == it:
+            break
+        # Bisquare robustness weights of the points from their residuals around the current smooth
+        residual = y - np.interp(x, binned.grid, fit)
+        scale = 6 * np.median(np.abs(residual))
+        if scale == 0:
+            break
+        w = np.clip(1 - (residual / scale) ** 2, 0, None) ** 2
+    return fit
+
+
+def stratified_sample(x, n: int, n_strata: int = 20, tail: float = TAIL_SHARE, seed: int = 0):
+    """
+    Summary: The positions of a sample of about n points, with an equal share from every x quantile stratum (the sample follows the
+    distribution of x, with less variance along x than a simple random sample), plus the smallest point and the top tail of x (the largest
+    tail * n points), so that the sample spans the full x range
+    """
+    rng = np.random.default_rng(seed)
+    if len(x) <= n:
+        return np.arange(len(x))
+    strata = np.clip(np.searchsorted(np.quantile(x, np.linspace(0, 1, n_strata + 1)[1:-1]), x, side="right"), 0, n_strata - 1)
+    per_stratum = n // n_strata
+    sample = [rng.choice(idx, min(per_stratum, len(idx)), replace=False) for idx in (np.flatnonzero(strata == s) for s in range(n_strata)) if len(idx)]
+    n_tail = max(int(tail * n), 1)
+    sample += [[np.argmin(x)], np.argpartition(x, len(x) - n_tail)[-n_tail:]]
+    return np.unique(np.concatenate(sample))
+
+
+def delta_lowess(x, y, grid, frac: float = FRAC, it: int = ITERATIONS, n_sample: int = 20000, delta_share: float = 0.005, seed: int = 0):
+    """
+    Summary: Exact LOWESS (statsmodels) of a stratified sample with delta-skipping, evaluated on a grid
+    Input:
+        - x, y (array): The points
+        - grid (array): The x values to evaluate the smooth at
+        - frac (float): The share of the (sampled) points in every local regression
+        - it (int): The number of robustness iterations
+        - n_sample (int): The size of the stratified sample (which also holds the extremes and the top tail of x)
+        - delta_share (float): The delta of statsmodels as a share of the DELTA_QUANTILES range of x (points closer than delta are
+          interpolated); the full range of skewed x (e.g. AADT) would make delta span most of the dense region
+        - seed (int): The sampling seed
+    Output:
+        - fit (array): The smooth at grid
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    sample = stratified_sample(x, n_sample, seed=seed)
+    low, high = np.quantile(x, DELTA_QUANTILES)
+    delta = delta_share * (high - low)
+    smooth = lowess(y[sample], x[sample], frac=frac, it=it, delta=delta, return_sorted=True)
+    return np.interp(grid, smooth[:, 0], smooth[:, 1])
+
+
+def exact_lowess(x, y, frac: float = FRAC, it: int = ITERATIONS):
+    """
+    Summary: Exact LOWESS (statsmodels, no delta-skipping), sorted by x
+    """
+    return lowess(np.asarray(y, dtype=np.float64), np.asarray(x, dtype=np.float64), frac=frac, it=it, delta=0.0, return_sorted=True)
+
+
+def approximation_error(x, y, grid, fit, smoother, frac: float = FRAC, it: int = ITERATIONS, n_check: int = N_CHECK, seed: int = 0):
+    """
+    Summary: The error of an approximate LOWESS against exact LOWESS of a random sample of the points
+    Input:
+        - x, y (array): The points
+        - grid, fit (array): The approximate smooth of all points and the x values it is evaluated at
+        - smoother (callable): smoother(x_sample, y_sample, grid) runs the approximation on the sample
+        - n_check (int): The size of the random sample (the exact fit costs O(n_check^2 * frac))
+    Output:
+        - error (dict): The method error (the approximation run on the sample against the exact fit of the same sample: max, RMS and max
+          relative to the std of y) and the max difference of the smooth of all points from the exact fit of the sample (which also holds
+          the sampling noise of the sample)
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(x), min(n_check, len(x)), replace=False)
+    exact = exact_lowess(x[sample], y[sample], frac, it)
+    method = np.abs(smoother(x[sample], y[sample], exact[:, 0]) - exact[:, 1])
+    full = np.abs(np.interp(exact[:, 0], grid, fit) - exact[:, 1])
+    std = y[sample].std()
+    return {
+        "n_check": len(sample),
+        "max_abs_error": float(method.max()),
+        "rms_error": float(np.sqrt(np.mean(method**2))),
+        "max_error_rel_std": float(method.max() / std) if std > 0 else 0.0,
+        "max_abs_diff_full": float(full.max()),
+    }
+
+
+def residual_diagnostics(
+    y_true,
+    predictions: dict,
+    method: str = "binned",
+    frac: float = FRAC,
+    it: int = ITERATIONS,
+    n_bins: int = N_BINS,
+    n_grid: int = N_GRID,
+    n_check: int = N_CHECK,
+    n_plot: int = N_PLOT,
+    seed: int = 0,
+):
+    """
+    Summary: The LOWESS smooth of the residuals against the observed values of several models, with its approximation error
+    Input:
+        - y_true (array): The observed values (shared by all models)
+        - predictions (dict): Model name -> predicted values (e.g. {"rf": ..., "lr": ...})
+        - method (str): "binned" (binned local regression on the grid) or "delta" (stratified sample with delta-skipping)
+        - frac (float): The LOWESS span
+        - it (int): The number of robustness iterations
+        - n_bins, n_grid (int): The x bins and the evaluation grid size
+        - n_check (int): The sample size of the exact LOWESS the approximation is checked against
+        - n_plot (int): The number of points kept for the scatter (the largest residuals are always kept)
+        - seed (int): The sampling seed
+    Output:
+        - result (dict): grid; and per model: <name>_fit (the smooth at grid), <name>_x / <name>_residual (the scatter sample) and
+          <name>_error (the ERROR_FIELDS of approximation_error as an array)
+    """
+    binned = BinnedX(y_true, n_bins, n_grid)
+    rng = np.random.default_rng(seed)
+    result = {"grid": binned.grid}
+    for name, y_pred in predictions.items():
+        residual = binned.x - np.asarray(y_pred, dtype=np.float64)
+        if method == "binned":
+            result[f"{name}_fit"] = binned_lowess(binned, residual, frac, it)
+            smoother = lambda xs, ys, grid: np.interp(grid, (b := BinnedX(xs, n_bins, n_grid)).grid, binned_lowess(b, ys, frac, it))
+        elif method == "delta":
+            result[f"{name}_fit"] = delta_lowess(binned.x, residual, binned.grid, frac, it, seed=seed)
+            smoother = lambda xs, ys, grid: delta_lowess(xs, ys, grid, frac, it, seed=seed)
+        else:
+            raise ValueError(f"Unknown method {method}; use 'binned' or 'delta'")
+
+        error = approximation_error(binned.x, residual, binned.grid, result[f"{name}_fit"], smoother, frac, it, n_check, seed)
+        print(f"LOWESS ({method}) of the {name} residuals: max error {error['max_abs_error']:.4g} "
+              f"({error['max_error_rel_std']:.2%} of the residual std), RMS error {error['rms_error']:.4g} against exact LOWESS of "
+              f"{error['n_check']} points; the smooth of all points is within {error['max_abs_diff_full']:.4g} of it", flush=True)
+        result[f"{name}_error"] = np.array([error[k] for k in ERROR_FIELDS])
+
+        # The scatter shows a random sample and the largest residuals
+        keep = np.union1d(rng.choice(len(residual), min(n_plot, len(residual)), replace=False), np.argsort(np.abs(residual))[-1000:])
+        result[f"{name}_x"], result[f"{name}_residual"] = binned.x[keep], residual[keep]
+    return result
+
+
+def plot_residual_lowess(diagnostics, name: str, path, title: str, xlabel: str):
+    """
+    Summary: The residual_lowess_* figure of one model: the residual scatter sample and the LOWESS fit
+    """
+    fig, ax = plt.subplots(figsize=(10, 3.75))
+    ax.scatter(diagnostics[f"{name}_x"], diagnostics[f"{name}_residual"], facecolors="none", edgecolors="blue", alpha=0.3)
+    ax.plot(diagnostics["grid"], diagnostics[f"{name}_fit"], color="red", linewidth=2, label="Lowess Fit")
+    ax.grid(True, color="black", alpha=0.5)
+    ax.set_axisbelow(True)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel("Residuals")
+    ax.legend()
+    fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(path, dpi=240)
+    plt.close(fig)
@@ -0,0 +1,193 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the grouped evaluation of the AADT models. Instead of filtering the test set and calling the scikit-learn
+metrics once per group, the sufficient statistics of every metric (n, sum y, sum y^2, sum error, sum |error|, sum error^2 and the absolute
+percentage errors of the rows with a positive observation) are accumulated for all groups with one np.bincount each, and R-squared, MAE,
+MSE, RMSE, MAPE and bias follow from the sums. Bootstrap confidence intervals reuse one set of resampled row counts for every grouping and
+metric (and, with the same seed, for every model), so each resample costs a few weighted bincounts. evaluate returns a tidy table with one
+row per grouping, group and metric.
+
+<LICENSE>
+"""
+import warnings
+import numpy as np
+import pandas as pd
+
+METRICS = ["r2", "mae", "mse", "rmse", "mape", "bias"]
+N_BOOT = 200
+CI = 0.95
+
+
+def group_codes(X, group_vars, groups=None):
+    """
+    Summary: The group index of every row (the groups of the metrics here and of the models of utils.grouped_linear)
+    Input:
+        - X (DataFrame): The data with the group columns
+        - group_vars (list): The group columns (e.g. ["STATEFP"] or ["STATEFP", "F_SYSTEM"])
+        - groups (DataFrame): The known groups; rows of unknown groups get -1 (defaults to the groups of X). Missing keys (NaN) are a
+          level of their own
+    Output:
+        - codes (array): The group index of every row
+        - groups (DataFrame): The group keys, one row per group index
+    """
+    # Factorize each column and combine the integer codes; string keys of millions of rows are slow to build
+    levels = [pd.Index(pd.unique(groups[v])) if groups is not None else None for v in group_vars]
+    columns, sizes = [], []
+    for i, v in enumerate(group_vars):
+        # Missing keys (NaN / None) form a group of their own instead of taking the -1 of unknown levels
+        codes, uniques = pd.factorize(np.asarray(X[v]), sort=True, use_na_sentinel=False)
+        if levels[i] is None:
+            levels[i] = pd.Index(uniques)
+        else:
+            # Map the (few) distinct values to the known levels rather than looking up every row
+            codes = np.append(levels[i].get_indexer(uniques), -1)[codes]
+        columns.append(codes)
+        sizes.append(len(levels[i]) + 1)
+    # Unknown levels (-1) are shifted to 0 so that every combination has a key
+    keys = np.ravel_multi_index([c + 1 for c in columns], sizes)
+    unknown = np.any(np.column_stack(columns) < 0, axis=1)
+
+    if groups is None:
+        group_keys, codes = np.unique(keys, return_inverse=True)
+        parts = np.unravel_index(group_keys, sizes)
+        groups = pd.DataFrame({v: levels[i][parts[i] - 1] for i, v in enumerate(group_vars)})
+        return codes.ravel(), groups
+
+    group_keys = np.ravel_multi_index([levels[i].get_indexer(groups[v]) + 1 for i, v in enumerate(group_vars)], sizes)
+    order = np.argsort(group_keys)
+    position = np.minimum(np.searchsorted(group_keys[order], keys), len(order) - 1)
+    codes = np.where((group_keys[order][position] == keys) & ~unknown, order[position], -1)
+    return codes, groups
+
+
+def row_stats(y_true, y_pred):
+    """
+    Summary: The per-row terms of the sufficient statistics of the metrics
+    Input:
+        - y_true, y_pred (array): The observed and predicted values
+    Output:
+        - stats (dict): n, y, yy, e, ae, se, n_pos and ape (the absolute percentage error of the rows with a positive observation, else 0)
+    """
+    y_true = np.asarray(y_true, dtype=np.float64)
+    error = np.asarray(y_pred, dtype=np.float64) - y_true
+    positive = y_true > 0
+    ape = np.zeros(len(y_true))
+    ape[positive] = np.abs(error[positive]) / y_true[positive]
+    return {"n": np.ones(len(y_true)), "y": y_true, "yy": y_true**2, "e": error, "ae": np.abs(error), "se": error**2,
+            "n_pos": positive.astype(np.float64), "ape": ape}
+
+
+def group_sums(codes, n_groups: int, stats, weights=None):
+    """
+    Summary: The sufficient statistics of the metrics of every group, one np.bincount per statistic
+    Input:
+        - codes (array): The group index of every row
+        - n_groups (int): The number of groups
+        - stats (dict): See row_stats
+        - weights (array): Row weights, e.g. the bootstrap counts of every row (defaults to 1)
+    Output:
+        - sums (dict): The sums of the row statistics of every group
+    """
+    if weights is not None:
+        stats = {name: v * weights for name, v in stats.items()}
+    return {name: np.bincount(codes, weights=v, minlength=n_groups) for name, v in stats.items()}
+
+
+def metrics_from_sums(sums):
+    """
+    Summary: The metrics of every group from its sufficient statistics
+    Input:
+        - sums (dict): See group_sums
+    Output:
+        - metrics (dict): r2, mae, mse, rmse, mape (a fraction, over the rows with a positive observation) and bias (mean of predicted - observed)
+    """
+    n = sums["n"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sst = sums["yy"] - sums["y"] ** 2 / n
+        mse = sums["se"] / n
+        return {
+            # R-squared is undefined for groups with a constant observation
+            "r2": np.where(sst > 0, 1 - sums["se"] / sst, np.nan),
+            "mae": sums["ae"] / n,
+            "mse": mse,
+            "rmse": np.sqrt(mse),
+            "mape": sums["ape"] / sums["n_pos"],
+            "bias": sums["e"] / n,
+        }
+
+
+def group_metrics(codes, n_groups: int, y_true, y_pred):
+    """
+    Summary: The metrics of every group as a frame (one row per group index)
+    """
+    sums = group_sums(codes, n_groups, row_stats(y_true, y_pred))
+    return pd.DataFrame({"n": sums["n"].astype(np.int64), **metrics_from_sums(sums)})
+
+
+def bootstrap_counts(n: int, n_boot: int = N_BOOT, seed: int = 0):
+    """
+    Summary: The number of times every row is drawn in each bootstrap resample; the same seed gives the same resamples
+    Input:
+        - n (int): The number of rows
+        - n_boot (int): The number of resamples
+        - seed (int): The random seed
+    Output:
+        - counts (generator): One array of n counts per resample (the resamples are not held in memory together)
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(n_boot):
+        yield np.bincount(rng.integers(0, n, n), minlength=n)
+
+
+def evaluate(y_true, y_pred, groups=None, by=None, n_boot: int = 0, ci: float = CI, seed: int = 0):
+    """
+    Summary: The metrics of every group of every grouping in one vectorized pass, with optional bootstrap confidence intervals
+    Input:
+        - y_true, y_pred (array): The observed and predicted values
+        - groups (DataFrame): The group columns of the rows (e.g. STATEFP, F_SYSTEM, URBAN), aligned with y_true; missing keys form a
+          group labelled "missing"
+        - by (list): The groupings, each a column or a list of columns (e.g. ["STATEFP", "F_SYSTEM", ["STATEFP", "F_SYSTEM"]]);
+          the overall metrics ("all") are always included
+        - n_boot (int): The number of bootstrap resamples (0 for no confidence intervals)
+        - ci (float): The confidence level of the percentile intervals
+        - seed (int): The random seed of the resamples (use the same seed to compare models on the same resamples)
+    Output:
+        - table (DataFrame): grouping, group, n, metric, value and, with n_boot, ci_low and ci_high
+    """
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    groupings = [("all", np.zeros(len(y_true), dtype=np.int64), pd.Series(["all"]))]
+    for grouping in by or []:
+        columns = [grouping] if isinstance(grouping, str) else list(grouping)
+        codes, keys = group_codes(groups.reset_index(drop=True), columns)
+        labels = keys.astype(object).where(keys.notna(), "missing").astype(str).agg(" x ".join, axis=1)
+        groupings.append((" x ".join(columns), codes, labels))
+
+    # Point estimates, and the resampled metrics of every grouping from the same resamples
+    stats = row_stats(y_true, y_pred)
+    point = [pd.DataFrame(metrics_from_sums(group_sums(codes, len(labels), stats))) for _, codes, labels in groupings]
+    counts = [np.bincount(codes, minlength=len(labels)) for _, codes, labels in groupings]
+    if n_boot:
+        boot = [np.empty((n_boot, len(labels), len(METRICS))) for _, _, labels in groupings]
+        for b, weights in enumerate(bootstrap_counts(len(y_true), n_boot, seed)):
+            resampled = {name: v * weights for name, v in stats.items()}
+            for g, (_, codes, labels) in enumerate(groupings):
+                metrics = metrics_from_sums(group_sums(codes, len(labels), resampled))
+                boot[g][b] = np.column_stack([metrics[m] for m in METRICS])
+
+    tables = []
+    for g, (name, _, labels) in enumerate(groupings):
+        table = point[g].assign(grouping=name, group=labels.to_numpy(), n=counts[g]).melt(
+            id_vars=["grouping", "group", "n"], value_vars=METRICS, var_name="metric", value_name="value")
+        if n_boot:
+            with warnings.catch_warnings():
+                # Metrics undefined in every resample (e.g. R-squared of a one-row group) stay NaN
+                warnings.simplefilter("ignore", RuntimeWarning)
+                low, high = np.nanquantile(boot[g], [(1 - ci) / 2, (1 + ci) / 2], axis=0)
+            # melt orders the rows metric-major
+            table["ci_low"] = low.T.ravel()
+            table["ci_high"] = high.T.ravel()
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
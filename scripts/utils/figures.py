@@ -0,0 +1,289 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the binned figure functions of figs/ (error_map_*, boxplot_*, hdv_mdv_scatter, hexbin_AADT_HDV_MDV). Instead of
+plotting millions of points or links, the data is first reduced with vectorized np.bincount into small arrays: a 2-D grid of counts for the
+HDV / MDV density plots, per-county sums of the absolute (percentage) errors for the error maps, and per-group value histograms for the
+boxplots (the box statistics are read from the cumulative histograms). The binned arrays are cached as .npz files together with a signature
+of their source and parameters, so restyling and regenerating a figure only reads the cache.
+
+<LICENSE>
+"""
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from matplotlib import colors
+from utils import evaluation
+
+# Value bins of the boxplot histograms: 0 and log-spaced bins up to the largest value (bin width ~0.5%)
+BOX_BINS = 2048
+
+
+def source_signature(path: Path):
+    """
+    Summary: The path, size and modification time of a source file, to invalidate the binned arrays when it changes
+    """
+    path = Path(path)
+    stat = path.stat()
+    return {"path": str(path.resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def cached_bins(path: Path, compute, signature: dict, refresh: bool = False):
+    """
+    Summary: Load binned arrays from an .npz cache, or compute and cache them when the cache is missing or its signature differs
+    Input:
+        - path (Path): The .npz cache file
+        - compute (callable): Returns a dict of numpy arrays
+        - signature (dict): The source and parameters of the arrays (JSON serializable)
+        - refresh (bool): Recompute even when the cache is valid
+    Output:
+        - arrays (dict): The binned arrays
+    """
+    path = Path(path)
+    signature = json.dumps(signature, sort_keys=True, default=str)
+    if path.exists() and not refresh:
+        with np.load(path, allow_pickle=False) as f:
+            if str(f["_signature"]) == signature:
+                print(f"Loaded binned arrays from {path}", flush=True)
+                return {k: f[k] for k in f.files if k != "_signature"}
+
+    arrays = compute()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(path, _signature=np.array(signature), **arrays)
+    print(f"Cached binned arrays to {path}", flush=True)
+    return arrays
+
+
+def bin_index(values, lo: float, hi: float, n_bins: int):
+    """
+    Summary: The bin of every value in n_bins equal-width bins of [lo, hi] (values outside are clipped to the edge bins)
+    """
+    idx = ((values - lo) * (n_bins / (hi - lo))).astype(np.int64)
+    return np.clip(idx, 0, n_bins - 1)
+
+
+def histogram2d(chunks, x: str, y: str, bins: int = 100, extent=(0, 11, 0, 11), transform=np.log1p):
+    """
+    Summary: A 2-D grid of counts of two columns, accumulated over a stream of chunks with np.bincount
+    Input:
+        - chunks (iterable): DataFrames with the x and y columns (e.g. pd.read_csv(..., usecols=[x, y], chunksize=...))
+        - x, y (str): The columns
+        - bins (int): The number of bins along each axis
+        - extent (tuple): xmin, xmax, ymin, ymax of the grid (after the transform)
+        - transform (callable): Applied to the values before binning (log1p by default)
+    Output:
+        - arrays (dict): counts (bins x bins, x along the first axis), x_edges and y_edges
+    """
+    xmin, xmax, ymin, ymax = extent
+    counts = np.zeros(bins * bins, dtype=np.int64)
+    for chunk in chunks:
+        xv = transform(chunk[x].to_numpy(dtype=np.float64, na_value=np.nan))
+        yv = transform(chunk[y].to_numpy(dtype=np.float64, na_value=np.nan))
+        valid = np.isfinite(xv) & np.isfinite(yv)
+        cells = bin_index(xv[valid], xmin, xmax, bins) * bins + bin_index(yv[valid], ymin, ymax, bins)
+        counts += np.bincount(cells, minlength=bins * bins)
+    return {
+        "counts": counts.reshape(bins, bins),
+        "x_edges": np.linspace(xmin, xmax, bins + 1),
+        "y_edges": np.linspace(ymin, ymax, bins + 1),
+    }
+
+
+def group_errors(keys, y_true, y_pred):
+    """
+    Summary: Per-group sums of the absolute errors and absolute percentage errors (over the rows with a positive observation)
+    Input:
+        - keys (array): The group of every row (e.g. the county GEOID)
+        - y_true, y_pred (array): The observed and predicted values
+    Output:
+        - arrays (dict): groups, n, sum_ae, n_ape and sum_ape; MAPE = sum_ape / n_ape and MAE = sum_ae / n
+    """
+    groups, codes = np.unique(np.asarray(keys).astype(str), return_inverse=True)
+    sums = evaluation.group_sums(codes, len(groups), evaluation.row_stats(y_true, y_pred))
+    return {"groups": groups, "n": sums["n"].astype(np.int64), "sum_ae": sums["ae"], "n_ape": sums["n_pos"].astype(np.int64),
+            "sum_ape": sums["ape"]}
+
+
+def value_edges(max_value: float, n_bins: int = BOX_BINS):
+    """
+    Summary: Histogram edges of non-negative values: one bin [0, 1) and log-spaced bins from 1 to max_value
+    """
+    return np.concatenate([[0.0], np.geomspace(1.0, max(float(max_value), 2.0) * (1 + 1e-9), n_bins)])
+
+
+def group_histograms(keys, values, edges):
+    """
+    Summary: Per-group histograms of a value, in one np.bincount over (group, bin) cells
+    Input:
+        - keys (array): The group of every row
+        - values (array): The values
+        - edges (array): The bin edges (see value_edges)
+    Output:
+        - groups (array): The sorted groups
+        - counts (array): n_groups x n_bins
+    """
+    groups, codes = np.unique(np.asarray(keys), return_inverse=True)
+    n_bins = len(edges) - 1
+    bins = np.clip(np.searchsorted(edges, np.asarray(values, dtype=np.float64), side="right") - 1, 0, n_bins - 1)
+    counts = np.bincount(codes * n_bins + bins, minlength=len(groups) * n_bins)
+    return groups, counts.reshape(len(groups), n_bins)
+
+
+def _quantile(cdf, edges, q):
+    # The q quantile of a binned distribution, interpolated linearly inside its bin
+    i = int(np.searchsorted(cdf, q, side="left"))
+    i = min(i, len(cdf) - 1)
+    below = cdf[i - 1] if i > 0 else 0.0
+    share = (q - below) / (cdf[i] - below) if cdf[i] > below else 0.0
+    return edges[i] + share * (edges[i + 1] - edges[i])
+
+
+def box_stats(counts, edges, label=None, whis: float = 1.5):
+    """
+    Summary: The boxplot statistics of a binned distribution, in the format of matplotlib's Axes.bxp
+    Input:
+        - counts (array): The histogram
+        - edges (array): The bin edges
+        - label (str): The box label
+        - whis (float): The whisker reach in interquartile ranges
+    Output:
+        - stats (dict): med, q1, q3, whislo, whishi (to the bin resolution), fliers (empty) and label
+    """
+    total = counts.sum()
+    if total == 0:
+        return {"med": np.nan, "q1": np.nan, "q3": np.nan, "whislo": np.nan, "whishi": np.nan, "fliers": [], "label": label}
+    cdf = np.cumsum(counts) / total
+    q1, med, q3 = (_quantile(cdf, edges, q) for q in (0.25, 0.5, 0.75))
+    iqr = q3 - q1
+    occupied = np.flatnonzero(counts)
+    inside_low = occupied[edges[occupied + 1] >= q1 - whis * iqr]
+    inside_high = occupied[edges[occupied] <= q3 + whis * iqr]
+    whislo = max(edges[inside_low[0]], q1 - whis * iqr) if len(inside_low) else q1
+    whishi = min(edges[inside_high[-1] + 1], q3 + whis * iqr) if len(inside_high) else q3
+    return {"med": med, "q1": q1, "q3": q3, "whislo": min(whislo, q1), "whishi": max(whishi, q3), "fliers": [], "label": label}
+
+
+def plot_density_grid(binned, path: Path, title: str, xlabel: str, ylabel: str, vmax: float = 10, scale: float = 1e3, cmap: str = "Blues"):
+    """
+    Summary: The hdv_mdv_scatter figure: the 2-D grid of counts (in units of scale, clipped at vmax)
+    """
+    fig, ax = plt.subplots(figsize=(6.4, 4.8))
+    mesh = ax.pcolormesh(binned["x_edges"], binned["y_edges"], binned["counts"].T / scale, cmap=cmap, vmin=0, vmax=vmax)
+    cbar = fig.colorbar(mesh, ax=ax)
+    cbar.set_label(f"Number of Road Links ({scale:.0e})".replace("e+0", "e"))
+    ticks = cbar.get_ticks()
+    cbar.set_ticks(ticks)
+    cbar.set_ticklabels([f">{t:g}" if t >= vmax else f"{t:g}" for t in ticks])
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(path, dpi=300)
+    plt.close(fig)
+
+
+def plot_density_marginals(binned, path: Path, title: str, xlabel: str, ylabel: str, cmap: str = "Blues"):
+    """
+    Summary: The hexbin_AADT_HDV_MDV figure: the 2-D grid of counts with the marginal histograms (the row / column sums of the grid)
+    """
+    counts = binned["counts"]
+    x_edges, y_edges = binned["x_edges"], binned["y_edges"]
+    fig = plt.figure(figsize=(6, 6))
+    grid = fig.add_gridspec(2, 3, width_ratios=(4, 0.2, 1), height_ratios=(1, 4), hspace=0.05, wspace=0.45)
+    ax = fig.add_subplot(grid[1, 0])
+    ax_x = fig.add_subplot(grid[0, 0], sharex=ax)
+    ax_y = fig.add_subplot(grid[1, 2], sharey=ax)
+    cax = fig.add_subplot(grid[1, 1])
+
+    mesh = ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.T, 0), cmap=cmap)
+    ax_x.bar(x_edges[:-1], counts.sum(axis=1), width=np.diff(x_edges), align="edge")
+    ax_y.barh(y_edges[:-1], counts.sum(axis=0), height=np.diff(y_edges), align="edge")
+    for marginal in (ax_x, ax_y):
+        marginal.axis("off")
+    fig.colorbar(mesh, cax=cax).set_label("Count")
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.suptitle(title)
+    fig.savefig(path, dpi=300, bbox_inches="tight")
+    plt.close(fig)
+
+
+def _inset_states(counties, alaska: str = "02", hawaii: str = "15"):
+    # Move Alaska (scaled down) and Hawaii below the contiguous states, in a projected CRS
+    state = counties["GEOID"].str[:2]
+    conus = counties[~state.isin([alaska, hawaii])]
+    minx, miny, maxx, maxy = conus.total_bounds
+    moved = [conus]
+    for fips, scale, x_share in [(alaska, 0.35, 0.0), (hawaii, 1.0, 0.25)]:
+        part = counties[state == fips]
+        if part.empty:
+            continue
+        part = part.copy()
+        part["geometry"] = part.geometry.scale(scale, scale, origin="center")
+        px, py, _, _ = part.total_bounds
+        part["geometry"] = part.geometry.translate(minx + x_share * (maxx - minx) - px, miny - 0.05 * (maxy - miny) - py)
+        moved.append(part)
+    return pd.concat(moved)
+
+
+def plot_error_map(counties, errors, path: Path, title: str, vmax: float = 25, cmap: str = "Reds"):
+    """
+    Summary: The error_map_* figure: the county MAPE (%) from the binned per-county errors
+    Input:
+        - counties (GeoDataFrame): County polygons with GEOID, in a projected CRS
+        - errors (dict): See group_errors (grouped by county GEOID)
+        - path (Path): The output figure
+        - title (str): The figure title
+        - vmax (float): The MAPE (%) at the top of the color scale
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mape = pd.Series(100 * errors["sum_ape"] / errors["n_ape"], index=errors["groups"])
+    counties = _inset_states(counties.assign(MAPE=counties["GEOID"].map(mape)))
+
+    fig, ax = plt.subplots(figsize=(20, 12))
+    norm = colors.Normalize(vmin=0, vmax=vmax)
+    counties.plot(column="MAPE", ax=ax, cmap=cmap, norm=norm, edgecolor="black", linewidth=0.2,
+                  missing_kwds={"color": "grey", "edgecolor": "black", "linewidth": 0.2})
+    cax = ax.inset_axes([0.93, 0.05, 0.02, 0.45])
+    cbar = fig.colorbar(plt.cm.ScalarMappable(norm=norm, cmap=cmap), cax=cax)
+    ticks = np.linspace(0, vmax, 6)
+    cbar.set_ticks(ticks)
+    cbar.set_ticklabels([f">{t:g}%" if t >= vmax else f"{t:g}%" for t in ticks])
+    cbar.ax.tick_params(labelsize=16)
+    cbar.ax.set_title("MAPE (%)", fontsize=16)
+    ax.set_axis_off()
+    ax.set_title(title, fontsize=24)
+    fig.savefig(path, dpi=180, bbox_inches="tight")
+    plt.close(fig)
+
+
+def plot_boxplots(panels, path: Path, title: str, ylabel: str):
+    """
+    Summary: The boxplot_* figure: observed (red) and predicted (blue) boxes of every group of every panel, from binned histograms
+    Input:
+        - panels (list): (xlabel, labels, observed counts, predicted counts, edges) of every panel (see group_histograms)
+        - path (Path): The output figure
+        - title (str): The figure title
+        - ylabel (str): The y axis label
+    """
+    fig, axes = plt.subplots(1, len(panels), figsize=(20, 10), sharey=True,
+                             gridspec_kw={"width_ratios": [max(len(p[1]), 3) for p in panels]})
+    for ax, (xlabel, labels, observed, predicted, edges) in zip(np.atleast_1d(axes), panels):
+        positions = np.arange(1, len(labels) + 1)
+        for counts, offset, color in [(observed, -0.2, "red"), (predicted, 0.2, "blue")]:
+            stats = [box_stats(c, edges, str(label)) for c, label in zip(counts, labels)]
+            ax.bxp(stats, positions=positions + offset, widths=0.35, patch_artist=True, showfliers=False,
+                   boxprops={"facecolor": color}, medianprops={"color": "orange"})
+        ax.set_xticks(positions)
+        ax.set_xticklabels([str(label) for label in labels])
+        ax.set_xlabel(xlabel, fontsize=14)
+    np.atleast_1d(axes)[0].set_ylabel(ylabel, fontsize=14)
+    fig.legend(handles=[plt.Rectangle((0, 0), 1, 1, color="red"), plt.Rectangle((0, 0), 1, 1, color="blue")],
+               labels=["Observed", "Predicted"], loc="upper right", fontsize=14)
+    fig.suptitle(title, fontsize=16)
+    fig.tight_layout()
+    fig.savefig(path, dpi=200)
+    plt.close(fig)
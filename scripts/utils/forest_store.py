@@ -0,0 +1,361 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains a compact, memory-mappable storage format for fitted tree ensembles (e.g. the Random Forest of AADTPredictor).
+A model is saved as a directory of .npy arrays:
+    - feature (int32), threshold (float32), left (int32), right (int32): one entry per internal node of all trees
+    - leaf_value (float64 or float32): one entry per leaf of all trees
+    - root (int32): the root of each tree
+    - meta.json: feature names, response variable and format information
+Child and root indices >= 0 point to internal nodes, negative indices i point to leaf ~i.
+Thresholds are rounded down to float32, which gives the same split decisions as scikit-learn on float32 inputs.
+
+<LICENSE>
+"""
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
+from sklearn.tree import DecisionTreeRegressor, ExtraTreeRegressor
+from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
+
+FORMAT_NAME = "hpms-compact-forest"
+FORMAT_VERSION = 1
+ARRAY_NAMES = ["feature", "threshold", "left", "right", "leaf_value", "root"]
+# Models whose prediction is the mean of their trees
+SUPPORTED_MODELS = (RandomForestRegressor, ExtraTreesRegressor, DecisionTreeRegressor, ExtraTreeRegressor)
+
+
+def _get_trees(model):
+    """
+    Summary: Get the scikit-learn tree structures of a fitted tree model
+    Input:
+        - model: A fitted decision tree or forest regressor
+    Output:
+        - trees (list): The tree_ objects of the model
+    """
+    if not isinstance(model, SUPPORTED_MODELS):
+        raise ValueError(f"{type(model).__name__} is not a supported tree model")
+    if hasattr(model, "estimators_"):
+        estimators = model.estimators_
+    elif hasattr(model, "tree_"):
+        estimators = [model]
+    else:
+        raise ValueError(f"{type(model).__name__} is not fitted")
+
+    trees = [estimator.tree_ for estimator in np.ravel(estimators)]
+    if any(tree.n_outputs != 1 for tree in trees):
+        raise ValueError("Only single-output regression trees are supported")
+    return trees
+
+
+def node_depths(children_left, children_right):
+    """
+    Summary: Depth of every node of a tree, computed level by level
+    Input:
+        - children_left (array): The left child of each node (-1 for leaves)
+        - children_right (array): The right child of each node (-1 for leaves)
+    Output:
+        - depth (array): The depth of each node (-1 for unreachable nodes)
+    """
+    depth = np.full(children_left.shape[0], -1, dtype=np.int32)
+    frontier = np.array([0])
+    level = 0
+    while frontier.size:
+        depth[frontier] = level
+        children = np.concatenate([children_left[frontier], children_right[frontier]])
+        frontier = children[children >= 0]
+        level += 1
+    return depth
+
+
+def round_down_float32(values):
+    """
+    Summary: Round float64 values to the largest float32 values that are not greater than them
+    Input:
+        - values (array): The float64 values
+    Output:
+        - rounded (array): The float32 values
+    """
+    rounded = values.astype(np.float32)
+    too_large = rounded.astype(np.float64) > values
+    rounded[too_large] = np.nextafter(rounded[too_large], np.float32(-np.inf))
+    return rounded
+
+
+def flatten_forest(model, max_depth=None, value_dtype=np.float64):
+    """
+    Summary: Flatten all trees of a fitted model into contiguous node arrays
+    Input:
+        - model: A fitted decision tree or forest regressor
+        - max_depth (int): Truncate the trees at this depth, using the mean of the training samples at the truncated nodes as leaf values
+        - value_dtype: The dtype of the leaf values
+    Output:
+        - arrays (dict): The feature, threshold, left, right, leaf_value and root arrays
+    """
+    parts = {name: [] for name in ARRAY_NAMES}
+    n_internal = 0
+    n_leaves = 0
+
+    for tree in _get_trees(model):
+        children_left = tree.children_left
+        children_right = tree.children_right
+        depth = node_depths(children_left, children_right)
+
+        reachable = depth >= 0
+        if max_depth is not None:
+            reachable &= depth <= max_depth
+        internal = reachable & (children_left >= 0)
+        if max_depth is not None:
+            internal &= depth < max_depth
+        leaf = reachable & ~internal
+
+        # Global index of every node in the internal-node or leaf arrays (encoded as ~i for leaves)
+        encoded = np.zeros(depth.shape[0], dtype=np.int64)
+        encoded[internal] = n_internal + np.arange(internal.sum())
+        encoded[leaf] = ~(n_leaves + np.arange(leaf.sum()))
+
+        parts["feature"].append(tree.feature[internal].astype(np.int32))
+        parts["threshold"].append(round_down_float32(tree.threshold[internal]))
+        parts["left"].append(encoded[children_left[internal]].astype(np.int32))
+        parts["right"].append(encoded[children_right[internal]].astype(np.int32))
+        parts["leaf_value"].append(tree.value[leaf, 0, 0].astype(value_dtype))
+        parts["root"].append(encoded[:1].astype(np.int32))
+
+        n_internal += int(internal.sum())
+        n_leaves += int(leaf.sum())
+
+    if max(n_internal, n_leaves) >= np.iinfo(np.int32).max:
+        raise ValueError("The model has too many nodes for int32 indices")
+
+    return {name: np.concatenate(arrays) for name, arrays in parts.items()}
+
+
+class CompactForest:
+    """
+    Summary: A tree ensemble stored in compact node arrays, predicting the mean of its trees like a scikit-learn forest
+    """
+
+    def __init__(self, arrays, feature_names=None, response_var=None, model_type=None):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.leaf_value = arrays["leaf_value"]
+        self.root = arrays["root"]
+        self.feature_names = list(feature_names) if feature_names is not None else None
+        self.response_var = response_var
+        self.model_type = model_type
+
+    @classmethod
+    def from_model(cls, model, feature_names=None, response_var=None, model_type=None, **kwargs):
+        """
+        Summary: Build a compact forest from a fitted scikit-learn model
+        Input:
+            - model: A fitted decision tree or forest regressor
+            - feature_names (list): The predictor variables, in training order
+            - response_var (str): The response variable
+            - model_type (str): The AADTPredictor model type
+            - **kwargs: Additional keyword arguments to pass to flatten_forest
+        Output:
+            - forest (CompactForest): The compact forest
+        """
+        if feature_names is None and hasattr(model, "feature_names_in_"):
+            feature_names = model.feature_names_in_
+        return cls(flatten_forest(model, **kwargs), feature_names, response_var, model_type)
+
+    @property
+    def n_trees(self):
+        return self.root.shape[0]
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ARRAY_NAMES)
+
+    def to_array(self, X):
+        """
+        Summary: Convert the predictors to the float32 matrix the trees were fitted on
+        Input:
+            - X (DataFrame or array): The predictor variables
+        Output:
+            - X (array): C-contiguous float32 array
+        """
+        if isinstance(X, pd.DataFrame) and self.feature_names is not None:
+            X = X[self.feature_names]
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+        if X.ndim != 2:
+            raise ValueError(f"Expected a 2D array of predictors, got {X.ndim} dimensions")
+        if np.isnan(X).any():
+            raise ValueError("The predictors contain missing values")
+        return X
+
+    def predict_array(self, X):
+        """
+        Summary: Predict from a float32 array, walking each tree level by level over all rows
+        Input:
+            - X (array): C-contiguous float32 predictors (see to_array)
+        Output:
+            - y_pred (array): The predictions
+        """
+        n_rows, n_features = X.shape
+        X_flat = X.ravel()
+        y_pred = np.zeros(n_rows, dtype=np.float64)
+        for root in self.root:
+            node = np.full(n_rows, root, dtype=np.int32)
+            active = np.arange(n_rows)
+            while active.size:
+                current = node[active]
+                go_left = X_flat[active * n_features + self.feature[current]] <= self.threshold[current]
+                next_node = np.where(go_left, self.left[current], self.right[current])
+                node[active] = next_node
+                active = active[next_node >= 0]
+            # Accumulate the trees in order, as scikit-learn does, so the sums are bit-identical
+            y_pred += self.leaf_value[~node]
+        y_pred /= self.n_trees
+        return y_pred
+
+    def predict(self, X):
+        """
+        Summary: Predict the response as the mean of the tree predictions
+        Input:
+            - X (DataFrame or array): The predictor variables
+        Output:
+            - y_pred (array): The predictions
+        """
+        return self.predict_array(self.to_array(X))
+
+    def save(self, path: Path):
+        """
+        Summary: Save the forest as a directory of .npy arrays
+        Input:
+            - path (Path): The output directory
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(path / f"{name}.npy", np.ascontiguousarray(getattr(self, name)))
+
+        meta = {
+            "format": FORMAT_NAME,
+            "version": FORMAT_VERSION,
+            "n_trees": int(self.n_trees),
+            "feature_names": self.feature_names,
+            "response_var": self.response_var,
+            "model_type": self.model_type,
+            "value_dtype": str(self.leaf_value.dtype),
+        }
+        with open(path / "meta.json", "w") as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True):
+        """
+        Summary: Load a saved forest. With mmap the arrays are memory-mapped read-only, so loading is near-instant and the pages are shared between processes.
+        Input:
+            - path (Path): The directory of the saved forest
+            - mmap (bool): Whether to memory-map the arrays
+        Output:
+            - forest (CompactForest): The loaded forest
+        """
+        path = Path(path)
+        with open(path / "meta.json") as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT_NAME or meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a {FORMAT_NAME} v{FORMAT_VERSION} model")
+
+        arrays = {
+            name: np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None)
+            for name in ARRAY_NAMES
+        }
+        return cls(arrays, meta["feature_names"], meta["response_var"], meta["model_type"])
+
+
+def save_forest(model, path: Path, **kwargs):
+    """
+    Summary: Save a fitted scikit-learn tree model in the compact format
+    Input:
+        - model: A fitted decision tree or forest regressor
+        - path (Path): The output directory
+        - **kwargs: Additional keyword arguments to pass to CompactForest.from_model
+    Output:
+        - forest (CompactForest): The compact forest that was saved
+    """
+    forest = CompactForest.from_model(model, **kwargs)
+    forest.save(path)
+    return forest
+
+
+def load_forest(path: Path, mmap: bool = True):
+    """
+    Summary: Load a compact forest saved with save_forest
+    Input:
+        - path (Path): The directory of the saved forest
+        - mmap (bool): Whether to memory-map the arrays
+    Output:
+        - forest (CompactForest): The loaded forest
+    """
+    return CompactForest.load(path, mmap=mmap)
+
+
+def _accuracy(y_true, y_pred):
+    return {
+        "r2": r2_score(y_true, y_pred),
+        "mae": mean_absolute_error(y_true, y_pred),
+        "rmse": float(np.sqrt(mean_squared_error(y_true, y_pred))),
+    }
+
+
+def prune_to_size(model, max_bytes, X_val, y_val, **kwargs):
+    """
+    Summary: Truncate the trees at the largest depth whose compact size fits in max_bytes and report the accuracy cost
+    Input:
+        - model: A fitted decision tree or forest regressor
+        - max_bytes (int): The size bound of the compact arrays in bytes
+        - X_val (DataFrame or array): The validation predictors
+        - y_val (array): The validation response
+        - **kwargs: Additional keyword arguments to pass to CompactForest.from_model
+    Output:
+        - forest (CompactForest): The pruned forest
+        - report (dict): The depth, size and validation accuracy before and after pruning
+    """
+    full = CompactForest.from_model(model, **kwargs)
+    report = {"full_bytes": int(full.nbytes), "max_bytes": int(max_bytes)}
+    full_accuracy = _accuracy(y_val, full.predict(X_val))
+    report.update({f"full_{name}": value for name, value in full_accuracy.items()})
+
+    if full.nbytes <= max_bytes:
+        forest, depth = full, None
+    else:
+        # Node counts per depth give the size of every truncation without flattening each one
+        nodes_at = np.zeros(1, dtype=np.int64)
+        internal_at = np.zeros(1, dtype=np.int64)
+        for tree in _get_trees(model):
+            depth = node_depths(tree.children_left, tree.children_right)
+            reachable = depth >= 0
+            counts = np.bincount(depth[reachable])
+            internal_counts = np.bincount(depth[reachable & (tree.children_left >= 0)], minlength=counts.shape[0])
+            size = max(nodes_at.shape[0], counts.shape[0])
+            nodes_at = np.pad(nodes_at, (0, size - nodes_at.shape[0])) + np.pad(counts, (0, size - counts.shape[0]))
+            internal_at = np.pad(internal_at, (0, size - internal_at.shape[0])) + np.pad(
+                internal_counts, (0, size - internal_counts.shape[0])
+            )
+
+        internal_bytes = full.feature.itemsize + full.threshold.itemsize + full.left.itemsize + full.right.itemsize
+        leaf_bytes = full.leaf_value.itemsize
+        n_nodes_within = np.cumsum(nodes_at)
+        n_internal_within = np.concatenate([[0], np.cumsum(internal_at)[:-1]])
+        sizes = n_internal_within * internal_bytes + (n_nodes_within - n_internal_within) * leaf_bytes + full.root.nbytes
+
+        fitting = np.flatnonzero(sizes <= max_bytes)
+        if fitting.size == 0:
+            raise ValueError(f"No truncation of the model fits in {max_bytes} bytes")
+        depth = int(fitting[-1])
+        forest = CompactForest.from_model(model, max_depth=depth, **kwargs)
+
+    report["max_depth"] = depth
+    report["pruned_bytes"] = int(forest.nbytes)
+    pruned_accuracy = _accuracy(y_val, forest.predict(X_val))
+    report.update({f"pruned_{name}": value for name, value in pruned_accuracy.items()})
+    return forest, report
@@ -0,0 +1,224 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the geometry reduction stage applied before the overlays (county intersect, UAC join, census block buffers).
+Coordinates are snapped to a grid with shapely.set_precision and the vertices are then thinned with shapely.simplify (topology preserving),
+both in meters of the projected Albers CRS. Every feature's vertex count, length and area are compared before and after, so that the
+reduction is reported with its maximum per-feature error. compare_reduction runs the block-buffer overlay and the density aggregation on the
+original and the reduced layers to report the speed-up and the effect on VKT and traffic density. reduce_gdb_layer writes a reduced copy of a
+geodatabase layer (<layer>_reduced) that the ArcPy overlays of compile_raw_data.py and compile_traffic_density.py read with --reduce.
+
+<LICENSE>
+"""
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyogrio
+import shapely
+from utils.overlay import overlay_pairs
+from utils.density import DensityAccumulator, VEHICLE_TYPES, LINK_LENGTH
+from utils.utils import load_data
+from utils.telemetry import stage
+
+# Default grid (1 m) and simplification tolerance (2 m), well below the 250 m block buffer and the HPMS positional accuracy
+GRID_SIZE = 1.0
+TOLERANCE = 2.0
+# The suffix of the reduced copy of a geodatabase layer, and the CRS the grid and tolerance are measured in
+REDUCED_SUFFIX = "_reduced"
+ALBERS = "EPSG:5070"
+
+
+def reduce_geometry(geoms, grid_size: float = GRID_SIZE, tolerance: float = TOLERANCE):
+    """
+    Summary: Snap the coordinates to a grid and simplify the geometry
+    Input:
+        - geoms (array): Shapely geometries in a projected CRS (meters)
+        - grid_size (float): The grid size of the coordinates (0 to keep full precision)
+        - tolerance (float): The simplification tolerance (0 to skip the simplification)
+    Output:
+        - reduced (array): The reduced geometries (empty results keep the original geometry)
+    """
+    geoms = np.asarray(geoms)
+    reduced = geoms
+    if grid_size:
+        reduced = shapely.set_precision(reduced, grid_size)
+        # The snapped geometries carry a fixed precision model that makes every later buffer / intersection use snap-rounding overlay
+        # (about 3x slower); grid size 0 returns them to floating precision and keeps the snapped coordinates
+        reduced = shapely.set_precision(reduced, 0)
+    if tolerance:
+        reduced = shapely.simplify(reduced, tolerance, preserve_topology=True)
+    # Features shorter or smaller than the grid collapse to empty geometries; they are kept as they were
+    collapsed = shapely.is_empty(reduced) & ~shapely.is_empty(geoms)
+    return np.where(collapsed, geoms, reduced)
+
+
+def reduction_report(before, after):
+    """
+    Summary: The per-feature effect of a geometry reduction
+    Input:
+        - before, after (array): The original and reduced geometries
+    Output:
+        - report (DataFrame): Vertices before / after, and the absolute and relative change in length and area of each feature
+    """
+    length_before, length_after = shapely.length(before), shapely.length(after)
+    area_before, area_after = shapely.area(before), shapely.area(after)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return pd.DataFrame(
+            {
+                "vertices_before": shapely.get_num_coordinates(before),
+                "vertices_after": shapely.get_num_coordinates(after),
+                "length_change": np.abs(length_after - length_before),
+                "length_change_rel": np.nan_to_num(np.abs(length_after - length_before) / length_before),
+                "area_change": np.abs(area_after - area_before),
+                "area_change_rel": np.nan_to_num(np.abs(area_after - area_before) / area_before),
+            }
+        )
+
+
+def summarize_reduction(report):
+    """
+    Summary: Totals of a reduction report
+    Input:
+        - report (DataFrame): See reduction_report
+    Output:
+        - summary (dict): Vertices before / after, the vertex reduction, and the maximum and mean per-feature change in length and area
+    """
+    vertices_before = int(report["vertices_before"].sum())
+    vertices_after = int(report["vertices_after"].sum())
+    return {
+        "features": len(report),
+        "vertices_before": vertices_before,
+        "vertices_after": vertices_after,
+        "vertex_reduction": 1 - vertices_after / vertices_before if vertices_before else 0.0,
+        "max_length_change_m": float(report["length_change"].max()) if len(report) else 0.0,
+        "max_length_change_rel": float(report["length_change_rel"].max()) if len(report) else 0.0,
+        "mean_length_change_rel": float(report["length_change_rel"].mean()) if len(report) else 0.0,
+        "max_area_change_m2": float(report["area_change"].max()) if len(report) else 0.0,
+        "max_area_change_rel": float(report["area_change_rel"].max()) if len(report) else 0.0,
+        "mean_area_change_rel": float(report["area_change_rel"].mean()) if len(report) else 0.0,
+    }
+
+
+def reduce_layer(gdf, grid_size: float = GRID_SIZE, tolerance: float = TOLERANCE, name: str = "layer"):
+    """
+    Summary: Reduce the geometry of a layer and report the effect
+    Input:
+        - gdf (GeoDataFrame): The layer, in a projected CRS
+        - grid_size (float): The grid size of the coordinates in meters
+        - tolerance (float): The simplification tolerance in meters
+        - name (str): The layer name used in the printed summary
+    Output:
+        - reduced (GeoDataFrame): The layer with the reduced geometry
+        - report (DataFrame): The per-feature report (see reduction_report), on the index of the layer
+        - summary (dict): See summarize_reduction
+    """
+    if gdf.crs is None or not gdf.crs.is_projected:
+        raise ValueError("The geometry must be reduced in a projected CRS (e.g. EPSG:5070) so that the grid and tolerance are in meters")
+    before = np.asarray(gdf.geometry.values)
+    after = reduce_geometry(before, grid_size, tolerance)
+    report = reduction_report(before, after)
+    report.index = gdf.index
+    summary = summarize_reduction(report)
+
+    reduced = gdf.copy()
+    reduced[gdf.geometry.name] = after
+    print(
+        f"Reduced {name} (grid {grid_size} m, tolerance {tolerance} m): {summary['vertices_before']} -> {summary['vertices_after']} vertices "
+        f"({summary['vertex_reduction']:.1%} fewer), max length change {summary['max_length_change_m']:.2f} m "
+        f"({summary['max_length_change_rel']:.2%}), max area change {summary['max_area_change_rel']:.2%}",
+        flush=True,
+    )
+    return reduced, report, summary
+
+
+def reduce_gdb_layer(gdb, layer: str, grid_size: float = GRID_SIZE, tolerance: float = TOLERANCE):
+    """
+    Summary: Reduce the geometry of a geodatabase layer and write it back as <layer>_reduced, with the per-feature report as
+    <layer>_reduced.csv next to the geodatabase
+    Input:
+        - gdb (Path): The file geodatabase
+        - layer (str): The layer to reduce
+        - grid_size (float): The grid size of the coordinates in meters
+        - tolerance (float): The simplification tolerance in meters
+    Output:
+        - summary (dict): See summarize_reduction
+    """
+    gdf = load_data(gdb, layer)
+    # The grid and tolerance are in meters of the Albers projection
+    if not gdf.crs.is_projected:
+        gdf = gdf.to_crs(ALBERS)
+
+    with stage('reduce_geometry', rows_in=len(gdf), layer=layer):
+        reduced, report, summary = reduce_layer(gdf, grid_size, tolerance, layer)
+
+    pyogrio.write_dataframe(reduced, gdb, layer=layer + REDUCED_SUFFIX, driver="OpenFileGDB")
+    report.to_csv(Path(gdb).parent / f"{layer}{REDUCED_SUFFIX}.csv")
+    return summary
+
+
+def _overlay_density(blocks, links, distance: float):
+    # The overlay time, the pair count and the per-block density of one version of the layers
+    start = time.perf_counter()
+    block_idx, link_idx, length = overlay_pairs(np.asarray(blocks.geometry.values), np.asarray(links.geometry.values), distance)
+    seconds = time.perf_counter() - start
+
+    columns = {
+        "GEOID20": blocks["GEOID20"].to_numpy()[block_idx],
+        "Area_Land_Orig": blocks["Area_Land_Orig"].to_numpy()[block_idx],
+        LINK_LENGTH: links[LINK_LENGTH].to_numpy()[link_idx],
+        "Length_Clip": length,
+    }
+    columns.update({v: links[v].to_numpy()[link_idx] for v in VEHICLE_TYPES})
+    accumulator = DensityAccumulator()
+    accumulator.update(pa.RecordBatch.from_pydict(columns))
+    return seconds, len(length), accumulator.result().set_index("GEOID20")
+
+
+def compare_reduction(blocks, links, distance: float = 250, grid_size: float = GRID_SIZE, tolerance: float = TOLERANCE):
+    """
+    Summary: Run the block-buffer overlay and the density aggregation on the original and the reduced layers and compare them
+    Input:
+        - blocks (GeoDataFrame): Census blocks with GEOID20 and Area_Land_Orig, in a projected CRS
+        - links (GeoDataFrame): Road links with Shape_Length_New and the VKT fields (VKT, VKT_LDV, VKT_MDV, VKT_HDV), in the same CRS
+        - distance (float): The buffer distance in meters
+        - grid_size (float): The grid size of the coordinates in meters
+        - tolerance (float): The simplification tolerance in meters
+    Output:
+        - report (dict): The reduction summaries of both layers, the overlay times and speed-up, the pair counts, the relative change of the
+          apportioned VKT and the per-block change in traffic density
+    """
+    reduced_blocks, _, block_summary = reduce_layer(blocks, grid_size, tolerance, "blocks")
+    reduced_links, _, link_summary = reduce_layer(links, grid_size, tolerance, "links")
+    # The link length of the apportioned shares follows the reduced geometry, so a link fully inside a buffer still counts in full
+    reduced_links[LINK_LENGTH] = shapely.length(np.asarray(reduced_links.geometry.values))
+
+    seconds_before, pairs_before, density_before = _overlay_density(blocks, links, distance)
+    seconds_after, pairs_after, density_after = _overlay_density(reduced_blocks, reduced_links, distance)
+
+    density_before, density_after = density_before.align(density_after, join="outer", fill_value=0)
+    td_before, td_after = density_before["TD_VKT"].to_numpy(), density_after["TD_VKT"].to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        td_change = np.abs(td_after - td_before) / np.where(td_before > 0, td_before, np.nan)
+    vkt_before = density_before[VEHICLE_TYPES].sum()
+    vkt_after = density_after[VEHICLE_TYPES].sum()
+
+    return {
+        "distance": distance,
+        "grid_size": grid_size,
+        "tolerance": tolerance,
+        "blocks": block_summary,
+        "links": link_summary,
+        "overlay_s_before": seconds_before,
+        "overlay_s_after": seconds_after,
+        "speedup": seconds_before / seconds_after if seconds_after > 0 else float("nan"),
+        "pairs_before": pairs_before,
+        "pairs_after": pairs_after,
+        "vkt_change_rel": {v: float((vkt_after[v] - vkt_before[v]) / vkt_before[v]) if vkt_before[v] else 0.0 for v in VEHICLE_TYPES},
+        "blocks_changed": int(((td_before > 0) != (td_after > 0)).sum()),
+        "max_density_change_rel": float(np.nanmax(td_change)) if np.isfinite(td_change).any() else 0.0,
+        "p99_density_change_rel": float(np.nanpercentile(td_change, 99)) if np.isfinite(td_change).any() else 0.0,
+        "mean_density_change_rel": float(np.nanmean(td_change)) if np.isfinite(td_change).any() else 0.0,
+    }
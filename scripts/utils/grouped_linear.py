@@ -0,0 +1,185 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains GroupedLinearRegression, the linear-regression baseline fit separately for every state (or every F_SYSTEM x
+state) in one pass. Instead of a Python loop of scikit-learn fits, the normal-equation sums X'X, X'y and y'y of every group are accumulated
+with weighted np.bincount and the batch of small systems is solved together with np.linalg.solve; rank-deficient systems (a predictor that
+is constant within the group, such as COUNTYFP in a one-county state) get the minimum-norm least-squares solution, as a per-group
+LinearRegression would. Groups with too few rows and groups not seen in training fall back to the pooled model, whose sums are the total of
+the group sums. The same sums give the
+in-sample metrics of every group without a second pass over the data.
+
+<LICENSE>
+"""
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, RegressorMixin
+from utils.evaluation import group_codes, group_metrics
+
+# Systems with a larger condition number are solved by least squares
+COND_LIMIT = 1e10
+
+
+def accumulate(codes, Z, y, n_groups):
+    """
+    Summary: The normal-equation sums of every group in one pass
+    Input:
+        - codes (array): The group index of every row
+        - Z (array): The design matrix (with the intercept column)
+        - y (array): The response
+        - n_groups (int): The number of groups
+    Output:
+        - sums (dict): n, ZtZ (G x p x p), Zty (G x p), yty, y_sum of every group
+    """
+    p = Z.shape[1]
+    ZtZ = np.zeros((n_groups, p, p))
+    # One weighted bincount per entry of the upper triangle; ZtZ is symmetric
+    for i, j in zip(*np.triu_indices(p)):
+        ZtZ[:, i, j] = ZtZ[:, j, i] = np.bincount(codes, weights=Z[:, i] * Z[:, j], minlength=n_groups)
+    Zty = np.column_stack([np.bincount(codes, weights=Z[:, i] * y, minlength=n_groups) for i in range(p)])
+    return {
+        "n": np.bincount(codes, minlength=n_groups),
+        "ZtZ": ZtZ,
+        "Zty": Zty,
+        "yty": np.bincount(codes, weights=y * y, minlength=n_groups),
+        "y_sum": np.bincount(codes, weights=y, minlength=n_groups),
+    }
+
+
+def solve_batch(ZtZ, Zty, alpha: float = 0.0):
+    """
+    Summary: Solve the stacked normal equations (ZtZ + alpha * I) b = Zty of all groups together
+    Input:
+        - ZtZ (array): G x p x p
+        - Zty (array): G x p
+        - alpha (float): Ridge penalty of the slopes (the intercept, column 0, is not penalized)
+    Output:
+        - coef (array): G x p coefficients
+        - solved (array): Whether the system of each group was well conditioned (else it has the minimum-norm least-squares solution)
+    """
+    penalty = np.full(ZtZ.shape[-1], alpha)
+    penalty[0] = 0.0
+    A = ZtZ + np.diag(penalty)
+    # Ill-conditioned systems (a constant predictor within the group, too few rows) get the minimum-norm least-squares solution, with the
+    # directions below the same conditioning limit dropped
+    solved = np.linalg.cond(A) < COND_LIMIT
+    coef = np.zeros(Zty.shape)
+    if solved.any():
+        coef[solved] = np.linalg.solve(A[solved], Zty[solved][..., None])[..., 0]
+    if not solved.all():
+        coef[~solved] = (np.linalg.pinv(A[~solved], rcond=1 / COND_LIMIT, hermitian=True) @ Zty[~solved][..., None])[..., 0]
+    return coef, solved
+
+
+def sums_metrics(sums, coef):
+    """
+    Summary: The in-sample R-squared, MSE and RMSE of every group from its normal-equation sums
+    Input:
+        - sums (dict): The output of accumulate
+        - coef (array): G x p coefficients
+    Output:
+        - metrics (DataFrame): n, r2, mse, rmse of every group
+    """
+    # SSE = y'y - 2 b'Z'y + b'Z'Z b
+    sse = sums["yty"] - 2 * np.einsum("gp,gp->g", coef, sums["Zty"]) + np.einsum("gp,gpq,gq->g", coef, sums["ZtZ"], coef)
+    n = sums["n"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sst = sums["yty"] - sums["y_sum"] ** 2 / n
+        mse = np.maximum(sse, 0) / n
+        r2 = 1 - np.maximum(sse, 0) / sst
+    return pd.DataFrame({"n": n, "r2": r2, "mse": mse, "rmse": np.sqrt(mse)})
+
+
+class GroupedLinearRegression(RegressorMixin, BaseEstimator):
+    """
+    Summary: One ordinary least squares model per group, fit and evaluated in vectorized passes. The group columns select the model; the
+    remaining columns of X are the predictors (cast to float, as LinearRegression does).
+    """
+
+    def __init__(self, group_vars=("STATEFP",), min_group_rows: int = 50, alpha: float = 0.0):
+        """
+        Input:
+            - group_vars (tuple): The group columns of X
+            - min_group_rows (int): Groups with fewer training rows use the pooled model (rank-deficient groups keep their own model)
+            - alpha (float): Ridge penalty on the standardized slopes (0 is ordinary least squares)
+        """
+        self.group_vars = group_vars
+        self.min_group_rows = min_group_rows
+        self.alpha = alpha
+
+    def _design(self, X, features=None):
+        # Standardized predictors keep the normal equations of large values (AADT) well conditioned
+        Z = X[self.feature_names_].to_numpy(dtype=np.float64) if features is None else features
+        Z = (Z - self.x_mean_) / self.x_scale_
+        return np.column_stack([np.ones(len(Z)), Z])
+
+    def fit(self, X, y):
+        """
+        Summary: Fit the model of every group
+        Input:
+            - X (DataFrame): The group columns and the predictors
+            - y (array): The response
+        """
+        group_vars = list(self.group_vars)
+        self.feature_names_ = [c for c in X.columns if c not in group_vars]
+        features = X[self.feature_names_].to_numpy(dtype=np.float64)
+        self.x_mean_ = features.mean(axis=0)
+        x_std = features.std(axis=0)
+        self.x_scale_ = np.where(x_std > 0, x_std, 1.0)
+
+        codes, self.groups_ = group_codes(X, group_vars)
+        y = np.asarray(y, dtype=np.float64)
+        sums = accumulate(codes, self._design(X, features), y, len(self.groups_))
+
+        # The pooled model is the sum of the group systems; it is solved last as group G
+        pooled = {k: np.concatenate([v, v.sum(axis=0, keepdims=True)]) for k, v in sums.items()}
+        coef, _ = solve_batch(pooled["ZtZ"], pooled["Zty"], self.alpha)
+        self.pooled_coef_ = coef[-1]
+        use_group = sums["n"] >= self.min_group_rows
+        self.coef_groups_ = np.where(use_group[:, None], coef[:-1], self.pooled_coef_)
+        self.fallback_groups_ = self.groups_[~use_group].reset_index(drop=True)
+
+        # Training metrics of the coefficients actually used by each group
+        self.train_metrics_ = pd.concat(
+            [self.groups_, sums_metrics(sums, self.coef_groups_).assign(own_model=use_group)], axis=1
+        )
+        if len(self.fallback_groups_):
+            print(f"{len(self.fallback_groups_)} of {len(self.groups_)} groups use the pooled linear model", flush=True)
+        return self
+
+    def predict(self, X):
+        """
+        Summary: Predict every row with the model of its group (the pooled model for groups not seen in training)
+        Input:
+            - X (DataFrame): The group columns and the predictors
+        Output:
+            - y_pred (array): The predictions
+        """
+        codes, _ = group_codes(X, list(self.group_vars), self.groups_)
+        coef = np.vstack([self.coef_groups_, self.pooled_coef_])[codes]
+        return np.einsum("np,np->n", self._design(X), coef)
+
+    def group_metrics(self, X, y):
+        """
+        Summary: The metrics of every group on new data (e.g. the test set), from per-group sums in one pass (see utils.evaluation)
+        Input:
+            - X (DataFrame): The group columns and the predictors
+            - y (array): The response
+        Output:
+            - metrics (DataFrame): The group keys, n and the metrics of utils.evaluation of every group of X
+        """
+        codes, groups = group_codes(X, list(self.group_vars))
+        return pd.concat([groups, group_metrics(codes, len(groups), y, self.predict(X))], axis=1)
+
+    def coefficients(self):
+        """
+        Summary: The intercept and slopes of every group on the original predictor scale
+        Output:
+            - coef (DataFrame): The group keys, intercept and one column per predictor
+        """
+        slopes = self.coef_groups_[:, 1:] / self.x_scale_
+        intercept = self.coef_groups_[:, 0] - slopes @ self.x_mean_
+        return pd.concat(
+            [self.groups_, pd.DataFrame(np.column_stack([intercept, slopes]), columns=["intercept", *self.feature_names_])], axis=1
+        )
@@ -0,0 +1,206 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the incremental traffic density update. The block-link pairs and the block densities are stored per state
+(pairs/tile_<STATEFP>.parquet and density/density_<STATEFP>.parquet), and a manifest keeps a content hash of each state's census blocks and
+road links (geometry, VKT fields and thus the imputed AADT behind them). On an update only the states whose hash changed are dirty: their blocks
+are overlaid again, together with the blocks of other states that lie within the buffer distance of a dirty state's links (now or in the
+stored pairs), and the refreshed per-state densities are merged back into the national table.
+
+<LICENSE>
+"""
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import shapely
+from pathlib import Path
+from utils.overlay import run_overlay
+from utils.density import stream_density
+
+MANIFEST = "manifest.json"
+LINK_STATE = "Link_STATEFP"
+
+
+def _hash_frame(df, geoms):
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    digest.update(b"".join(shapely.to_wkb(geoms)))
+    return digest.hexdigest()
+
+
+def state_hashes(blocks, links, block_fields, link_fields):
+    """
+    Summary: Content hash of the census blocks and the road links of every state
+    Input:
+        - blocks (GeoDataFrame): Census blocks with GEOID20
+        - links (GeoDataFrame): Road links with FID_Link_Cnty_Intxn and Link_STATEFP
+        - block_fields (list): The block attributes that enter the density
+        - link_fields (list): The link attributes that enter the density
+    Output:
+        - hashes (dict): {STATEFP: {"blocks": sha256, "links": sha256}}
+    """
+    hashes = {}
+    block_state = blocks["GEOID20"].str[:2]
+    for state, rows in pd.Series(np.arange(len(blocks))).groupby(block_state.to_numpy()).indices.items():
+        part = blocks.iloc[rows].sort_values("GEOID20")
+        hashes.setdefault(state, {})["blocks"] = _hash_frame(part[block_fields], part.geometry.values)
+    for state, rows in pd.Series(np.arange(len(links))).groupby(links[LINK_STATE].to_numpy()).indices.items():
+        part = links.iloc[rows].sort_values("FID_Link_Cnty_Intxn")
+        hashes.setdefault(state, {})["links"] = _hash_frame(part[link_fields], part.geometry.values)
+    return hashes
+
+
+def load_manifest(out_dir: Path):
+    path = Path(out_dir) / MANIFEST
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(out_dir: Path, manifest: dict):
+    path = Path(out_dir) / MANIFEST
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def dirty_states(manifest: dict, hashes: dict, settings: dict):
+    """
+    Summary: The states whose blocks or links changed since the manifest was written (all states when the overlay settings changed)
+    Input:
+        - manifest (dict): The stored manifest
+        - hashes (dict): The current state hashes
+        - settings (dict): The current overlay settings (distance, kernel)
+    Output:
+        - dirty (set): The dirty state FIPS codes, including states that were removed
+    """
+    if manifest.get("settings") != settings:
+        return set(hashes) | set(manifest.get("states", {}))
+    stored = manifest.get("states", {})
+    return {state for state in set(hashes) | set(stored) if hashes.get(state) != stored.get(state)}
+
+
+def affected_blocks(blocks, links, dirty: set, distance: float, pairs_dir: Path):
+    """
+    Summary: The blocks whose density can change with the dirty states: the blocks of the dirty states, and the blocks of the other states
+    within the buffer distance of a dirty state's links, either now or in the stored pairs (links that moved away or were removed)
+    Input:
+        - blocks (GeoDataFrame): Census blocks with GEOID20
+        - links (GeoDataFrame): Road links with Link_STATEFP
+        - dirty (set): The dirty state FIPS codes
+        - distance (float): The (largest) buffer distance
+        - pairs_dir (Path): The directory of the stored per-state pairs
+    Output:
+        - mask (array): Whether each block is affected
+    """
+    block_state = blocks["GEOID20"].str[:2].to_numpy()
+    mask = np.isin(block_state, list(dirty))
+
+    dirty_links = np.asarray(links.geometry.values)[links[LINK_STATE].isin(dirty).to_numpy()]
+    if len(dirty_links):
+        near, _ = shapely.STRtree(dirty_links).query(np.asarray(blocks.geometry.values), predicate="dwithin", distance=distance)
+        mask[near] = True
+
+    for file in Path(pairs_dir).glob("tile_*.parquet"):
+        if file.stem[len("tile_"):] in dirty:
+            continue
+        stored = pd.read_parquet(file, columns=["GEOID20", LINK_STATE])
+        mask |= blocks["GEOID20"].isin(stored.loc[stored[LINK_STATE].isin(dirty), "GEOID20"]).to_numpy()
+    return mask
+
+
+def _write_parquet(df, path: Path):
+    tmp_path = Path(path).with_suffix(".tmp")
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def update_density(
+    blocks,
+    links,
+    out_dir: Path,
+    distance=250,
+    kernel: str = "buffer",
+    n_workers: int = None,
+    apportion: bool = True,
+):
+    """
+    Summary: Bring the per-state pairs and densities in out_dir up to date with the blocks and links, recomputing only what changed
+    Input:
+        - blocks (GeoDataFrame): Census blocks with GEOID20 and Area_Land_Orig, in a projected CRS
+        - links (GeoDataFrame): Road links with FID_Link_Cnty_Intxn, STATEFP, Shape_Length_New and the VKT fields, in the same CRS
+        - out_dir (Path): The directory of the manifest, pairs/, density/ and traffic_density.parquet
+        - distance (float or list): The buffer distance(s) in meters (see utils.overlay.run_overlay)
+        - kernel (str): The overlay kernel (see utils.overlay.run_overlay)
+        - n_workers (int): The number of worker processes
+        - apportion (bool): Apportion VKT by the clipped length share (see utils.density.DensityAccumulator)
+    Output:
+        - density (DataFrame): The national traffic density table
+        - report (dict): The dirty states, the number of affected blocks and the runtime
+        A RuntimeError is raised when a state could not be overlaid; the stored pairs, densities and manifest are then left unchanged so
+        that the next run recomputes the state.
+    """
+    start = time.perf_counter()
+    out_dir = Path(out_dir)
+    pairs_dir, density_dir = out_dir / "pairs", out_dir / "density"
+    pairs_dir.mkdir(parents=True, exist_ok=True)
+    density_dir.mkdir(parents=True, exist_ok=True)
+
+    links = links.rename(columns={"STATEFP": LINK_STATE})
+    block_fields = [c for c in blocks.columns if c != blocks.geometry.name]
+    link_fields = [c for c in links.columns if c != links.geometry.name]
+
+    settings = {"distance": distance, "kernel": kernel, "apportion": apportion}
+    manifest = load_manifest(out_dir)
+    hashes = state_hashes(blocks, links, block_fields, link_fields)
+    dirty = dirty_states(manifest, hashes, settings)
+    print(f"Dirty states: {sorted(dirty)}", flush=True)
+
+    max_distance = float(np.max(distance))
+    mask = affected_blocks(blocks, links, dirty, max_distance, pairs_dir) if dirty else np.zeros(len(blocks), dtype=bool)
+    affected = blocks[mask]
+    print(f"Recomputing {len(affected)} of {len(blocks)} blocks", flush=True)
+
+    if len(affected):
+        staging_dir = out_dir / "staging"
+        for file in staging_dir.glob("tile_*.parquet"):
+            file.unlink()
+        # A failed state tile raises here, before any pairs, density or the manifest are rewritten, so the next run retries it
+        run_overlay(affected, links, staging_dir, distance=distance, partition="state", n_workers=n_workers, resume=False, kernel=kernel)
+        missing = sorted(state for state in set(affected["GEOID20"].str[:2]) if not (staging_dir / f"tile_{state}.parquet").exists())
+        if missing:
+            raise RuntimeError(f"The overlay of states {missing} was not staged; the pairs and the manifest were left unchanged")
+
+        # Replace the pairs of the affected blocks state by state; blocks of removed states drop out with their files
+        affected_geoids = set(affected["GEOID20"])
+        block_states = set(blocks["GEOID20"].str[:2])
+        touched = set(affected["GEOID20"].str[:2]) | (dirty - block_states)
+        for state in sorted(touched):
+            pairs_file, staged_file = pairs_dir / f"tile_{state}.parquet", staging_dir / f"tile_{state}.parquet"
+            density_file = density_dir / f"density_{state}.parquet"
+            parts = []
+            if pairs_file.exists() and state not in dirty:
+                stored = pd.read_parquet(pairs_file)
+                parts.append(stored[~stored["GEOID20"].isin(affected_geoids)])
+            if staged_file.exists():
+                parts.append(pd.read_parquet(staged_file))
+            if state not in block_states or not parts:
+                pairs_file.unlink(missing_ok=True)
+                density_file.unlink(missing_ok=True)
+                continue
+            _write_parquet(pd.concat(parts, ignore_index=True), pairs_file)
+            _write_parquet(stream_density(pairs_file, apportion=apportion), density_file)
+
+    density = pd.concat([pd.read_parquet(f) for f in sorted(density_dir.glob("density_*.parquet"))], ignore_index=True)
+    _write_parquet(density, out_dir / "traffic_density.parquet")
+    save_manifest(out_dir, {"settings": settings, "states": hashes})
+
+    report = {"dirty_states": sorted(dirty), "affected_blocks": int(mask.sum()), "seconds": time.perf_counter() - start}
+    print(f"Updated traffic density of {len(density)} blocks in {report['seconds']:.1f}s", flush=True)
+    return density, report
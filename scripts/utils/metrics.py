@@ -0,0 +1,149 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the optional live metrics exporter of long-running jobs (hyperparameter tuning, sensitivity runs, the national
+overlay). When started, it serves Prometheus metrics on localhost: the current stage (from the utils.telemetry stage hooks), rows processed,
+partitions completed, trials finished, best score so far, the RSS of the process and its workers, and an ETA from the progress of the
+partitions or trials. It is started with start_exporter or by setting HPMS_METRICS_PORT; without prometheus-client, or when it is not
+started, every update is a no-op. Scrape it with curl http://127.0.0.1:<port>/metrics.
+
+<LICENSE>
+"""
+import os
+import time
+import psutil
+from utils import telemetry
+
+try:
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Info, start_http_server
+except ImportError:
+    CollectorRegistry = None
+
+PORT_ENV_VAR = "HPMS_METRICS_PORT"
+# Set by the exporting process so that its worker processes do not try to bind the same port
+OWNER_ENV_VAR = "HPMS_METRICS_OWNER"
+DEFAULT_PORT = 9108
+
+
+class _Exporter:
+    """
+    Summary: The metrics of the exporting process
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.process = psutil.Process()
+        self.stage = Info("hpms_stage", "The pipeline stage in progress", registry=registry)
+        self.stage_started = Gauge("hpms_stage_started_timestamp_seconds", "Start time of the stage in progress", registry=registry)
+        self.rows = Counter("hpms_rows_processed", "Rows processed by finished stages", ["stage"], registry=registry)
+        self.partitions_completed = Gauge("hpms_partitions_completed", "Partitions (tiles, states, batches) completed", registry=registry)
+        self.partitions_total = Gauge("hpms_partitions_total", "Partitions of the current partitioned stage", registry=registry)
+        self.trials_completed = Gauge("hpms_trials_completed", "Tuning trials finished", registry=registry)
+        self.trials_total = Gauge("hpms_trials_total", "Tuning trials planned", registry=registry)
+        self.best_score = Gauge("hpms_best_score", "Best tuning score so far", registry=registry)
+        Gauge("hpms_rss_bytes", "Resident memory of the process and its workers", registry=registry).set_function(self.rss)
+        Gauge("hpms_eta_seconds", "Estimated seconds until the current partitions / trials finish", registry=registry).set_function(self.eta)
+        self.progress = {}
+        self.set_stage("idle")
+
+    def rss(self):
+        total = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def eta(self):
+        # Extrapolate the elapsed time of the most recently updated progress (partitions or trials)
+        if not self.progress:
+            return float("nan")
+        start, done, total, _ = max(self.progress.values(), key=lambda p: p[3])
+        if done <= 0 or total <= 0:
+            return float("nan")
+        return (time.time() - start) / done * max(total - done, 0)
+
+    def set_stage(self, name):
+        self.stage.info({"stage": name})
+        self.stage_started.set(time.time())
+
+    def set_progress(self, kind, done, total):
+        now = time.time()
+        previous = self.progress.get(kind)
+        # A new partitioned stage (or a restart) resets the clock of the ETA
+        if previous is None or done == 0 or done < previous[1] or total != previous[2]:
+            start = now
+        else:
+            start = previous[0]
+        self.progress[kind] = (start, done, total, now)
+        completed, planned = (self.partitions_completed, self.partitions_total) if kind == "partitions" else (self.trials_completed, self.trials_total)
+        completed.set(done)
+        planned.set(total)
+
+    def on_stage(self, event, stage):
+        if event == "start":
+            self.set_stage(stage.name)
+            return
+        rows = stage.rows_out if stage.rows_out is not None else stage.rows_in
+        if rows:
+            self.rows.labels(stage.name).inc(rows)
+        self.set_stage(stage.parent or "idle")
+
+
+_EXPORTER = None
+
+
+def start_exporter(port: int = None, addr: str = "127.0.0.1"):
+    """
+    Summary: Serve the metrics on localhost (once per process)
+    Input:
+        - port (int): The port (defaults to HPMS_METRICS_PORT, then 9108)
+        - addr (str): The address to bind
+    Output:
+        - started (bool): Whether the exporter is running
+    """
+    global _EXPORTER
+    if _EXPORTER is not None:
+        return True
+    if CollectorRegistry is None:
+        print("WARNING: prometheus-client is not installed; the metrics exporter is disabled", flush=True)
+        return False
+
+    port = int(port or os.environ.get(PORT_ENV_VAR) or DEFAULT_PORT)
+    registry = CollectorRegistry()
+    exporter = _Exporter(registry)
+    try:
+        start_http_server(port, addr=addr, registry=registry)
+    except OSError as e:
+        print(f"WARNING: The metrics exporter could not bind {addr}:{port}. {e}", flush=True)
+        return False
+    _EXPORTER = exporter
+    os.environ[OWNER_ENV_VAR] = str(os.getpid())
+    telemetry.add_listener(exporter.on_stage)
+    print(f"Serving metrics on http://{addr}:{port}/metrics", flush=True)
+    return True
+
+
+def set_progress(done: int, total: int, kind: str = "partitions"):
+    """
+    Summary: Report the progress of a partitioned stage ("partitions") or of a tuning run ("trials")
+    """
+    if _EXPORTER is not None:
+        _EXPORTER.set_progress(kind, done, total)
+
+
+def trial_finished(done: int, total: int, best_score: float = None):
+    """
+    Summary: Report a finished tuning trial and the best score so far
+    """
+    if _EXPORTER is not None:
+        _EXPORTER.set_progress("trials", done, total)
+        if best_score is not None:
+            _EXPORTER.best_score.set(best_score)
+
+
+# Start from the environment in the main process only (workers inherit the owner variable)
+if os.environ.get(PORT_ENV_VAR) and not os.environ.get(OWNER_ENV_VAR):
+    start_exporter()
@@ -0,0 +1,504 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains a spatially tiled, multi-process overlay of census block buffers and HPMS road links, replacing the national
+PairwiseBuffer + PairwiseIntersect of compile_traffic_density.py. Blocks are partitioned into grid tiles (or states); each tile receives the
+road links within the buffer distance of its extent, finds candidate block-road pairs with an STRtree, clips the links with vectorized Shapely 2
+and writes its pairs to one Parquet file. At most a few tiles per worker are in flight at a time, so the pickled tile inputs do not pile up.
+A run with failed tiles raises an error after the others finish; the tile settings are recorded in overlay.json and a resumed run with the
+same settings skips the finished tiles.
+
+<LICENSE>
+"""
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+import shapely
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from utils.telemetry import instrument, n_rows
+from utils import metrics
+
+# Defaults of the buffer-free kernel: coarse round caps and the number of pairs clipped at a time
+DWITHIN_QUAD_SEGS = 4
+DWITHIN_CHUNK_SIZE = 20000
+# Tiles in flight per worker process; the inputs of the other tiles are built only when a slot frees up
+TILES_PER_WORKER = 2
+# The settings of the tiles in an overlay output directory
+MANIFEST_NAME = "overlay.json"
+
+def assign_grid_tiles(geoms, tile_size: float):
+    """
+    Summary: Assign each geometry to the square grid tile containing the center of its bounding box
+    Input:
+        - geoms (array): Shapely geometries in a projected CRS
+        - tile_size (float): The tile width in CRS units (meters)
+    Output:
+        - tiles (array): The tile key of each geometry ("<col>_<row>")
+    """
+    bounds = shapely.bounds(geoms)
+    cols = np.floor((bounds[:, 0] + bounds[:, 2]) / 2 / tile_size).astype(np.int64)
+    rows = np.floor((bounds[:, 1] + bounds[:, 3]) / 2 / tile_size).astype(np.int64)
+    return np.char.add(np.char.add(cols.astype(str), "_"), rows.astype(str))
+
+
+def assign_state_tiles(geoids):
+    """
+    Summary: Assign each census block to its state
+    Input:
+        - geoids (array): The GEOID20 of each block
+    Output:
+        - tiles (array): The state FIPS code of each block
+    """
+    return np.asarray(geoids).astype(str).astype("U2")
+
+
+def overlay_pairs(block_geoms, road_geoms, distance: float, road_tree=None):
+    """
+    Summary: Clip the road links against the buffer of every block they pass within distance of
+    Input:
+        - block_geoms (array): The block polygons
+        - road_geoms (array): The road link lines
+        - distance (float): The buffer distance in CRS units (meters)
+        - road_tree (STRtree): An existing STRtree of road_geoms
+    Output:
+        - block_idx (array): The position of the block of each pair
+        - road_idx (array): The position of the road link of each pair
+        - length (array): The length of the link inside the block buffer
+    """
+    buffers = shapely.buffer(block_geoms, distance)
+    road_tree = road_tree if road_tree is not None else shapely.STRtree(road_geoms)
+    block_idx, road_idx = road_tree.query(buffers, predicate="intersects")
+    clipped = shapely.intersection(road_geoms[road_idx], buffers[block_idx])
+    return block_idx, road_idx, shapely.length(clipped)
+
+
+def equal_width_distance(distance: float, quad_segs: int):
+    """
+    Summary: The buffer distance at which a round cap of quad_segs segments per quarter circle has the perimeter (mean width) of the true circle.
+    The coarse polygon's vertices lie on the circle, so without the correction it would systematically clip the links short.
+    Input:
+        - distance (float): The buffer distance
+        - quad_segs (int): Segments per quarter circle
+    Output:
+        - distance (float): The corrected buffer distance
+    """
+    n_sides = 4 * quad_segs
+    return distance * np.pi / (n_sides * np.sin(np.pi / n_sides))
+
+
+def overlay_pairs_dwithin(
+    block_geoms,
+    road_geoms,
+    distance: float,
+    road_tree=None,
+    quad_segs: int = DWITHIN_QUAD_SEGS,
+    chunk_size: int = DWITHIN_CHUNK_SIZE,
+):
+    """
+    Summary: Buffer-free variant of overlay_pairs. Candidate pairs come from a dwithin query on the block polygons themselves,
+    and each chunk of pairs is clipped against coarse buffers of only the blocks in that chunk, which are freed before the next chunk.
+    Input:
+        - block_geoms (array): The block polygons
+        - road_geoms (array): The road link lines
+        - distance (float): The buffer distance in CRS units (meters)
+        - road_tree (STRtree): An existing STRtree of road_geoms
+        - quad_segs (int): Segments per quarter circle of the on-the-fly buffers (Shapely's default is 8)
+        - chunk_size (int): The number of pairs clipped at a time
+    Output:
+        - block_idx (array): The position of the block of each pair
+        - road_idx (array): The position of the road link of each pair
+        - length (array): The length of the link inside the block buffer
+    """
+    road_tree = road_tree if road_tree is not None else shapely.STRtree(road_geoms)
+    block_idx, road_idx = road_tree.query(block_geoms, predicate="dwithin", distance=distance)
+    coarse_distance = equal_width_distance(distance, quad_segs)
+
+    length = np.empty(len(block_idx), dtype=np.float64)
+    for start in range(0, len(block_idx), chunk_size):
+        stop = start + chunk_size
+        chunk_blocks, inverse = np.unique(block_idx[start:stop], return_inverse=True)
+        buffers = shapely.buffer(block_geoms[chunk_blocks], coarse_distance, quad_segs=quad_segs)
+        clipped = shapely.intersection(road_geoms[road_idx[start:stop]], buffers[inverse])
+        length[start:stop] = shapely.length(clipped)
+        del buffers, clipped
+    return block_idx, road_idx, length
+
+
+KERNELS = {"buffer": overlay_pairs, "dwithin": overlay_pairs_dwithin}
+
+
+def length_column(distance: float):
+    """
+    Summary: The name of the clipped length column of a buffer distance in a multi-distance overlay (e.g. Length_Clip_250)
+    """
+    return f"Length_Clip_{distance:g}"
+
+
+def overlay_pairs_multi(
+    block_geoms,
+    road_geoms,
+    distances,
+    road_tree=None,
+    kernel: str = "buffer",
+    quad_segs: int = DWITHIN_QUAD_SEGS,
+    chunk_size: int = DWITHIN_CHUNK_SIZE,
+):
+    """
+    Summary: Clip the road links against block buffers of several distances in one pass. Candidate pairs are found once at the largest distance,
+    and the distances are then visited from the largest to the smallest (nested rings): a pair only reaches a smaller buffer if it touches the
+    larger one, and simple links lying wholly inside a buffer take their full length without an intersection (the lengths are those of
+    overlay_pairs).
+    Input:
+        - block_geoms (array): The block polygons
+        - road_geoms (array): The road link lines
+        - distances (list): The buffer distances in CRS units (meters)
+        - road_tree (STRtree): An existing STRtree of road_geoms
+        - kernel (str): "buffer" for exact buffers, or "dwithin" for the dwithin candidate query and coarse buffers of overlay_pairs_dwithin
+        - quad_segs (int): Segments per quarter circle of the coarse buffers of the dwithin kernel
+        - chunk_size (int): The number of pairs clipped at a time
+    Output:
+        - block_idx (array): The position of the block of each pair
+        - road_idx (array): The position of the road link of each pair
+        - lengths (array): The length of the link inside the block buffer of each distance (n_pairs x n_distances, in the order of distances)
+    """
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown kernel {kernel}")
+    order = np.argsort(distances)[::-1]
+    max_distance = distances[order[0]]
+    road_tree = road_tree if road_tree is not None else shapely.STRtree(road_geoms)
+    if kernel == "dwithin":
+        block_idx, road_idx = road_tree.query(block_geoms, predicate="dwithin", distance=max_distance)
+    else:
+        block_idx, road_idx = road_tree.query(shapely.buffer(block_geoms, max_distance), predicate="intersects")
+
+    # The shortcut length of a link inside a buffer must equal its intersection length (as in overlay_pairs). The intersection
+    # dissolves the self-overlapping parts of non-simple links, so only simple links take their full length
+    road_length = shapely.length(road_geoms)
+    road_simple = shapely.is_simple(road_geoms)
+    lengths = np.zeros((len(block_idx), len(distances)), dtype=np.float64)
+    for start in range(0, len(block_idx), chunk_size):
+        stop = start + chunk_size
+        chunk_blocks, inverse = np.unique(block_idx[start:stop], return_inverse=True)
+        chunk_roads = road_idx[start:stop]
+        active = np.arange(len(chunk_roads))
+        for k in order:
+            if kernel == "dwithin":
+                buffers = shapely.buffer(block_geoms[chunk_blocks], equal_width_distance(distances[k], quad_segs), quad_segs=quad_segs)
+            else:
+                buffers = shapely.buffer(block_geoms[chunk_blocks], distances[k])
+            shapely.prepare(buffers)
+            pair_buffers = buffers[inverse[active]]
+            pair_roads = road_geoms[chunk_roads[active]]
+
+            # Simple links lying wholly inside the buffer keep their full length; the others are clipped,
+            # and only the links that reach into this ring's buffer are carried to the next smaller distance
+            inside = road_simple[chunk_roads[active]] & shapely.covers(pair_buffers, pair_roads)
+            crossing = ~inside & shapely.intersects(pair_buffers, pair_roads)
+            length = np.zeros(len(active), dtype=np.float64)
+            length[inside] = road_length[chunk_roads[active[inside]]]
+            length[crossing] = shapely.length(shapely.intersection(pair_roads[crossing], pair_buffers[crossing]))
+            lengths[start + active, k] = length
+            active = active[length > 0]
+        del buffers, pair_buffers
+    return block_idx, road_idx, lengths
+
+
+def compare_kernels(block_geoms, road_geoms, distance: float, quad_segs: int = DWITHIN_QUAD_SEGS, chunk_size: int = DWITHIN_CHUNK_SIZE):
+    """
+    Summary: Compare the dwithin kernel with the buffer kernel on a set of blocks (accuracy, runtime and buffer memory)
+    Input:
+        - block_geoms (array): The block polygons
+        - road_geoms (array): The road link lines
+        - distance (float): The buffer distance in CRS units (meters)
+        - quad_segs (int): Segments per quarter circle of the dwithin kernel's buffers
+        - chunk_size (int): The number of pairs clipped at a time by the dwithin kernel
+    Output:
+        - report (dict): Pair counts, total length difference, per-pair error, runtimes and the coordinate memory of the buffers
+    """
+    road_tree = shapely.STRtree(road_geoms)
+
+    start = time.perf_counter()
+    ref_block, ref_road, ref_length = overlay_pairs(block_geoms, road_geoms, distance, road_tree)
+    buffer_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_block, new_road, new_length = overlay_pairs_dwithin(block_geoms, road_geoms, distance, road_tree, quad_segs, chunk_size)
+    dwithin_seconds = time.perf_counter() - start
+
+    # Align the pairs of both kernels on (block, road)
+    n_roads = len(road_geoms)
+    ref = pd.Series(ref_length, index=ref_block.astype(np.int64) * n_roads + ref_road)
+    new = pd.Series(new_length, index=new_block.astype(np.int64) * n_roads + new_road)
+    ref, new = ref[ref > 0], new[new > 0]
+    ref, new = ref.align(new, fill_value=0.0)
+    abs_error = np.abs(new.to_numpy() - ref.to_numpy())
+
+    # Coordinates are stored as 2 doubles; the buffer kernel holds all buffers at once, the dwithin kernel one chunk's at most
+    full_coords = shapely.get_num_coordinates(shapely.buffer(block_geoms, distance))
+    coarse_coords = shapely.get_num_coordinates(shapely.buffer(block_geoms, distance, quad_segs=quad_segs))
+    chunk_coords = max(
+        (coarse_coords[np.unique(new_block[i : i + chunk_size])].sum() for i in range(0, len(new_block), chunk_size)),
+        default=0,
+    )
+    return {
+        "n_pairs_buffer": int((ref > 0).sum()),
+        "n_pairs_dwithin": int((new > 0).sum()),
+        "total_length_buffer": float(ref.sum()),
+        "total_length_dwithin": float(new.sum()),
+        "total_length_rel_diff": float((new.sum() - ref.sum()) / ref.sum()) if ref.sum() else 0.0,
+        "pair_abs_error_mean": float(abs_error.mean()) if abs_error.size else 0.0,
+        "pair_abs_error_max": float(abs_error.max()) if abs_error.size else 0.0,
+        "buffer_seconds": buffer_seconds,
+        "dwithin_seconds": dwithin_seconds,
+        "buffer_coords_mb": float(full_coords.sum() * 16 / 1e6),
+        "dwithin_peak_coords_mb": float(chunk_coords * 16 / 1e6),
+    }
+
+
+def _tile_file(out_dir: Path, tile: str):
+    return Path(out_dir) / f"tile_{tile}.parquet"
+
+
+def overlay_settings(blocks, roads, distance, partition: str, tile_size: float, kernel: str, settings: dict = None):
+    """
+    Summary: The settings that determine the tiles of an overlay, as stored in overlay.json
+    Input:
+        - blocks, roads (GeoDataFrame): The overlay inputs (their carried fields and CRS are recorded)
+        - distance, partition, tile_size, kernel: See run_overlay
+        - settings (dict): Further settings of the inputs (e.g. the geometry reduction)
+    Output:
+        - settings (dict): JSON-compatible settings
+    """
+    manifest = {
+        # 250 and 250.0 give the same tiles
+        "distance": float(distance) if np.isscalar(distance) else [float(d) for d in distance],
+        "kernel": kernel,
+        "partition": partition,
+        "tile_size": tile_size if partition == "grid" else None,
+        "block_fields": [c for c in blocks.columns if c != blocks.geometry.name],
+        "road_fields": [c for c in roads.columns if c != roads.geometry.name],
+        "crs": str(blocks.crs),
+        **(settings or {}),
+    }
+    # Round-trip through JSON so that tuples, NumPy scalars etc. compare equal to the stored manifest
+    return json.loads(json.dumps(manifest, default=str))
+
+
+def read_manifest(out_dir: Path):
+    """
+    Summary: The settings of the tiles in an overlay output directory (None when it has no overlay.json)
+    """
+    path = Path(out_dir) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _prepare_out_dir(out_dir: Path, settings: dict, resume: bool):
+    """
+    Summary: Check that the finished tiles of out_dir were made with the same settings before resuming, or clear them when not resuming,
+    and record the settings
+    """
+    tiles = list(out_dir.glob("tile_*.parquet"))
+    if resume and tiles:
+        stored = read_manifest(out_dir)
+        if stored != settings:
+            if stored is None:
+                reason = f"no {MANIFEST_NAME} records their settings"
+            else:
+                changed = sorted(k for k in set(stored) | set(settings) if stored.get(k) != settings.get(k))
+                reason = "; ".join(f"{k}: {stored.get(k)} -> {settings.get(k)}" for k in changed)
+            raise ValueError(
+                f"{out_dir} holds {len(tiles)} tiles of other overlay settings ({reason}). "
+                "Rerun without resuming (--no-resume) to clear them, or write to another directory."
+            )
+    if not resume:
+        for file in tiles + list(out_dir.glob("tile_*.tmp")):
+            file.unlink()
+
+    tmp_file = out_dir / (MANIFEST_NAME + ".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(settings, f, indent=2)
+    os.replace(tmp_file, out_dir / MANIFEST_NAME)
+
+
+@instrument("intersect_tile", rows_in=lambda tile, blocks, roads, *args, **kwargs: n_rows(blocks), rows_out=lambda result, *args, **kwargs: result[1])
+def overlay_tile(tile, blocks, roads, distance, out_dir, kernel="buffer"):
+    """
+    Summary: Overlay one tile and write its pairs (runs inside a worker process)
+    Input:
+        - tile (str): The tile key
+        - blocks (DataFrame): The blocks of the tile (GEOID20, block attributes and a geometry column of shapely objects)
+        - roads (DataFrame): The road links near the tile (FID_Link_Cnty_Intxn, link attributes and geometry)
+        - distance (float or list): The buffer distance in meters, or several distances for a multi-distance overlay
+        - out_dir (Path): The output directory
+        - kernel (str): "buffer" (overlay_pairs) or "dwithin" (overlay_pairs_dwithin)
+    Output:
+        - tile (str): The tile key
+        - n_pairs (int): The number of block-road pairs written
+        - seconds (float): The processing time
+    """
+    start = time.perf_counter()
+    block_geoms = blocks["geometry"].to_numpy()
+    road_geoms = roads["geometry"].to_numpy()
+    if np.ndim(distance):
+        block_idx, road_idx, lengths = overlay_pairs_multi(block_geoms, road_geoms, distance, kernel=kernel)
+        keep = lengths.max(axis=1) > 0
+    else:
+        block_idx, road_idx, length = KERNELS[kernel](block_geoms, road_geoms, distance)
+        keep = length > 0
+    pairs = pd.concat(
+        [
+            blocks.drop(columns="geometry").iloc[block_idx[keep]].reset_index(drop=True),
+            roads.drop(columns="geometry").iloc[road_idx[keep]].reset_index(drop=True),
+        ],
+        axis=1,
+    )
+    if np.ndim(distance):
+        for k, d in enumerate(distance):
+            pairs[length_column(d)] = lengths[keep, k]
+    else:
+        pairs["Length_Clip"] = length[keep]
+
+    # Write to a temporary name first so that an interrupted tile is never taken as finished
+    out_file = _tile_file(out_dir, tile)
+    tmp_file = out_file.with_suffix(".tmp")
+    pairs.to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, out_file)
+    return tile, len(pairs), time.perf_counter() - start
+
+
+@instrument(
+    "intersect",
+    rows_in=lambda blocks, *args, **kwargs: n_rows(blocks),
+    rows_out=lambda result, *args, **kwargs: int(result["n_pairs"].sum()),
+)
+def run_overlay(
+    blocks,
+    roads,
+    out_dir: Path,
+    distance: float = 250,
+    partition: str = "grid",
+    tile_size: float = 50000,
+    n_workers: int = None,
+    resume: bool = True,
+    kernel: str = "buffer",
+    settings: dict = None,
+):
+    """
+    Summary: Overlay the census block buffers with the road links tile by tile on a process pool
+    Input:
+        - blocks (GeoDataFrame): Census blocks with GEOID20 and the block attributes to carry (e.g. Area_Land_Orig), in a projected CRS
+        - roads (GeoDataFrame): Road links with FID_Link_Cnty_Intxn and the link attributes to carry (e.g. VKT fields), in the same CRS
+        - out_dir (Path): Directory of the tile Parquet files
+        - distance (float or list): The buffer distance in meters, or a list of distances to write one Length_Clip_<distance> column each
+        - partition (str): "grid" for square tiles of tile_size, or "state" for one tile per state
+        - tile_size (float): The grid tile width in meters
+        - n_workers (int): The number of worker processes (defaults to the number of CPUs)
+        - resume (bool): Skip the tiles that already have an output file (a ValueError is raised when they were made with other settings);
+          without resume the existing tiles are removed first
+        - kernel (str): "buffer" to clip against exact block buffers, or "dwithin" for the buffer-free kernel
+        - settings (dict): Further settings of the inputs to record in overlay.json (e.g. the geometry reduction)
+    Output:
+        - summary (DataFrame): The number of pairs and the processing time of each tile processed in this run; a RuntimeError listing the
+          failed tiles is raised instead when any tile could not be overlaid (the finished tiles are kept for a resumed run)
+    """
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown kernel {kernel}")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    _prepare_out_dir(out_dir, overlay_settings(blocks, roads, distance, partition, tile_size, kernel, settings), resume)
+
+    block_geoms = np.asarray(blocks.geometry.values)
+    road_geoms = np.asarray(roads.geometry.values)
+    if partition == "grid":
+        tiles = assign_grid_tiles(block_geoms, tile_size)
+    elif partition == "state":
+        tiles = assign_state_tiles(blocks["GEOID20"])
+    else:
+        raise ValueError(f"Unknown partition {partition}")
+
+    tile_rows = pd.Series(np.arange(len(tiles))).groupby(tiles).indices
+    if resume:
+        finished = [tile for tile in tile_rows if _tile_file(out_dir, tile).exists()]
+        for tile in finished:
+            del tile_rows[tile]
+        print(f"Resuming: {len(finished)} tiles already finished", flush=True)
+
+    # Candidate roads of a tile: those within the (largest) buffer distance of the tile's block extent
+    max_distance = float(np.max(distance))
+    road_tree = shapely.STRtree(road_geoms)
+    block_attrs = pd.DataFrame(blocks.drop(columns=blocks.geometry.name))
+    road_attrs = pd.DataFrame(roads.drop(columns=roads.geometry.name))
+    block_bounds = shapely.bounds(block_geoms)
+
+    def tile_inputs(rows):
+        extent = shapely.box(
+            block_bounds[rows, 0].min() - max_distance,
+            block_bounds[rows, 1].min() - max_distance,
+            block_bounds[rows, 2].max() + max_distance,
+            block_bounds[rows, 3].max() + max_distance,
+        )
+        road_rows = np.sort(road_tree.query(extent))
+        tile_blocks = block_attrs.iloc[rows].reset_index(drop=True)
+        tile_blocks["geometry"] = block_geoms[rows]
+        tile_roads = road_attrs.iloc[road_rows].reset_index(drop=True)
+        tile_roads["geometry"] = road_geoms[road_rows]
+        return tile_blocks, tile_roads
+
+    n_workers = n_workers or os.cpu_count()
+    n_tiles = len(tile_rows)
+    print(f"Overlaying {n_tiles} tiles on {n_workers} processes...", flush=True)
+    # Submit the largest tiles first so that they do not end up as stragglers
+    queue = iter(sorted(tile_rows.items(), key=lambda item: len(item[1]), reverse=True))
+    summary, failed = [], []
+    metrics.set_progress(0, n_tiles)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = {}
+
+        def submit_next():
+            item = next(queue, None)
+            if item is not None:
+                tile, rows = item
+                pending[executor.submit(overlay_tile, tile, *tile_inputs(rows), distance, out_dir, kernel)] = tile
+
+        for _ in range(TILES_PER_WORKER * n_workers):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tile = pending.pop(future)
+                try:
+                    tile, n_pairs, seconds = future.result()
+                    summary.append({"tile": tile, "n_pairs": n_pairs, "seconds": seconds})
+                    print(f"Tile {tile} finished ({len(summary) + len(failed)}/{n_tiles}): {n_pairs} pairs in {seconds:.1f}s", flush=True)
+                except Exception as e:
+                    failed.append(tile)
+                    print(f"ERROR: Tile {tile} could not be overlaid. {e}", flush=True)
+                metrics.set_progress(len(summary) + len(failed), n_tiles)
+                submit_next()
+
+    if failed:
+        raise RuntimeError(
+            f"{len(failed)} of {n_tiles} tiles could not be overlaid: {sorted(failed)}. "
+            "Rerun with resume to recompute only these tiles."
+        )
+    return pd.DataFrame(summary, columns=["tile", "n_pairs", "seconds"])
+
+
+def read_pairs(out_dir: Path, columns=None):
+    """
+    Summary: Read the pairs written by run_overlay
+    Input:
+        - out_dir (Path): Directory of the tile Parquet files
+        - columns (list): The columns to read
+    Output:
+        - pairs (DataFrame): The pairs of all tiles
+    """
+    files = sorted(Path(out_dir).glob("tile_*.parquet"))
+    return pd.concat([pd.read_parquet(f, columns=columns) for f in files], ignore_index=True)
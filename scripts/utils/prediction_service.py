@@ -0,0 +1,373 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains a small local HTTP service that answers AADT_MDV / AADT_HDV queries for road segments from persisted AADTPredictor models.
+The models are loaded once (memory-mapped, see utils.forest_store), concurrent requests are coalesced into micro-batches for the ForestEngine,
+recent feature tuples are served from an LRU cache, and latency / throughput statistics are reported at /stats.
+Endpoints:
+    - POST /predict: JSON ({"records": [...]}, {"columns": {...}} or a list of records) or an Arrow IPC stream of (STATEFP, COUNTYFP, F_SYSTEM, THROUGH_LANES, AADT)
+    - GET /stats: p50/p99 latency, throughput and cache statistics
+    - GET /health
+
+<LICENSE>
+"""
+import io
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from utils.forest_inference import ForestEngine
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+class LRUCache:
+    """
+    Summary: Thread-safe least-recently-used cache of predictions keyed by feature tuples
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """
+        Summary: Look up several keys at once
+        Input:
+            - keys (list): The cache keys
+        Output:
+            - values (list): The cached value of each key, or None
+        """
+        values = []
+        with self.lock:
+            for key in keys:
+                value = self.entries.get(key)
+                if value is None:
+                    self.misses += 1
+                else:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                values.append(value)
+        return values
+
+    def put_many(self, keys, values):
+        """
+        Summary: Insert several entries, evicting the least recently used ones
+        Input:
+            - keys (list): The cache keys
+            - values (list): The values to cache
+        """
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            for key, value in zip(keys, values):
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+class MicroBatcher:
+    """
+    Summary: Coalesce concurrent prediction requests into one batch per model call
+    """
+
+    def __init__(self, predict_fn, max_batch_rows: int = 8192, max_wait_ms: float = 2.0):
+        """
+        Input:
+            - predict_fn: Function mapping a float32 array of rows to an (n_rows, n_outputs) array
+            - max_batch_rows (int): The maximum number of rows in a batch
+            - max_wait_ms (float): How long the first request of a batch waits for others to join
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.batch_sizes = deque(maxlen=10000)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, X):
+        """
+        Summary: Queue rows for prediction
+        Input:
+            - X (array): float32 predictor rows
+        Output:
+            - future (Future): Resolves to the predictions of the rows
+        """
+        future = Future()
+        self.requests.put((X, future))
+        return future
+
+    def close(self):
+        """
+        Summary: Stop the batching thread once the queued requests are served
+        """
+        self.requests.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            first = self.requests.get()
+            if first is None:
+                return
+            pending = [first]
+            n_rows = pending[0][0].shape[0]
+            deadline = time.perf_counter() + self.max_wait
+            while n_rows < self.max_batch_rows:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Serve this batch, then stop on the next loop
+                    self.requests.put(None)
+                    break
+                pending.append(item)
+                n_rows += item[0].shape[0]
+
+            self.batch_sizes.append(n_rows)
+            try:
+                y_pred = self.predict_fn(np.concatenate([X for X, _ in pending]))
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            start = 0
+            for X, future in pending:
+                future.set_result(y_pred[start : start + X.shape[0]])
+                start += X.shape[0]
+
+
+class PredictionService:
+    """
+    Summary: Predict several response variables for segment feature rows, with micro-batching, caching and statistics
+    """
+
+    def __init__(
+        self,
+        engines: dict,
+        cache_size: int = 100000,
+        max_batch_rows: int = 8192,
+        max_wait_ms: float = 2.0,
+    ):
+        """
+        Input:
+            - engines (dict): ForestEngine of each response variable; all must use the same predictor variables
+            - cache_size (int): The number of feature tuples kept in the LRU cache
+            - max_batch_rows (int): The maximum number of rows in a micro-batch
+            - max_wait_ms (float): How long a request waits for others to join its micro-batch
+        """
+        self.engines = engines
+        self.response_vars = list(engines)
+        self.feature_names = next(iter(engines.values())).forest.feature_names
+        self.cache = LRUCache(cache_size)
+        self.batcher = MicroBatcher(self._predict_rows, max_batch_rows, max_wait_ms)
+
+        self.stats_lock = threading.Lock()
+        self.latencies = deque(maxlen=100000)
+        self.n_requests = 0
+        self.n_rows = 0
+        self.started = time.perf_counter()
+
+    @classmethod
+    def from_directory(cls, model_dir: Path, response_vars=("AADT_MDV", "AADT_HDV"), **kwargs):
+        """
+        Summary: Load the exported models of each response variable from model_dir/<response_var>
+        Input:
+            - model_dir (Path): The directory written by AADTPredictor.export_model
+            - response_vars (list): The response variables to serve
+            - **kwargs: Additional keyword arguments to pass to PredictionService
+        Output:
+            - service (PredictionService): The service
+        """
+        engines = {var: ForestEngine.load(Path(model_dir) / var) for var in response_vars}
+        return cls(engines, **kwargs)
+
+    def _predict_rows(self, X):
+        return np.column_stack([self.engines[var].predict_array(X) for var in self.response_vars])
+
+    def predict(self, data: pd.DataFrame):
+        """
+        Summary: Predict the response variables for a frame of segment features
+        Input:
+            - data (DataFrame): The predictor variables
+        Output:
+            - predictions (dict): The predictions of each response variable
+        """
+        start = time.perf_counter()
+        X = self.engines[self.response_vars[0]].forest.to_array(data)
+
+        keys = [row.tobytes() for row in X]
+        cached = self.cache.get_many(keys)
+        missing = [i for i, value in enumerate(cached) if value is None]
+
+        y_pred = np.empty((X.shape[0], len(self.response_vars)), dtype=np.float64)
+        if missing:
+            y_missing = self.batcher.submit(X[missing]).result()
+            y_pred[missing] = y_missing
+            self.cache.put_many([keys[i] for i in missing], list(y_missing))
+        hits = [i for i, value in enumerate(cached) if value is not None]
+        if hits:
+            y_pred[hits] = np.stack([cached[i] for i in hits])
+
+        with self.stats_lock:
+            self.latencies.append(time.perf_counter() - start)
+            self.n_requests += 1
+            self.n_rows += X.shape[0]
+        return {var: y_pred[:, i] for i, var in enumerate(self.response_vars)}
+
+    def close(self):
+        """
+        Summary: Stop the micro-batching thread
+        """
+        self.batcher.close()
+
+    def stats(self):
+        """
+        Summary: Latency, throughput and cache statistics since the service started
+        Output:
+            - stats (dict): The statistics
+        """
+        with self.stats_lock:
+            latencies = np.array(self.latencies) * 1000
+            n_requests, n_rows = self.n_requests, self.n_rows
+        elapsed = time.perf_counter() - self.started
+        batch_sizes = np.array(self.batcher.batch_sizes)
+        return {
+            "requests": n_requests,
+            "rows": n_rows,
+            "latency_p50_ms": float(np.percentile(latencies, 50)) if latencies.size else None,
+            "latency_p99_ms": float(np.percentile(latencies, 99)) if latencies.size else None,
+            "requests_per_s": n_requests / elapsed,
+            "rows_per_s": n_rows / elapsed,
+            "mean_batch_rows": float(batch_sizes.mean()) if batch_sizes.size else None,
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "cache_entries": len(self.cache.entries),
+        }
+
+
+def parse_request(body: bytes, content_type: str):
+    """
+    Summary: Parse a JSON or Arrow request body into a frame of segment features
+    Input:
+        - body (bytes): The request body
+        - content_type (str): The Content-Type header
+    Output:
+        - data (DataFrame): The segment features
+    """
+    if content_type.startswith(ARROW_STREAM):
+        if pa is None:
+            raise ValueError("Arrow requests require pyarrow to be installed")
+        return pa.ipc.open_stream(pa.py_buffer(body)).read_all().to_pandas()
+
+    payload = json.loads(body)
+    if isinstance(payload, dict) and "columns" in payload:
+        return pd.DataFrame(payload["columns"])
+    if isinstance(payload, dict) and "records" in payload:
+        return pd.DataFrame.from_records(payload["records"])
+    if isinstance(payload, list):
+        return pd.DataFrame.from_records(payload)
+    raise ValueError('Expected {"records": [...]}, {"columns": {...}} or a list of records')
+
+
+def make_handler(service: PredictionService):
+    """
+    Summary: Build the HTTP request handler class bound to a service
+    Input:
+        - service (PredictionService): The prediction service
+    Output:
+        - handler: A BaseHTTPRequestHandler subclass
+    """
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body: bytes, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, status, payload):
+            self._send(status, json.dumps(payload).encode())
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send_json(200, service.stats())
+            elif self.path == "/health":
+                self._send_json(200, {"status": "ok", "response_vars": service.response_vars})
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            try:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                data = parse_request(body, self.headers.get("Content-Type", "application/json"))
+                predictions = service.predict(data)
+            except (ValueError, KeyError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            except Exception as e:
+                # Any other failure (e.g. a model or dtype error) still gets a response instead of a dropped connection
+                self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+                return
+
+            try:
+                if self.headers.get("Accept", "").startswith(ARROW_STREAM) and pa is not None:
+                    table = pa.table(predictions)
+                    sink = io.BytesIO()
+                    with pa.ipc.new_stream(sink, table.schema) as writer:
+                        writer.write_table(table)
+                    response = (sink.getvalue(), ARROW_STREAM)
+                else:
+                    response = (json.dumps({var: values.tolist() for var, values in predictions.items()}).encode(), "application/json")
+            except Exception as e:
+                self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+                return
+            self._send(200, *response)
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictionHandler
+
+
+def serve(service: PredictionService, host: str = "127.0.0.1", port: int = 8000):
+    """
+    Summary: Start the HTTP server in a background thread (port 0 picks a free port)
+    Input:
+        - service (PredictionService): The prediction service
+        - host (str): The interface to bind, localhost by default
+        - port (int): The port to bind
+    Output:
+        - server (ThreadingHTTPServer): The running server; stop it with server.shutdown() and service.close()
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,212 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the rollup cube of VKT / VMT by vehicle class over GEOID levels (block, tract, county, state) x F_SYSTEM x URBAN.
+The cube is built in one streaming pass over Arrow batches of either the imputed road links (hpms_aadt_imputation.parquet, county GEOID:
+county and state levels) or block-exact block-link pairs (compile_traffic_density_tiled.py --distance 0, GEOID20: all levels, each link's VKT
+apportioned by its clipped length share). Every cell is addressed by one integer key, GEOID prefix * 100 + F_SYSTEM * 10 + URBAN, and summed
+with np.bincount; each level is stored as a sorted Parquet table that RollupCube slices without touching link-level data.
+
+<LICENSE>
+"""
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from utils.density import iter_parquet_batches, layer_columns, BATCH_SIZE
+from utils.overlay import read_manifest
+
+# GEOID prefix length of each level
+LEVELS = {"state": 2, "county": 5, "tract": 11, "block": 15}
+MEASURES = ["VKT_TOTAL", "VKT_LDV", "VKT_MDV", "VKT_HDV", "VMT_TOTAL", "VMT_LDV", "VMT_MDV", "VMT_HDV"]
+# The link fields that compile_traffic_density_tiled.py --rollup adds to the pairs
+ROLLUP_FIELDS = ["F_SYSTEM", "URBAN", "VMT_TOTAL", "VMT_LDV", "VMT_MDV", "VMT_HDV"]
+# Codes of a missing F_SYSTEM / URBAN in the cell key
+MISSING_F_SYSTEM = 0
+MISSING_URBAN = 9
+# The number of batch partials kept before they are reduced into one
+REDUCE_EVERY = 16
+
+
+def encode_cells(geoid_prefix, f_system, urban):
+    """
+    Summary: Integer key of each (GEOID prefix, F_SYSTEM, URBAN) cell
+    """
+    f_system = np.where(np.isnan(f_system), MISSING_F_SYSTEM, f_system).astype(np.int64)
+    urban = np.where(np.isnan(urban), MISSING_URBAN, urban).astype(np.int64)
+    return geoid_prefix * 100 + f_system * 10 + urban
+
+
+def decode_cells(keys):
+    """
+    Summary: Split cell keys into GEOID prefix, F_SYSTEM and URBAN codes
+    """
+    return keys // 100, (keys // 10) % 10, keys % 10
+
+
+def _reduce(partials):
+    keys = np.concatenate([k for k, _ in partials])
+    sums = np.concatenate([s for _, s in partials], axis=1)
+    uniques, inverse = np.unique(keys, return_inverse=True)
+    reduced = np.vstack([np.bincount(inverse, weights=row, minlength=uniques.size) for row in sums])
+    return uniques, reduced
+
+
+def _numeric(column):
+    return pd.to_numeric(pd.Series(column.to_numpy(zero_copy_only=False)), errors="coerce").to_numpy(dtype=np.float64)
+
+
+def check_pairs(source: Path, columns: list):
+    """
+    Summary: Check that a directory of block-link pairs is block-exact (overlaid with distance 0) and carries the rollup fields; 250 m pairs
+    would count every link in all the blocks within 250 m
+    Input:
+        - source (Path): The directory of pair tiles and their overlay.json
+        - columns (list): The columns of the pairs
+    """
+    hint = "write them with compile_traffic_density_tiled.py --distance 0 --rollup"
+    manifest = read_manifest(source)
+    if manifest is None:
+        raise ValueError(f"{source} has no overlay.json recording how its pairs were made; {hint}")
+    if manifest["distance"] != 0:
+        raise ValueError(f"The pairs in {source} were overlaid with a {manifest['distance']} m buffer, not block-exact; {hint}")
+    missing = [f for f in ROLLUP_FIELDS if f not in columns]
+    if missing:
+        raise ValueError(f"The pairs in {source} lack the rollup fields {missing}; {hint}")
+
+
+def build_cube(source: Path, out_dir: Path, geoid_field: str = None, batch_size: int = BATCH_SIZE):
+    """
+    Summary: Build the rollup cube of a Parquet source in one pass
+    Input:
+        - source (Path): hpms_aadt_imputation.parquet, or a directory of block-exact block-link pair tiles (see check_pairs)
+        - out_dir (Path): The cube directory
+        - geoid_field (str): GEOID20 for pairs or GEOID (county) for links; detected from the columns by default
+        - batch_size (int): The number of rows per batch
+    Output:
+        - cube (RollupCube): The opened cube
+    """
+    columns = layer_columns(source)
+    if Path(source).is_dir():
+        check_pairs(source, columns)
+    if geoid_field is None:
+        geoid_field = "GEOID20" if "GEOID20" in columns else "GEOID"
+    geoid_width = 15 if geoid_field == "GEOID20" else 5
+    levels = {name: width for name, width in LEVELS.items() if width <= geoid_width}
+
+    # Pairs written by compile_traffic_density_tiled.py carry the total VKT as VKT
+    renames = {"VKT": "VKT_TOTAL"} if "VKT" in columns and "VKT_TOTAL" not in columns else {}
+    measures = [m for m in MEASURES if m in columns or m in renames.values()]
+    source_measures = [next((k for k, v in renames.items() if v == m), m) for m in measures]
+    apportion = "Length_Clip" in columns
+    read = [geoid_field, "F_SYSTEM", "URBAN"] + source_measures + (["Length_Clip", "Shape_Length_New"] if apportion else [])
+
+    partials = {name: [] for name in levels}
+    n_rows = 0
+    for batch in iter_parquet_batches(source, read, batch_size):
+        geoid = _numeric(batch.column(geoid_field))
+        valid = ~np.isnan(geoid)
+        values = np.nan_to_num(np.vstack([_numeric(batch.column(m)) for m in source_measures]))
+        if apportion:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                share = np.clip(np.nan_to_num(_numeric(batch.column("Length_Clip")) / _numeric(batch.column("Shape_Length_New")), posinf=0.0), 0, 1)
+            values = values * share
+        geoid = geoid[valid].astype(np.int64)
+        values = values[:, valid]
+        f_system, urban = _numeric(batch.column("F_SYSTEM"))[valid], _numeric(batch.column("URBAN"))[valid]
+
+        for name, width in levels.items():
+            keys = encode_cells(geoid // 10 ** (geoid_width - width), f_system, urban)
+            uniques, inverse = np.unique(keys, return_inverse=True)
+            sums = np.vstack([np.bincount(inverse, weights=row, minlength=uniques.size) for row in values])
+            partials[name].append((uniques, sums))
+            if len(partials[name]) >= REDUCE_EVERY:
+                partials[name] = [_reduce(partials[name])]
+        n_rows += batch.num_rows
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, width in levels.items():
+        keys, sums = _reduce(partials[name]) if partials[name] else (np.empty(0, dtype=np.int64), np.empty((len(measures), 0)))
+        table = pd.DataFrame({"cell": keys, **{m: sums[i] for i, m in enumerate(measures)}})
+        table.to_parquet(out_dir / f"{name}.parquet", index=False)
+    with open(out_dir / "cube.json", "w") as f:
+        json.dump({"levels": levels, "measures": measures, "source": str(source), "apportioned": apportion}, f, indent=2)
+    print(f"Built the rollup cube of {n_rows} rows at levels {list(levels)}", flush=True)
+    return RollupCube.open(out_dir)
+
+
+class RollupCube:
+    """
+    Summary: Slices and totals of the rollup cube
+    """
+
+    def __init__(self, path: Path, levels: dict, measures: list):
+        self.path = Path(path)
+        self.levels = levels
+        self.measures = measures
+        self._tables = {}
+
+    @classmethod
+    def open(cls, path: Path):
+        """
+        Summary: Open a cube written by build_cube
+        """
+        with open(Path(path) / "cube.json") as f:
+            header = json.load(f)
+        return cls(path, header["levels"], header["measures"])
+
+    def _level(self, level: str):
+        if level not in self.levels:
+            raise ValueError(f"Level {level} is not in the cube (levels: {list(self.levels)})")
+        if level not in self._tables:
+            table = pd.read_parquet(self.path / f"{level}.parquet")
+            prefix, f_system, urban = decode_cells(table["cell"].to_numpy())
+            self._tables[level] = (prefix, f_system, urban, table[self.measures].to_numpy())
+        return self._tables[level]
+
+    def query(self, level: str, geoids=None, f_system=None, urban=None, by=("GEOID", "F_SYSTEM", "URBAN"), measures=None):
+        """
+        Summary: Sum the measures of a slice of the cube
+        Input:
+            - level (str): "state", "county", "tract" or "block"
+            - geoids (list): Keep these GEOIDs of the level (all by default)
+            - f_system (list): Keep these functional systems (all by default)
+            - urban (list): Keep these URBAN codes (all by default)
+            - by (list): The dimensions to keep among GEOID, F_SYSTEM and URBAN; the others are summed out
+            - measures (list): The measures to return (all by default)
+        Output:
+            - result (DataFrame): The dimensions in by and the summed measures
+        """
+        prefix, cell_f_system, cell_urban, values = self._level(level)
+        mask = np.ones(prefix.size, dtype=bool)
+        if geoids is not None:
+            mask &= np.isin(prefix, np.asarray(geoids).astype(np.int64))
+        if f_system is not None:
+            mask &= np.isin(cell_f_system, f_system)
+        if urban is not None:
+            mask &= np.isin(cell_urban, urban)
+
+        measures = self.measures if measures is None else list(measures)
+        columns = [self.measures.index(m) for m in measures]
+        dims = {
+            "GEOID": prefix[mask],
+            "F_SYSTEM": cell_f_system[mask],
+            "URBAN": cell_urban[mask],
+        }
+        by = list(by)
+        if not by:
+            return pd.DataFrame([values[mask][:, columns].sum(axis=0)], columns=measures)
+
+        # Group on one integer key of the kept dimensions
+        scales = {"GEOID": 100, "F_SYSTEM": 10, "URBAN": 1}
+        keys = sum(dims[d] * scales[d] for d in by)
+        uniques, inverse = np.unique(keys, return_inverse=True)
+        result = pd.DataFrame({m: np.bincount(inverse, weights=values[mask][:, c], minlength=uniques.size) for m, c in zip(measures, columns)})
+        for d in reversed(by):
+            code = (uniques // scales[d]) % 10 if d != "GEOID" else uniques // 100
+            result.insert(0, d, code)
+        if "GEOID" in by:
+            result["GEOID"] = np.char.zfill(result["GEOID"].to_numpy().astype(str), self.levels[level])
+        return result
@@ -0,0 +1,219 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains a static packed Hilbert R-tree over bounding boxes. Items are sorted by the Hilbert code of their box centers
+and packed bottom-up into nodes of node_size children, so the whole tree is two flat arrays (node boxes and leaf item ids) that are saved
+as .npy files and memory-mapped on load. Queries walk the tree level by level with vectorized box tests.
+
+<LICENSE>
+"""
+import json
+import numpy as np
+from pathlib import Path
+
+HILBERT_BITS = 16
+
+
+def hilbert_codes(x, y, bits: int = HILBERT_BITS):
+    """
+    Summary: Hilbert curve index of integer grid coordinates
+    Input:
+        - x, y (array): Grid coordinates in [0, 2**bits)
+        - bits (int): The order of the curve
+    Output:
+        - codes (array): The Hilbert index of each point
+    """
+    x = x.astype(np.int64)
+    y = y.astype(np.int64)
+    codes = np.zeros(x.shape, dtype=np.int64)
+    n = 1 << bits
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        codes += s * s * ((3 * rx) ^ ry)
+
+        # Rotate the quadrant so that the curve stays continuous
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+    return codes
+
+
+class PackedRTree:
+    """
+    Summary: Static packed Hilbert R-tree over item bounding boxes
+    """
+
+    def __init__(self, boxes, item_ids, level_offsets, node_size: int):
+        """
+        Input:
+            - boxes (array): Node boxes (minx, miny, maxx, maxy) of all levels, leaves first
+            - item_ids (array): The item id of each leaf box
+            - level_offsets (list): The start of each level in boxes, plus the total number of boxes
+            - node_size (int): The number of children of each node
+        """
+        self.boxes = boxes
+        self.item_ids = item_ids
+        self.level_offsets = list(level_offsets)
+        self.node_size = node_size
+
+    @classmethod
+    def build(cls, bounds, node_size: int = 16):
+        """
+        Summary: Build the tree from item bounding boxes
+        Input:
+            - bounds (array): n x 4 array of (minx, miny, maxx, maxy)
+            - node_size (int): The number of children of each node
+        Output:
+            - tree (PackedRTree): The tree
+        """
+        bounds = np.asarray(bounds, dtype=np.float64)
+        n_items = bounds.shape[0]
+        if n_items == 0:
+            return cls(np.empty((0, 4)), np.empty(0, dtype=np.int64), [0, 0], node_size)
+
+        with np.errstate(invalid="ignore"):
+            centers_x = (bounds[:, 0] + bounds[:, 2]) / 2
+            centers_y = (bounds[:, 1] + bounds[:, 3]) / 2
+        # Empty boxes (inf, inf, -inf, -inf) match no query; sort them next to the first item
+        valid = np.isfinite(centers_x) & np.isfinite(centers_y)
+        if not valid.any():
+            valid[:] = True
+            centers_x = centers_y = np.zeros(n_items)
+        centers_x = np.where(valid, centers_x, centers_x[valid].min())
+        centers_y = np.where(valid, centers_y, centers_y[valid].min())
+        scale = (1 << HILBERT_BITS) - 1
+        span_x = max(centers_x.max() - centers_x.min(), 1e-12)
+        span_y = max(centers_y.max() - centers_y.min(), 1e-12)
+        grid_x = ((centers_x - centers_x.min()) / span_x * scale).astype(np.int64)
+        grid_y = ((centers_y - centers_y.min()) / span_y * scale).astype(np.int64)
+        order = np.argsort(hilbert_codes(grid_x, grid_y), kind="stable")
+
+        levels = [bounds[order]]
+        while levels[-1].shape[0] > 1:
+            child = levels[-1]
+            starts = np.arange(0, child.shape[0], node_size)
+            levels.append(
+                np.column_stack(
+                    [
+                        np.minimum.reduceat(child[:, 0], starts),
+                        np.minimum.reduceat(child[:, 1], starts),
+                        np.maximum.reduceat(child[:, 2], starts),
+                        np.maximum.reduceat(child[:, 3], starts),
+                    ]
+                )
+            )
+        level_offsets = np.cumsum([0] + [level.shape[0] for level in levels]).tolist()
+        return cls(np.concatenate(levels), order.astype(np.int64), level_offsets, node_size)
+
+    @property
+    def n_items(self):
+        return self.item_ids.shape[0]
+
+    def query(self, minx, miny, maxx, maxy):
+        """
+        Summary: Find the items whose bounding box intersects a box
+        Input:
+            - minx, miny, maxx, maxy (float): The query box
+        Output:
+            - items (array): The ids of the intersecting items, in leaf order
+        """
+        if self.n_items == 0:
+            return np.empty(0, dtype=np.int64)
+
+        n_levels = len(self.level_offsets) - 1
+        nodes = np.zeros(1, dtype=np.int64)
+        for level in range(n_levels - 1, -1, -1):
+            boxes = self.boxes[self.level_offsets[level] + nodes]
+            hit = (boxes[:, 0] <= maxx) & (boxes[:, 2] >= minx) & (boxes[:, 1] <= maxy) & (boxes[:, 3] >= miny)
+            nodes = nodes[hit]
+            if level == 0 or nodes.size == 0:
+                break
+            # Expand each hit node into the range of its children on the level below
+            level_size = self.level_offsets[level] - self.level_offsets[level - 1]
+            children = (nodes[:, None] * self.node_size + np.arange(self.node_size)).ravel()
+            nodes = children[children < level_size]
+        if level != 0:
+            return np.empty(0, dtype=np.int64)
+        return self.item_ids[nodes]
+
+    def query_points(self, x, y, batch_size: int = 8192):
+        """
+        Summary: Find the items whose bounding box contains each point, walking the tree level by level over all (point, node) candidates
+        Input:
+            - x, y (array): The point coordinates
+            - batch_size (int): The number of points walked together (bounds the candidate arrays)
+        Output:
+            - point_idx (array): The position of the point of each match (ascending)
+            - items (array): The id of the matched item (in leaf order within a point)
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        if self.n_items == 0 or x.shape[0] == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        n_levels = len(self.level_offsets) - 1
+        point_idx, items = [], []
+        for start in range(0, x.shape[0], batch_size):
+            points = np.arange(start, min(start + batch_size, x.shape[0]), dtype=np.int64)
+            nodes = np.zeros(points.shape[0], dtype=np.int64)
+            for level in range(n_levels - 1, -1, -1):
+                boxes = self.boxes[self.level_offsets[level] + nodes]
+                px, py = x[points], y[points]
+                hit = (boxes[:, 0] <= px) & (boxes[:, 2] >= px) & (boxes[:, 1] <= py) & (boxes[:, 3] >= py)
+                points, nodes = points[hit], nodes[hit]
+                if level == 0 or nodes.size == 0:
+                    break
+                # Expand each hit node into the range of its children on the level below, keeping its point
+                level_size = self.level_offsets[level] - self.level_offsets[level - 1]
+                children = (nodes[:, None] * self.node_size + np.arange(self.node_size)).ravel()
+                valid = children < level_size
+                points = np.repeat(points, self.node_size)[valid]
+                nodes = children[valid]
+            if level == 0 and nodes.size:
+                # Candidates are ordered by node; group the matches by point
+                order = np.argsort(points, kind="stable")
+                point_idx.append(points[order])
+                items.append(self.item_ids[nodes[order]])
+        if not items:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(point_idx), np.concatenate(items)
+
+    def save(self, path: Path):
+        """
+        Summary: Save the tree as .npy arrays and a JSON header
+        Input:
+            - path (Path): The output directory
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "boxes.npy", np.ascontiguousarray(self.boxes))
+        np.save(path / "item_ids.npy", np.ascontiguousarray(self.item_ids))
+        with open(path / "rtree.json", "w") as f:
+            json.dump({"node_size": self.node_size, "level_offsets": self.level_offsets}, f)
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True):
+        """
+        Summary: Load a saved tree, memory-mapping the arrays by default
+        Input:
+            - path (Path): The directory written by save
+            - mmap (bool): Memory-map the arrays instead of reading them
+        Output:
+            - tree (PackedRTree): The tree
+        """
+        path = Path(path)
+        with open(path / "rtree.json") as f:
+            header = json.load(f)
+        mmap_mode = "r" if mmap else None
+        return cls(
+            np.load(path / "boxes.npy", mmap_mode=mmap_mode),
+            np.load(path / "item_ids.npy", mmap_mode=mmap_mode),
+            header["level_offsets"],
+            header["node_size"],
+        )
@@ -0,0 +1,300 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains a deterministic generator of synthetic HPMS and census data for benchmarking the pipeline without the NTAD and
+TIGER downloads: road link linestrings with HPMS attributes (F_SYSTEM, THROUGH_LANES, AADT, AADT_SINGLE_UNIT, AADT_COMBINATION), county and
+census block polygons with 2020 GEOIDs, and urban area (UAC) polygons, all in USA Contiguous Albers (EPSG:5070). The number of links sets the
+scale (10k to 10M); the study area grows with it so that the link, county and block densities stay constant. The same seed always gives the
+same data.
+
+<LICENSE>
+"""
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+CRS = "EPSG:5070"
+STATE_FIPS = [
+    "01", "02", "04", "05", "06", "08", "09", "10", "11", "12", "13", "15", "16", "17", "18", "19", "20", "21", "22", "23", "24", "25",
+    "26", "27", "28", "29", "30", "31", "32", "33", "34", "35", "36", "37", "38", "39", "40", "41", "42", "44", "45", "46", "47", "48",
+    "49", "50", "51", "53", "54", "55", "56",
+]
+
+# The HPMS sample covers functional systems 1-6 (hpms_2018_fsys123 and hpms_2018_fsys456)
+F_SYSTEM_PROBS = np.array([0.05, 0.03, 0.15, 0.30, 0.35, 0.12])
+AADT_MEDIAN = np.array([40000, 30000, 15000, 6000, 1500, 400])
+MDV_SHARE = np.array([0.05, 0.05, 0.05, 0.04, 0.04, 0.03])
+HDV_SHARE = np.array([0.15, 0.10, 0.06, 0.04, 0.03, 0.02])
+THROUGH_LANES = np.array([4, 4, 3, 2, 2, 2])
+SEGMENT_LENGTH = np.array([800, 600, 400, 300, 250, 200])
+# Share of links with a reported truck count (higher on the national highway system)
+TRUCK_REPORTED = np.array([0.9, 0.6, 0.4, 0.25, 0.15, 0.1])
+
+LINKS_PER_KM2 = 20
+LINKS_PER_COUNTY = 2000
+BLOCKS_PER_LINK = 1.2
+COUNTIES_PER_STATE = 60
+VERTICES_PER_LINK = 4
+
+
+def study_area(n_links: int):
+    """
+    Summary: The side length in meters of the square study area of a scale
+    """
+    return np.sqrt(n_links / LINKS_PER_KM2) * 1000
+
+
+def make_training_frame(n_rows: int, seed: int = 0, reported: bool = False):
+    """
+    Summary: Synthetic rows with the HPMS feature distribution of the AADT imputation (no geometry)
+    Input:
+        - n_rows (int): The number of rows
+        - seed (int): The random seed
+        - reported (bool): Only generate rows with reported truck counts (the training rows of AADTPredictor)
+    Output:
+        - df (DataFrame): STATEFP, COUNTYFP, GEOID, F_SYSTEM, THROUGH_LANES, URBAN, AADT, AADT_MDV, AADT_HDV (NaN where not reported)
+    """
+    rng = np.random.default_rng(seed)
+    # Reported links are drawn from the functional system mix of the reported links
+    probs = F_SYSTEM_PROBS * TRUCK_REPORTED if reported else F_SYSTEM_PROBS
+    f_index = rng.choice(len(F_SYSTEM_PROBS), size=n_rows, p=probs / probs.sum())
+    n_counties = max(4, n_rows // LINKS_PER_COUNTY)
+    county = rng.integers(0, n_counties, n_rows)
+    state = np.array(STATE_FIPS)[(county // COUNTIES_PER_STATE) % len(STATE_FIPS)]
+    countyfp = np.char.zfill((county % COUNTIES_PER_STATE * 2 + 1).astype(str), 3)
+
+    # County-level traffic intensity makes location informative, as in the real data
+    county_effect = rng.normal(0, 0.4, n_counties)[county]
+    aadt = np.round(AADT_MEDIAN[f_index] * np.exp(rng.normal(0, 0.8, n_rows) + county_effect))
+    mdv = np.round(aadt * MDV_SHARE[f_index] * rng.lognormal(0, 0.4, n_rows))
+    hdv = np.round(aadt * HDV_SHARE[f_index] * rng.lognormal(0, 0.5, n_rows))
+    reported = (rng.random(n_rows) < TRUCK_REPORTED[f_index]) | reported
+
+    lanes = THROUGH_LANES[f_index] + rng.choice([-1, 0, 0, 0, 1, 2], size=n_rows)
+    return pd.DataFrame(
+        {
+            "STATEFP": state,
+            "COUNTYFP": countyfp,
+            "GEOID": np.char.add(state, countyfp),
+            "F_SYSTEM": f_index + 1,
+            "THROUGH_LANES": np.maximum(lanes, 1),
+            "URBAN": rng.choice([0, 1, 2], size=n_rows, p=[0.5, 0.4, 0.1]),
+            "AADT": aadt,
+            "AADT_MDV": np.where(reported, mdv, np.nan),
+            "AADT_HDV": np.where(reported, hdv, np.nan),
+        }
+    )
+
+
+def make_counties(n_links: int):
+    """
+    Summary: A grid of county polygons covering the study area, grouped into states
+    Input:
+        - n_links (int): The scale
+    Output:
+        - counties (GeoDataFrame): STATEFP, COUNTYFP, GEOID and geometry
+    """
+    side = study_area(n_links)
+    n_side = max(2, int(np.ceil(np.sqrt(n_links / LINKS_PER_COUNTY))))
+    size = side / n_side
+    col, row = np.meshgrid(np.arange(n_side), np.arange(n_side))
+    col, row = col.ravel(), row.ravel()
+    index = np.arange(col.size)
+    state = np.array(STATE_FIPS)[(index // COUNTIES_PER_STATE) % len(STATE_FIPS)]
+    countyfp = np.char.zfill((index % COUNTIES_PER_STATE * 2 + 1).astype(str), 3)
+    return gpd.GeoDataFrame(
+        {"STATEFP": state, "COUNTYFP": countyfp, "GEOID": np.char.add(state, countyfp)},
+        geometry=shapely.box(col * size, row * size, (col + 1) * size, (row + 1) * size),
+        crs=CRS,
+    )
+
+
+def make_blocks(n_links: int, counties=None):
+    """
+    Summary: Census block polygons (a sub-grid of each county) with 2020 GEOIDs and land area
+    Input:
+        - n_links (int): The scale
+        - counties (GeoDataFrame): The counties of make_counties (generated when not given)
+    Output:
+        - blocks (GeoDataFrame): GEOID20, Area_Land_Orig (square meters) and geometry
+    """
+    counties = make_counties(n_links) if counties is None else counties
+    per_side = max(1, int(round(np.sqrt(n_links * BLOCKS_PER_LINK / len(counties)))))
+    bounds = shapely.bounds(np.asarray(counties.geometry.values))
+    size = (bounds[:, 2] - bounds[:, 0]) / per_side
+
+    sub_col, sub_row = np.meshgrid(np.arange(per_side), np.arange(per_side))
+    sub_col, sub_row = sub_col.ravel(), sub_row.ravel()
+    county_idx = np.repeat(np.arange(len(counties)), sub_col.size)
+    sub_col, sub_row = np.tile(sub_col, len(counties)), np.tile(sub_row, len(counties))
+    x0 = bounds[county_idx, 0] + sub_col * size[county_idx]
+    y0 = bounds[county_idx, 1] + sub_row * size[county_idx]
+
+    # Tracts are rows of blocks within the county; block numbers run along the row
+    tract = np.char.zfill((sub_row + 1).astype(str), 6)
+    block = np.char.zfill((sub_col + 1000).astype(str), 4)
+    geoid = np.char.add(np.char.add(counties["GEOID"].to_numpy().astype(str)[county_idx], tract), block)
+    geometry = shapely.box(x0, y0, x0 + size[county_idx], y0 + size[county_idx])
+    return gpd.GeoDataFrame({"GEOID20": geoid, "Area_Land_Orig": shapely.area(geometry)}, geometry=geometry, crs=CRS)
+
+
+def make_urban_areas(n_links: int, seed: int = 0):
+    """
+    Summary: Round urban area (UAC) polygons: large urbanized areas (U) and small urban clusters (C)
+    Input:
+        - n_links (int): The scale
+        - seed (int): The random seed
+    Output:
+        - uac (GeoDataFrame): UACE10, UATYP10 and geometry
+    """
+    rng = np.random.default_rng(seed + 1)
+    side = study_area(n_links)
+    n_uac = max(1, n_links // (3 * LINKS_PER_COUNTY))
+    urbanized = rng.random(n_uac) < 0.3
+    radius = np.where(urbanized, rng.uniform(0.05, 0.12, n_uac), rng.uniform(0.01, 0.03, n_uac)) * side / np.sqrt(n_uac)
+    centers = shapely.points(rng.uniform(0, side, n_uac), rng.uniform(0, side, n_uac))
+    return gpd.GeoDataFrame(
+        {"UACE10": np.char.zfill(np.arange(1, n_uac + 1).astype(str), 5), "UATYP10": np.where(urbanized, "U", "C")},
+        geometry=shapely.buffer(centers, radius),
+        crs=CRS,
+    )
+
+
+def make_links(n_links: int, seed: int = 0):
+    """
+    Summary: Road link linestrings with HPMS attributes. Missing values follow the HPMS patterns: most links have no truck counts,
+    and a few have no (or zero) AADT or no THROUGH_LANES.
+    Input:
+        - n_links (int): The scale (number of links)
+        - seed (int): The random seed
+    Output:
+        - links (GeoDataFrame): FID_Link_Cnty_Intxn, F_SYSTEM, THROUGH_LANES, AADT, AADT_SINGLE_UNIT, AADT_COMBINATION, Shape_Length and geometry
+    """
+    rng = np.random.default_rng(seed)
+    side = study_area(n_links)
+    f_index = rng.choice(len(F_SYSTEM_PROBS), size=n_links, p=F_SYSTEM_PROBS)
+
+    # A short random walk per link; higher functional systems have longer, straighter segments
+    start = rng.uniform(0, side, (n_links, 1, 2))
+    heading = rng.uniform(0, 2 * np.pi, (n_links, 1)) + np.cumsum(rng.normal(0, 0.3, (n_links, VERTICES_PER_LINK - 1)), axis=1)
+    step = SEGMENT_LENGTH[f_index][:, None] * rng.uniform(0.5, 1.5, (n_links, VERTICES_PER_LINK - 1))
+    steps = np.stack([np.cos(heading) * step, np.sin(heading) * step], axis=2)
+    coords = np.clip(np.concatenate([start, start + np.cumsum(steps, axis=1)], axis=1), 0, side)
+    geometry = shapely.linestrings(coords)
+
+    # Traffic varies smoothly in space, as it does between counties of the real data
+    gx, gy = coords[:, 0, 0] / side, coords[:, 0, 1] / side
+    spatial_effect = 0.3 * np.sin(2 * np.pi * gx * 3) * np.cos(2 * np.pi * gy * 2)
+    aadt = np.round(AADT_MEDIAN[f_index] * np.exp(rng.normal(0, 0.8, n_links) + spatial_effect))
+    aadt[rng.random(n_links) < 0.01] = 0
+    aadt[rng.random(n_links) < 0.01] = np.nan
+    reported = rng.random(n_links) < TRUCK_REPORTED[f_index]
+    lanes = (THROUGH_LANES[f_index] + rng.choice([-1, 0, 0, 0, 1, 2], size=n_links)).astype(np.float64)
+    lanes[rng.random(n_links) < 0.05] = np.nan
+
+    return gpd.GeoDataFrame(
+        {
+            "FID_Link_Cnty_Intxn": np.arange(1, n_links + 1),
+            "F_SYSTEM": f_index + 1,
+            "THROUGH_LANES": np.maximum(lanes, 1),
+            "AADT": aadt,
+            "AADT_SINGLE_UNIT": np.where(reported, np.round(aadt * MDV_SHARE[f_index] * rng.lognormal(0, 0.4, n_links)), np.nan),
+            "AADT_COMBINATION": np.where(reported, np.round(aadt * HDV_SHARE[f_index] * rng.lognormal(0, 0.5, n_links)), np.nan),
+            "Shape_Length": shapely.length(geometry),
+        },
+        geometry=geometry,
+        crs=CRS,
+    )
+
+
+def make_dataset(n_links: int, seed: int = 0):
+    """
+    Summary: Generate all synthetic layers of a scale
+    Input:
+        - n_links (int): The scale (number of road links)
+        - seed (int): The random seed
+    Output:
+        - data (dict): links, counties, uac and blocks GeoDataFrames
+    """
+    counties = make_counties(n_links)
+    return {
+        "links": make_links(n_links, seed),
+        "counties": counties,
+        "uac": make_urban_areas(n_links, seed),
+        "blocks": make_blocks(n_links, counties),
+    }
+
+
+def hpms_county_frame(links, counties):
+    """
+    Summary: The attribute table of HPMS_2018_county_intxn for subset_hpms.py, with each link assigned to the county of its first vertex
+    Input:
+        - links (GeoDataFrame): The links of make_links
+        - counties (GeoDataFrame): The counties of make_counties
+    Output:
+        - hpms (DataFrame): The links with STATEFP, COUNTYFP, GEOID (as strings, like the geodatabase) and URBAN_CODE
+    """
+    first = shapely.get_point(np.asarray(links.geometry.values), 0)
+    point_idx, county_idx = shapely.STRtree(np.asarray(counties.geometry.values)).query(first, predicate="intersects")
+    county = np.zeros(len(links), dtype=np.int64)
+    county[point_idx] = county_idx
+    hpms = pd.DataFrame(links.drop(columns="geometry"))
+    for field in ["STATEFP", "COUNTYFP", "GEOID"]:
+        hpms[field] = counties[field].to_numpy()[county]
+    hpms["URBAN_CODE"] = 99999.0
+    return hpms
+
+
+def hpms_uac_frame(links, uac):
+    """
+    Summary: The attribute table of HPMS_2018_cnty_uac_join for subset_hpms.py (first urban area containing each link's first vertex)
+    Input:
+        - links (GeoDataFrame): The links of make_links
+        - uac (GeoDataFrame): The urban areas of make_urban_areas
+    Output:
+        - hpms_uac (DataFrame): FID_Link_Cnty_Intxn, UACE10 and UATYP10
+    """
+    first = shapely.get_point(np.asarray(links.geometry.values), 0)
+    point_idx, uac_idx = shapely.STRtree(np.asarray(uac.geometry.values)).query(first, predicate="intersects")
+    point_idx, keep = np.unique(point_idx, return_index=True)
+    hpms_uac = pd.DataFrame({"FID_Link_Cnty_Intxn": links["FID_Link_Cnty_Intxn"].to_numpy(), "UACE10": None, "UATYP10": None})
+    hpms_uac.loc[point_idx, "UACE10"] = uac["UACE10"].to_numpy()[uac_idx[keep]]
+    hpms_uac.loc[point_idx, "UATYP10"] = uac["UATYP10"].to_numpy()[uac_idx[keep]]
+    return hpms_uac
+
+
+def link_network(links, counties):
+    """
+    Summary: The links in the schema of hpms_aadt_imputation.parquet (imputed truck AADT, VKT / VMT by vehicle class) for the density stages
+    Input:
+        - links (GeoDataFrame): The links of make_links
+        - counties (GeoDataFrame): The counties of make_counties
+    Output:
+        - network (GeoDataFrame): FID_Link_Cnty_Intxn, STATEFP, F_SYSTEM, URBAN, Shape_Length_New, VKT_* and VMT_* fields and geometry
+    """
+    hpms = hpms_county_frame(links, counties)
+    f_index = hpms["F_SYSTEM"].to_numpy() - 1
+    aadt = np.nan_to_num(hpms["AADT"].to_numpy())
+    mdv = np.where(np.isnan(hpms["AADT_SINGLE_UNIT"]), aadt * MDV_SHARE[f_index], hpms["AADT_SINGLE_UNIT"])
+    hdv = np.where(np.isnan(hpms["AADT_COMBINATION"]), aadt * HDV_SHARE[f_index], hpms["AADT_COMBINATION"])
+
+    length = shapely.length(np.asarray(links.geometry.values))
+    network = gpd.GeoDataFrame(
+        {
+            "FID_Link_Cnty_Intxn": hpms["FID_Link_Cnty_Intxn"].to_numpy(),
+            "STATEFP": hpms["STATEFP"].to_numpy(),
+            "F_SYSTEM": hpms["F_SYSTEM"].to_numpy(),
+            "URBAN": np.zeros(len(hpms), dtype=np.int64),
+            "Shape_Length_New": length,
+        },
+        geometry=links.geometry.values,
+        crs=links.crs,
+    )
+    for unit, meters in [("VKT", 1000), ("VMT", 1609.34)]:
+        network[f"{unit}_TOTAL"] = aadt * length / meters
+        network[f"{unit}_MDV"] = mdv * length / meters
+        network[f"{unit}_HDV"] = hdv * length / meters
+        network[f"{unit}_LDV"] = network[f"{unit}_TOTAL"] - network[f"{unit}_MDV"] - network[f"{unit}_HDV"]
+    return network
@@ -0,0 +1,342 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the instrumentation layer of the pipeline. Stages are wrapped with the stage context manager or the instrument
+decorator; each stage records its wall time, CPU time (of all threads of the process), peak RSS (sampled by one background thread while stages
+are open), rows in / out and throughput as one JSON line. Telemetry is enabled by setting HPMS_TELEMETRY to the path of the JSON lines file
+(or by calling configure; unset or 0 disables it); when it is disabled the hooks only check one attribute and call straight through. Worker
+processes inherit the setting and the run id, so their stages land in the same file. summary reads the file back into a per-stage report of
+where a run spent its time.
+
+<LICENSE>
+"""
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+import psutil
+
+ENV_VAR = "HPMS_TELEMETRY"
+RUN_ENV_VAR = "HPMS_TELEMETRY_RUN"
+PID_ENV_VAR = "HPMS_TELEMETRY_MAIN_PID"
+# Seconds between two RSS samples while a stage is open
+SAMPLE_INTERVAL = 0.05
+
+
+class _Telemetry:
+    """
+    Summary: The process-wide telemetry state: output path, run id, open stages and the RSS sampler
+    """
+
+    def __init__(self):
+        self.path = None
+        self.run_id = None
+        self.main_pid = None
+        # Stages are timed when records are written or a listener (e.g. utils.metrics) is registered
+        self.active = False
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.open_stages = set()
+        self.local = threading.local()
+        self.sampler_pid = None
+        self.wake = threading.Event()
+
+    def start_sampler(self):
+        # The sampler thread does not survive a fork, so each process starts its own
+        if self.sampler_pid == os.getpid():
+            return
+        self.sampler_pid = os.getpid()
+        self.process = psutil.Process()
+        threading.Thread(target=self._sample, daemon=True).start()
+
+    def _sample(self):
+        while True:
+            self.wake.wait()
+            rss = self.process.memory_info().rss
+            with self.lock:
+                for stage in self.open_stages:
+                    stage.peak = max(stage.peak, rss)
+                if not self.open_stages:
+                    self.wake.clear()
+            time.sleep(SAMPLE_INTERVAL)
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+
+
+_STATE = _Telemetry()
+
+
+def configure(path=None, run_id: str = None, main_pid: int = None):
+    """
+    Summary: Enable telemetry to a JSON lines file, or disable it (path None)
+    Input:
+        - path (Path): The JSON lines file the stage records are appended to
+        - run_id (str): The id of this run (defaults to the start time and process id)
+        - main_pid (int): The process id of the run's main process (defaults to this process; set for the worker processes)
+    """
+    if path is None:
+        _STATE.path = None
+        _STATE.active = bool(_STATE.listeners)
+        os.environ.pop(ENV_VAR, None)
+        os.environ.pop(PID_ENV_VAR, None)
+        return
+    _STATE.path = Path(path)
+    _STATE.active = True
+    _STATE.path.parent.mkdir(parents=True, exist_ok=True)
+    _STATE.run_id = run_id or f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+    _STATE.main_pid = main_pid or os.getpid()
+    # Worker processes read the same settings from the environment
+    os.environ[ENV_VAR] = str(_STATE.path)
+    os.environ[RUN_ENV_VAR] = _STATE.run_id
+    os.environ[PID_ENV_VAR] = str(_STATE.main_pid)
+
+
+def enabled():
+    """
+    Summary: Whether telemetry is enabled
+    """
+    return _STATE.path is not None
+
+
+def add_listener(listener):
+    """
+    Summary: Call listener(event, stage) when a stage starts ("start") and ends ("end"), whether or not records are written
+    Input:
+        - listener: The callable; it must be fast and must not raise
+    """
+    _STATE.listeners.append(listener)
+    _STATE.active = True
+
+
+def n_rows(obj):
+    """
+    Summary: The number of rows of a frame, array or sized object (None otherwise)
+    """
+    shape = getattr(obj, "shape", None)
+    if shape:
+        return int(shape[0])
+    try:
+        return len(obj)
+    except TypeError:
+        return None
+
+
+class Stage:
+    """
+    Summary: One instrumented stage. Set rows_out (and optionally rows_in) inside the with block; extra fields are written with the record.
+    """
+
+    def __init__(self, name: str, rows_in=None, **fields):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.fields = fields
+
+    def __enter__(self):
+        stack = getattr(_STATE.local, "stack", None)
+        if stack is None:
+            stack = _STATE.local.stack = []
+        self.parent = stack[-1].name if stack else None
+        self.depth = len(stack)
+        stack.append(self)
+
+        self.start_time = datetime.now()
+        self.rss_start = psutil.Process().memory_info().rss
+        self.peak = self.rss_start
+        _STATE.start_sampler()
+        with _STATE.lock:
+            _STATE.open_stages.add(self)
+        _STATE.wake.set()
+        for listener in _STATE.listeners:
+            listener("start", self)
+        self.cpu_start = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = self.wall_s = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu_start
+        rss_end = psutil.Process().memory_info().rss
+        with _STATE.lock:
+            _STATE.open_stages.discard(self)
+        _STATE.local.stack.pop()
+        for listener in _STATE.listeners:
+            listener("end", self)
+        if _STATE.path is None:
+            return False
+
+        rows = self.rows_out if self.rows_out is not None else self.rows_in
+        _STATE.write(
+            {
+                "run_id": _STATE.run_id,
+                "pid": os.getpid(),
+                "main_pid": _STATE.main_pid,
+                "stage": self.name,
+                "parent": self.parent,
+                "depth": self.depth,
+                "start": self.start_time.isoformat(timespec="milliseconds"),
+                "wall_s": wall,
+                "cpu_s": cpu,
+                "rss_start_mb": self.rss_start / 1024**2,
+                "rss_end_mb": rss_end / 1024**2,
+                "peak_rss_mb": max(self.peak, rss_end) / 1024**2,
+                "rows_in": self.rows_in,
+                "rows_out": self.rows_out,
+                "rows_per_s": rows / wall if rows is not None and wall > 0 else None,
+                "status": "ok" if exc_type is None else f"error: {exc_type.__name__}",
+                **self.fields,
+            }
+        )
+        return False
+
+
+class _NullStage:
+    """
+    Summary: The stage returned when telemetry is disabled; it ignores everything
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str, rows_in=None, **fields):
+    """
+    Summary: Context manager timing a stage
+    Input:
+        - name (str): The stage name (e.g. load, fit, intersect)
+        - rows_in (int): The number of input rows
+        - **fields: Extra fields of the record (e.g. response_var)
+    Output:
+        - stage (Stage): Set its rows_out inside the with block
+    """
+    if not _STATE.active:
+        return _NULL_STAGE
+    return Stage(name, rows_in, **fields)
+
+
+def _safe_count(count, *args, **kwargs):
+    # A failing row count must never break the instrumented code
+    try:
+        return count(*args, **kwargs)
+    except Exception:
+        return None
+
+
+def instrument(name: str = None, rows_in=None, rows_out=None):
+    """
+    Summary: Decorator timing every call of a function or method as a stage
+    Input:
+        - name (str): The stage name (defaults to the qualified function name)
+        - rows_in: Callable receiving the call arguments and returning the number of input rows
+        - rows_out: Callable receiving the return value followed by the call arguments and returning the number of output rows
+    Output:
+        - decorator
+    """
+
+    def decorator(fn):
+        stage_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _STATE.active:
+                return fn(*args, **kwargs)
+            with Stage(stage_name, _safe_count(rows_in, *args, **kwargs) if rows_in else None) as record:
+                result = fn(*args, **kwargs)
+                if rows_out is not None:
+                    record.rows_out = _safe_count(rows_out, result, *args, **kwargs)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def load_records(path):
+    """
+    Summary: Read the stage records of a telemetry file
+    """
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def summary(records, run_id: str = None):
+    """
+    Summary: Where a run spent its time, by stage
+    Input:
+        - records (DataFrame): The stage records (see load_records)
+        - run_id (str): The run to summarize (defaults to the last run in the records)
+    Output:
+        - report (DataFrame): Calls, total wall / CPU time, share of the run's wall time, peak RSS, rows and throughput of each stage,
+          slowest first
+    """
+    if records.empty:
+        return records
+    run_id = run_id or records["run_id"].iloc[-1]
+    run = records[records["run_id"] == run_id].copy()
+    for column in ["rows_in", "rows_out"]:
+        run[column] = pd.to_numeric(run[column], errors="coerce")
+
+    # The run's wall time is the span of its top-level stages in the main process; stages of worker processes (e.g. fit_state,
+    # intersect_tile) are also at depth 0 in their own process but overlap the main process's stages. Records written without
+    # main_pid take the process of the first top-level stage to start.
+    top = run[run["depth"] == 0]
+    if not top.empty:
+        if "main_pid" in top and top["main_pid"].notna().any():
+            main_pid = top["main_pid"].dropna().iloc[0]
+        else:
+            main_pid = top.sort_values("start")["pid"].iloc[0]
+        top = top[top["pid"] == main_pid]
+    run_wall = top["wall_s"].sum() if not top.empty else run["wall_s"].sum()
+    report = run.groupby("stage", sort=False).agg(
+        calls=("wall_s", "size"),
+        wall_s=("wall_s", "sum"),
+        cpu_s=("cpu_s", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+        rows_in=("rows_in", lambda s: s.sum(min_count=1)),
+        rows_out=("rows_out", lambda s: s.sum(min_count=1)),
+        errors=("status", lambda s: int((s != "ok").sum())),
+    )
+    report["share"] = report["wall_s"] / run_wall if run_wall > 0 else float("nan")
+    rows = report["rows_out"].where(report["rows_out"] > 0, report["rows_in"])
+    report["rows_per_s"] = rows / report["wall_s"].where(report["wall_s"] > 0)
+    report.attrs = {"run_id": run_id, "wall_s": run_wall}
+    return report.sort_values("wall_s", ascending=False).reset_index()
+
+
+def print_summary(path=None, run_id: str = None):
+    """
+    Summary: Print the summary of a run (by default the current run of the enabled telemetry file; no-op when telemetry is disabled)
+    """
+    path = path or _STATE.path
+    if path is None or not Path(path).exists():
+        return
+    report = summary(load_records(path), run_id or (_STATE.run_id if path == _STATE.path else None))
+    if report.empty:
+        return
+    print(f"Telemetry of run {report.attrs['run_id']} ({report.attrs['wall_s']:.1f}s in top-level stages):")
+    print(report.to_string(index=False, float_format=lambda x: f"{x:.3f}"), flush=True)
+
+
+# Enable from the environment, inheriting the run id of the parent process
+if os.environ.get(ENV_VAR, "") not in ("", "0"):
+    configure(os.environ[ENV_VAR], os.environ.get(RUN_ENV_VAR), int(os.environ.get(PID_ENV_VAR) or 0) or None)
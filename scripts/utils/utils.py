@@ -4,6 +4,7 @@ import sys
 import zipfile
 import os
 import geopandas as gpd
+from utils.telemetry import instrument, n_rows
 
 def download_file(url: str, storage_dir: Path):
     '''
@@ -47,6 +48,7 @@ def get_state_fips(blocks_dir: Path):
 
     return state_fips
 
+@instrument("load", rows_out=lambda result, *args, **kwargs: n_rows(result))
 def load_data(gdb, layer):
     '''
     Summary: Load data from the geodatabase
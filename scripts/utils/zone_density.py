@@ -0,0 +1,216 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script contains the traffic density engine for arbitrary polygon zones (school catchments, monitor radii, custom grids).
+The imputed HPMS road links are indexed once into a RoadIndex (link WKB, VKT by vehicle class and a packed Hilbert R-tree of the link bounds)
+that is cached on disk and memory-mapped by the worker processes. Zones are processed in batches on a process pool: each zone's candidate
+links come from the R-tree, are clipped with vectorized Shapely, and contribute their VKT in proportion to the clipped share of their length.
+
+<LICENSE>
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from utils.spatial_index import PackedRTree
+from utils import metrics
+
+VEHICLE_TYPES = ["VKT", "VKT_LDV", "VKT_MDV", "VKT_HDV"]
+# The VKT fields of hpms_aadt_imputation.parquet, in the order of VEHICLE_TYPES
+LINK_VKT_FIELDS = ["VKT_TOTAL", "VKT_LDV", "VKT_MDV", "VKT_HDV"]
+
+
+class RoadIndex:
+    """
+    Summary: Disk-cached spatial index of the road links with their VKT by vehicle class
+    """
+
+    def __init__(self, path: Path, vkt, link_length, crs: str, rtree: PackedRTree):
+        """
+        Input:
+            - path (Path): The cache directory
+            - vkt (array): n_links x 4 VKT in the order of VEHICLE_TYPES
+            - link_length (array): The length of each link
+            - crs (str): The CRS of the link geometry (WKT)
+            - rtree (PackedRTree): The R-tree over the link bounds
+        """
+        self.path = Path(path)
+        self.vkt = vkt
+        self.link_length = link_length
+        self.crs = crs
+        self.rtree = rtree
+        self._wkb = None
+
+    @staticmethod
+    def _fingerprint(links_path: Path):
+        stat = Path(links_path).stat()
+        return {"source": str(Path(links_path).resolve()), "size": stat.st_size, "mtime": stat.st_mtime}
+
+    @classmethod
+    def build(cls, links_path: Path, path: Path, crs=None):
+        """
+        Summary: Build the index of a road link GeoParquet file (e.g. hpms_aadt_imputation.parquet) and write it to path
+        Input:
+            - links_path (Path): The road link GeoParquet file with the VKT fields
+            - path (Path): The cache directory
+            - crs: The projected CRS to index in (defaults to the CRS of the links, which must be projected)
+        Output:
+            - index (RoadIndex): The opened index
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        links = gpd.read_parquet(links_path, columns=LINK_VKT_FIELDS + ["geometry"])
+        if crs is not None:
+            links = links.to_crs(crs)
+        if not links.crs.is_projected:
+            raise ValueError("The road links must be indexed in a projected CRS (e.g. EPSG:5070)")
+
+        geoms = np.asarray(links.geometry.values)
+        np.save(path / "vkt.npy", np.nan_to_num(links[LINK_VKT_FIELDS].to_numpy(dtype=np.float64)))
+        np.save(path / "link_length.npy", shapely.length(geoms))
+        pq.write_table(pa.table({"geometry": shapely.to_wkb(geoms)}), path / "geometry.parquet")
+        PackedRTree.build(shapely.bounds(geoms)).save(path / "rtree")
+        with open(path / "road_index.json", "w") as f:
+            json.dump({"crs": links.crs.to_wkt(), **cls._fingerprint(links_path)}, f)
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path: Path):
+        """
+        Summary: Open a cached index (arrays memory-mapped)
+        Input:
+            - path (Path): The cache directory
+        Output:
+            - index (RoadIndex): The index
+        """
+        path = Path(path)
+        with open(path / "road_index.json") as f:
+            header = json.load(f)
+        return cls(
+            path,
+            np.load(path / "vkt.npy", mmap_mode="r"),
+            np.load(path / "link_length.npy", mmap_mode="r"),
+            header["crs"],
+            PackedRTree.load(path / "rtree"),
+        )
+
+    @classmethod
+    def load_or_build(cls, links_path: Path, path: Path, crs=None):
+        """
+        Summary: Open the cached index if it was built from the current links file, otherwise rebuild it
+        Input:
+            - links_path (Path): The road link GeoParquet file
+            - path (Path): The cache directory
+            - crs: The projected CRS to index in
+        Output:
+            - index (RoadIndex): The index
+        """
+        header_path = Path(path) / "road_index.json"
+        if header_path.exists():
+            with open(header_path) as f:
+                header = json.load(f)
+            if all(header.get(k) == v for k, v in cls._fingerprint(links_path).items()):
+                print(f"Using the cached road index in {path}", flush=True)
+                return cls.open(path)
+        print(f"Building the road index in {path}...", flush=True)
+        return cls.build(links_path, path, crs)
+
+    @property
+    def wkb(self):
+        # The link geometry is kept as an Arrow binary column; only the candidate links of a zone are decoded
+        if self._wkb is None:
+            self._wkb = pq.read_table(self.path / "geometry.parquet", memory_map=True).column("geometry").combine_chunks()
+        return self._wkb
+
+    def zone_vkt(self, zone_geoms):
+        """
+        Summary: The VKT by vehicle class inside each zone, apportioned by the clipped share of each link's length
+        Input:
+            - zone_geoms (array): The zone polygons, in the CRS of the index
+        Output:
+            - vkt (array): n_zones x 4 VKT in the order of VEHICLE_TYPES
+        """
+        vkt = np.zeros((len(zone_geoms), len(VEHICLE_TYPES)), dtype=np.float64)
+        bounds = shapely.bounds(zone_geoms)
+        for i, zone in enumerate(zone_geoms):
+            if zone is None or shapely.is_empty(zone):
+                continue
+            links = np.sort(self.rtree.query(*bounds[i]))
+            if links.size == 0:
+                continue
+            geoms = shapely.from_wkb(self.wkb.take(pa.array(links)).to_numpy(zero_copy_only=False))
+            shapely.prepare(zone)
+            clipped = np.zeros(links.size, dtype=np.float64)
+            inside = shapely.contains(zone, geoms)
+            crossing = ~inside & shapely.intersects(zone, geoms)
+            clipped[inside] = self.link_length[links[inside]]
+            clipped[crossing] = shapely.length(shapely.intersection(geoms[crossing], zone))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                share = np.nan_to_num(np.clip(clipped / self.link_length[links], 0, 1))
+            vkt[i] = share @ self.vkt[links]
+        return vkt
+
+
+# The RoadIndex of a worker process, opened once by the pool initializer
+_WORKER_INDEX = None
+
+
+def _init_worker(index_path):
+    global _WORKER_INDEX
+    _WORKER_INDEX = RoadIndex.open(index_path)
+
+
+def _zone_batch(start, wkb):
+    return start, _WORKER_INDEX.zone_vkt(shapely.from_wkb(wkb))
+
+
+def zone_density(zones, index: RoadIndex, radius: float = None, batch_size: int = 500, n_workers: int = None):
+    """
+    Summary: Traffic density (VKT per square kilometer) by vehicle class of arbitrary zones
+    Input:
+        - zones (GeoDataFrame): The zone polygons (or points, with radius) and their attributes
+        - index (RoadIndex): The road index
+        - radius (float): Buffer the zones by this distance in meters first (e.g. monitor radii around points)
+        - batch_size (int): The number of zones per task
+        - n_workers (int): The number of worker processes (defaults to the number of CPUs; 1 runs in this process)
+    Output:
+        - density (DataFrame): The zone attributes, VKT_* sums, Area_km2 and TD_VKT_* densities
+    """
+    zone_geoms = np.asarray(zones.to_crs(index.crs).geometry.values)
+    if radius is not None:
+        zone_geoms = shapely.buffer(zone_geoms, radius)
+    n_zones = len(zone_geoms)
+    vkt = np.zeros((n_zones, len(VEHICLE_TYPES)), dtype=np.float64)
+
+    n_workers = n_workers or os.cpu_count()
+    if n_workers == 1:
+        vkt[:] = index.zone_vkt(zone_geoms)
+    else:
+        print(f"Computing the density of {n_zones} zones on {n_workers} processes...", flush=True)
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(index.path,)) as executor:
+            futures = [
+                executor.submit(_zone_batch, start, shapely.to_wkb(zone_geoms[start : start + batch_size]))
+                for start in range(0, n_zones, batch_size)
+            ]
+            metrics.set_progress(0, len(futures))
+            for i, future in enumerate(as_completed(futures), 1):
+                metrics.set_progress(i, len(futures))
+                start, batch_vkt = future.result()
+                vkt[start : start + batch_vkt.shape[0]] = batch_vkt
+
+    area_km2 = shapely.area(zone_geoms) / 10**6
+    density = pd.DataFrame(zones.drop(columns=zones.geometry.name)).reset_index(drop=True)
+    for j, vehicle_type in enumerate(VEHICLE_TYPES):
+        density[vehicle_type] = vkt[:, j]
+    density["Area_km2"] = area_km2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for j, vehicle_type in enumerate(VEHICLE_TYPES):
+            density[f"TD_{vehicle_type}"] = np.nan_to_num(vkt[:, j] / area_km2, nan=0.0, posinf=0.0)
+    return density
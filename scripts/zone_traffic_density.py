@@ -0,0 +1,42 @@
+"""
+HPMS Data Paper
+by Aviral Chawla, Meg Fay, and Britanny Antonczak
+
+Summary: This script computes traffic density (VKT per square kilometer by vehicle class) for any user polygon layer, such as school
+catchments, monitor radii or custom grids, directly from the imputed HPMS road links. The road link index is built once and cached next to
+hpms_aadt_imputation.parquet; later runs reuse it.
+
+<LICENSE>
+"""
+import argparse
+import geopandas as gpd
+from pathlib import Path
+from utils.zone_density import RoadIndex, zone_density
+
+parser = argparse.ArgumentParser(description="Traffic density of user polygons")
+parser.add_argument('zones', type=Path, help='Polygon (or point) layer readable by GeoPandas')
+parser.add_argument('output', type=Path, help='Output table (.parquet or .csv)')
+parser.add_argument('--layer', default=None, help='Layer of the zones file')
+parser.add_argument('--radius', type=float, default=None, help='Buffer the zones by this distance in meters (e.g. monitor radii around points)')
+parser.add_argument('--batch-size', type=int, default=500, help='Number of zones per task')
+parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+
+def main():
+    args = parser.parse_args()
+
+    HPMS_DIR = Path('../data/processed_data/HPMS')
+    HPMS_PARQUET = HPMS_DIR / 'hpms_aadt_imputation.parquet'
+    INDEX_DIR = HPMS_DIR / 'road_index'
+
+    index = RoadIndex.load_or_build(HPMS_PARQUET, INDEX_DIR, crs='EPSG:5070')
+    zones = gpd.read_file(args.zones, layer=args.layer, engine='pyogrio')
+    density = zone_density(zones, index, radius=args.radius, batch_size=args.batch_size, n_workers=args.workers)
+
+    if args.output.suffix == '.csv':
+        density.to_csv(args.output, index=False)
+    else:
+        density.to_parquet(args.output, index=False)
+    print(f'Wrote the traffic density of {len(density)} zones to:\n{args.output}', flush=True)
+
+if __name__ == '__main__':
+    main()